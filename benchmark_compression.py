@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Response compression benchmark
+Measures payload size, compression time and estimated transfer time for typical API responses
+Usage: python benchmark_compression.py [rows]
+"""
+
+import sys
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from compression import compress, brotli
+
+LINK_SPEEDS_MBPS = (10, 50)
+
+
+def query_payload(rows: int) -> bytes:
+    start = datetime(2025, 3, 10, tzinfo=timezone.utc)
+    results = [
+        {
+            "id": i,
+            "machine_code": f"CNC-{i % 250:03d}",
+            "shift_name": ("Day", "Night", "Afternoon")[i % 3],
+            "actual_units": (i * 7919) % 1000,
+            "planned_units": 1000,
+            "start_timestamp": (start + timedelta(minutes=i)).isoformat(timespec="milliseconds"),
+        }
+        for i in range(rows)
+    ]
+    return json.dumps({"sql_query": "SELECT ...", "results": results, "success": True}).encode()
+
+
+def measure(label: str, body: bytes):
+    encodings = [("identity", None), ("gzip", 6)] + ([("br", 5)] if brotli else [])
+    for encoding, level in encodings:
+        started = time.perf_counter()
+        encoded = body if encoding == "identity" else compress(body, encoding, level)
+        compress_ms = (time.perf_counter() - started) * 1000
+        transfer = " | ".join(
+            f"{mbps}Mbps {len(encoded) * 8 / (mbps * 1e6) * 1000 + compress_ms:7.1f}ms" for mbps in LINK_SPEEDS_MBPS
+        )
+        print(f"{label:<18} {encoding:<8} {len(encoded):>9} B  compress {compress_ms:6.2f}ms  | {transfer}")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print("=== Response Compression Benchmark ===")
+    measure(f"query {rows} rows", query_payload(rows))
+    for path in ("static/script.js", "static/style.css"):
+        with open(path, "rb") as asset:
+            measure(path, asset.read())
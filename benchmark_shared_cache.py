@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Shared cache benchmark
+Compares per-worker in-memory caches with the shared SQLite cache at 1 and N workers
+Usage: python benchmark_shared_cache.py [workers] [requests_per_worker]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import statistics
+from multiprocessing import Pool
+
+from shared_cache import SharedCache
+
+KEY_SPACE = 500
+PAYLOAD = [{"machine_id": i, "actual_units": i * 10, "start_timestamp": "2025-03-10T09:46:40.541+00:00"} for i in range(50)]
+
+
+def _zipf_key(rng: random.Random) -> str:
+    # Skewed popularity, like repeated dashboard and sample questions
+    return f"query-{min(int(rng.paretovariate(1.2)), KEY_SPACE)}"
+
+
+def _run_worker(args):
+    worker_id, requests, cache_path = args
+    rng = random.Random(worker_id)
+    cache = SharedCache(path=cache_path) if cache_path else None
+    local = {}
+    hits, latencies = 0, []
+
+    for _ in range(requests):
+        key = _zipf_key(rng)
+        start = time.perf_counter()
+        value = cache.get_sync("bench", key) if cache else local.get(key)
+        latencies.append(time.perf_counter() - start)
+        if value is not None:
+            hits += 1
+        elif cache:
+            cache.set_sync("bench", key, PAYLOAD, ttl=300)
+        else:
+            local[key] = PAYLOAD
+
+    if cache:
+        cache.close()
+    return hits, latencies
+
+
+def run(workers: int, requests: int, shared: bool):
+    cache_path = None
+    if shared:
+        cache_path = os.path.join(tempfile.mkdtemp(), "bench-cache.sqlite3")
+        SharedCache(path=cache_path).close()
+
+    with Pool(workers) as pool:
+        outcomes = pool.map(_run_worker, [(i, requests, cache_path) for i in range(workers)])
+
+    hits = sum(h for h, _ in outcomes)
+    latencies = sorted(l for _, ls in outcomes for l in ls)
+    total = workers * requests
+    label = "shared" if shared else "per-worker"
+    print(
+        f"{label:>10} | workers={workers:<2} | hit rate {hits / total:6.1%} | "
+        f"p50 {statistics.median(latencies) * 1e6:7.1f}us | p99 {latencies[int(len(latencies) * 0.99)] * 1e6:7.1f}us"
+    )
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 4
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    print("=== Shared Cache Benchmark ===")
+    for worker_count in (1, workers):
+        run(worker_count, requests, shared=False)
+        run(worker_count, requests, shared=True)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Startup time benchmark
+Starts the app in a fresh process and measures import time, time until it serves and time until /ready
+Usage: python benchmark_startup.py [runs] [port]
+"""
+
+import sys
+import json
+import time
+import subprocess
+import urllib.request
+import urllib.error
+from typing import Optional, Tuple
+
+
+def import_ms() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def get(url: str) -> Tuple[Optional[int], Optional[dict]]:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None, None
+
+
+def measure_run(port: int, timeout: float = 120) -> dict:
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    serving_ms = ready_ms = None
+    status = None
+    try:
+        while time.perf_counter() - started < timeout and server.poll() is None:
+            if serving_ms is None and get(f"http://127.0.0.1:{port}/health")[0] == 200:
+                serving_ms = (time.perf_counter() - started) * 1000
+            if serving_ms is not None:
+                code, status = get(f"http://127.0.0.1:{port}/ready")
+                if code == 200:
+                    ready_ms = (time.perf_counter() - started) * 1000
+                    break
+            time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+    return {"serving_ms": serving_ms, "ready_ms": ready_ms, "phases": (status or {}).get("phases", {})}
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5055
+
+    print("=== Startup Benchmark ===")
+    print(f"import main: {import_ms():.0f}ms")
+    for run in range(1, runs + 1):
+        result = measure_run(port)
+        if result["serving_ms"] is None:
+            print(f"run {run}: failed to start - is the database reachable?")
+            continue
+        if result["ready_ms"] is None:
+            print(f"run {run}: serving {result['serving_ms']:.0f}ms but never ready")
+            continue
+        phases = "  ".join(f"{name} {phase.get('ms', '?')}ms" for name, phase in result["phases"].items())
+        print(f"run {run}: serving {result['serving_ms']:.0f}ms  ready {result['ready_ms']:.0f}ms  | {phases}")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Precompress static assets
+Writes .gz (and .br when the brotli module is installed) next to each text asset in static/,
+served by PrecompressedStaticFiles without per-request compression (the app also runs this at startup)
+Variants newer than their source are kept; others are replaced atomically, so running workers never serve a partial file
+Usage: python build_static.py [static_dir]
+"""
+
+import os
+import sys
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.html', '.svg', '.json', '.txt')
+
+
+def write_atomically(path: str, data: bytes):
+    """Replace path in one step, so a server reading it never sees a partial file"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as target:
+        target.write(data)
+    os.replace(temp_path, path)
+
+
+def is_up_to_date(path: str, variant_path: str) -> bool:
+    try:
+        return os.stat(variant_path).st_mtime >= os.stat(path).st_mtime
+    except OSError:
+        return False
+
+
+def build(static_dir: str, verbose: bool = True):
+    total_raw = total_gz = total_br = 0
+    up_to_date = 0
+    for root, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            # Every worker runs this at startup; only the first one after a change does the work
+            if is_up_to_date(path, path + '.gz') and (not brotli or is_up_to_date(path, path + '.br')):
+                up_to_date += 1
+                continue
+            with open(path, 'rb') as source:
+                data = source.read()
+
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            write_atomically(path + '.gz', gz)
+            line = f"{os.path.relpath(path, static_dir):<24} {len(data):>8} B  gzip {len(gz):>7} B"
+            total_raw += len(data)
+            total_gz += len(gz)
+
+            if brotli:
+                br = brotli.compress(data, quality=11)
+                write_atomically(path + '.br', br)
+                line += f"  br {len(br):>7} B"
+                total_br += len(br)
+            if verbose:
+                print(line)
+
+    if total_raw and verbose:
+        print(f"\nTotal {total_raw} B -> gzip {total_gz} B ({total_gz / total_raw:.1%})", end="")
+        print(f", br {total_br} B ({total_br / total_raw:.1%})" if brotli else " (install brotli for .br)")
+    if up_to_date and verbose:
+        print(f"{up_to_date} file(s) already up to date")
+
+
+if __name__ == "__main__":
+    build(sys.argv[1] if len(sys.argv) > 1 else "static")
@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+# Process-wide counters for GET /api/admin/cancellations
+cancellation_stats: Dict[str, Any] = {
+    'client_disconnects': 0,
+    'llm_calls_cancelled': 0,
+    # Cancelled while queued in the rate limiter: no request was sent and no quota was spent
+    'llm_calls_cancelled_queued': 0,
+    'llm_seconds_cancelled': 0.0,
+    'queries_cancelled': 0,
+    # Cancelled while waiting for a pool connection: the statement never ran
+    'queries_cancelled_waiting': 0,
+    'query_seconds_cancelled': 0.0
+}
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the response was ready"""
+
+
+def record_llm_cancelled(started: float, queued: bool):
+    cancellation_stats['llm_calls_cancelled'] += 1
+    if queued:
+        cancellation_stats['llm_calls_cancelled_queued'] += 1
+    cancellation_stats['llm_seconds_cancelled'] += time.monotonic() - started
+
+
+def record_query_cancelled(started: float, running: bool):
+    cancellation_stats['queries_cancelled'] += 1
+    if not running:
+        cancellation_stats['queries_cancelled_waiting'] += 1
+    cancellation_stats['query_seconds_cancelled'] += time.monotonic() - started
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable, poll_interval: Optional[float] = None) -> Any:
+    """Await `awaitable` as a task, cancelling it as soon as the client disconnects.
+
+    Cancellation reaches the Groq call (the aiohttp request is aborted) and the asyncpg statement
+    (asyncpg sends a server-side cancel request before the connection returns to the pool).
+    Raises ClientDisconnected once the cancelled work has unwound.
+    """
+    interval = poll_interval or float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                cancellation_stats['client_disconnects'] += 1
+                logger.info(f"Client disconnected from {request.url.path}, cancelling in-flight work")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected()
+    finally:
+        # The handler itself was cancelled (e.g. shutdown)
+        if not task.done():
+            task.cancel()
+
+
+def get_cancellation_stats() -> Dict[str, Any]:
+    return {
+        **cancellation_stats,
+        'llm_seconds_cancelled': round(cancellation_stats['llm_seconds_cancelled'], 3),
+        'query_seconds_cancelled': round(cancellation_stats['query_seconds_cancelled'], 3)
+    }
@@ -0,0 +1,160 @@
+import os
+import re
+import logging
+from typing import List, Dict, Any, Optional
+
+from rollups import ROLLUP_TABLE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+TEXT_TYPES = {'character varying', 'text', 'character', 'USER-DEFINED'}
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class ColumnProfiler:
+    """Builds per-column value profiles from pg_stats (TABLESAMPLE fallback) to hint valid values to the LLM"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.max_enum_values = int(os.getenv("PROFILE_MAX_ENUM_VALUES", "20"))
+        self.sample_percent = float(os.getenv("PROFILE_SAMPLE_PERCENT", "10"))
+        self.cache_ttl = int(os.getenv("PROFILE_CACHE_TTL", "3600"))
+        self.max_hint_lines = int(os.getenv("PROFILE_MAX_HINT_LINES", "12"))
+        # Profiles of the current schema version, keyed by fingerprint
+        self._profiles: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    async def get_profiles(self, schema_info: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Return {"table.column": profile} for the given schema version"""
+        fingerprint = self.db_manager.schema_fingerprint(schema_info)
+        if fingerprint in self._profiles:
+            return self._profiles[fingerprint]
+
+        cache = self.db_manager.cache
+        cache_key = self.db_manager.cache_key(fingerprint)
+        profiles = await cache.get("profile", cache_key) if cache else None
+        if profiles is None:
+            try:
+                profiles = await self._build_profiles(schema_info)
+            except Exception as e:
+                # Value hints are optional context; generation proceeds without them
+                logger.warning(f"Failed to build column profiles: {e}")
+                return {}
+            if cache:
+                await cache.set("profile", cache_key, profiles, ttl=self.cache_ttl)
+
+        # Only the latest schema version is kept in memory
+        self._profiles = {fingerprint: profiles}
+        return profiles
+
+    async def _build_profiles(self, schema_info: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        profiles = {}
+        tables = {t['table_name'] for t in schema_info if not t['table_name'].startswith(ROLLUP_TABLE_PREFIX)}
+        async with self.db_manager.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT tablename, attname, null_frac, n_distinct,
+                       most_common_vals::text::text[] AS most_common_vals,
+                       most_common_freqs,
+                       histogram_bounds::text::text[] AS histogram_bounds
+                FROM pg_stats
+                WHERE schemaname = 'public'
+            """)
+            analyzed_tables = set()
+            for row in rows:
+                if row['tablename'] not in tables:
+                    continue
+                analyzed_tables.add(row['tablename'])
+                histogram = row['histogram_bounds'] or []
+                profiles[f"{row['tablename']}.{row['attname']}"] = {
+                    'source': 'pg_stats',
+                    'null_frac': row['null_frac'],
+                    'n_distinct': row['n_distinct'],
+                    'most_common_vals': list(row['most_common_vals'] or []),
+                    'most_common_freqs': list(row['most_common_freqs'] or []),
+                    'min': histogram[0] if histogram else None,
+                    'max': histogram[-1] if histogram else None,
+                }
+
+            # Tables never ANALYZEd have no pg_stats rows - sample their text columns instead
+            for table in schema_info:
+                if table['table_name'] not in tables or table['table_name'] in analyzed_tables:
+                    continue
+                for column in table['columns']:
+                    if column['data_type'] in TEXT_TYPES:
+                        profile = await self._sample_column(conn, table['table_name'], column['column_name'])
+                        if profile:
+                            profiles[f"{table['table_name']}.{column['column_name']}"] = profile
+
+        logger.info(f"Built {len(profiles)} column profiles")
+        return profiles
+
+    async def _sample_column(self, conn, table_name: str, column_name: str) -> Optional[Dict[str, Any]]:
+        """Estimate distinct values of an unanalyzed column with TABLESAMPLE"""
+        table, column = _quote_identifier(table_name), _quote_identifier(column_name)
+        limit = self.max_enum_values + 1
+        try:
+            values = await conn.fetch(
+                f"SELECT DISTINCT {column}::text AS value FROM {table} "
+                f"TABLESAMPLE SYSTEM ({self.sample_percent}) WHERE {column} IS NOT NULL LIMIT {limit}"
+            )
+            if not values:
+                # Page sampling of a tiny table often returns nothing; reading it directly is cheap
+                values = await conn.fetch(
+                    f"SELECT DISTINCT {column}::text AS value FROM {table} WHERE {column} IS NOT NULL LIMIT {limit}"
+                )
+        except Exception as e:
+            logger.warning(f"Failed to sample {table_name}.{column_name}: {e}")
+            return None
+
+        values = [row['value'] for row in values]
+        return {
+            'source': 'tablesample',
+            'null_frac': None,
+            'n_distinct': len(values) if len(values) <= self.max_enum_values else None,
+            'most_common_vals': values if len(values) <= self.max_enum_values else [],
+            'most_common_freqs': [],
+            'min': None,
+            'max': None,
+        }
+
+    def enum_values(self, profile: Dict[str, Any]) -> List[str]:
+        """Values of an enum-like column: few distinct values, all captured in the most common list"""
+        n_distinct = profile.get('n_distinct')
+        values = profile.get('most_common_vals') or []
+        # Negative n_distinct is a fraction of rows and means the column isn't enum-like
+        if not values or n_distinct is None or n_distinct <= 0 or n_distinct > self.max_enum_values:
+            return []
+        if len(values) < n_distinct:
+            return []
+        return [v for v in values if len(v) <= 40]
+
+    def format_value_hints(self, question: str, profiles: Dict[str, Dict[str, Any]]) -> str:
+        """Known values of enum-like columns for the tables relevant to the question"""
+        words = {w.rstrip('s') for w in re.findall(r'[a-z]+', question.lower()) if len(w) > 2}
+
+        hints = []
+        for qualified_name, profile in profiles.items():
+            values = self.enum_values(profile)
+            if not values:
+                continue
+            table, column = qualified_name.split('.', 1)
+            table_words = {w.rstrip('s') for w in table.split('_')} | {w.rstrip('s') for w in column.split('_')}
+            value_words = {w.rstrip('s') for v in values for w in re.findall(r'[a-z]+', v.lower())}
+
+            # Relevant when the question names the table/column or mentions one of the values
+            score = 3 * len(words & value_words) + len(words & table_words)
+            if score:
+                hints.append((score, f"{qualified_name}: {', '.join(_quote_literal(v) for v in values)}"))
+
+        if not hints:
+            return ""
+
+        hints.sort(key=lambda hint: -hint[0])
+        lines = [line for _, line in hints[:self.max_hint_lines]]
+        return "Known column values (use exactly as written):\n" + "\n".join(lines) + "\n\n"
@@ -0,0 +1,225 @@
+import os
+import time
+import asyncio
+import gzip
+import logging
+import mimetypes
+from typing import Dict, Any, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; responses fall back to gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'text/plain', 'text/javascript',
+                      'application/javascript', 'image/svg+xml')
+
+# Precompressed sibling files in order of preference: (encoding, suffix)
+PRECOMPRESSED_VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+
+# Process-wide counters for GET /api/admin/http
+http_stats: Dict[str, Any] = {
+    'compressed_responses': 0,
+    'bytes_in': 0,
+    'bytes_out': 0,
+    'compress_ms': 0.0,
+    'by_encoding': {},
+    'static_precompressed': 0,
+    'not_modified': 0,
+    'not_modified_bytes_saved': 0
+}
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {encoding: quality}"""
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            accepted[name.strip()] = quality
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br (when the brotli module is installed) or gzip, honouring q=0"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=level if level is not None else 5)
+    return gzip.compress(body, compresslevel=level if level is not None else 6, mtime=0)
+
+
+def strip_encoding_suffix(tag: str) -> str:
+    """The file's own ETag for one CompressionMiddleware suffixed with the encoding ("...-gzip")"""
+    for encoding in ('br', 'gzip'):
+        if tag.endswith(f'-{encoding}"'):
+            return tag[:-len(encoding) - 2] + '"'
+    return tag
+
+
+def record_not_modified(saved_bytes: int):
+    http_stats['not_modified'] += 1
+    http_stats['not_modified_bytes_saved'] += saved_bytes
+
+
+class CompressionMiddleware:
+    """Negotiated br/gzip compression of complete (non-streaming) JSON, HTML, CSS, JavaScript, SVG and
+    plain-text responses above a size threshold.
+
+    Streaming responses (CSV export, SSE) and already encoded ones (precompressed static files) pass
+    through untouched. Strong ETags of compressed responses get an encoding suffix; static files
+    revalidate against either form.
+    """
+
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size or int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+        # Larger bodies are compressed in a thread so they don't stall the event loop
+        self.thread_size = int(os.getenv("COMPRESSION_THREAD_BYTES", "65536"))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                content_type = headers.get('content-type', '')
+                if 'content-encoding' in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            body = message.get('body', b'')
+            if message.get('more_body', False) or len(body) < self.minimum_size:
+                # Streaming or small: send as is
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            started = time.perf_counter()
+            if len(body) >= self.thread_size:
+                compressed = await asyncio.to_thread(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            headers = MutableHeaders(raw=start_message['headers'])
+            headers['Content-Encoding'] = encoding
+            headers['Content-Length'] = str(len(compressed))
+            headers.add_vary_header('Accept-Encoding')
+            # A compressed body is a different representation; keep strong validators distinct
+            if 'etag' in headers and not headers['etag'].startswith('W/'):
+                headers['ETag'] = headers['etag'][:-1] + f'-{encoding}"'
+
+            http_stats['compressed_responses'] += 1
+            http_stats['bytes_in'] += len(body)
+            http_stats['bytes_out'] += len(compressed)
+            http_stats['compress_ms'] += elapsed_ms
+            http_stats['by_encoding'][encoding] = http_stats['by_encoding'].get(encoding, 0) + 1
+
+            await send(start_message)
+            await send({'type': 'http.response.body', 'body': compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves .br/.gz siblings built by build_static.py and sets Cache-Control"""
+
+    def __init__(self, *args, max_age: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age if max_age is not None else int(os.getenv("STATIC_MAX_AGE", "300"))
+
+    def _precompressed(self, full_path: str, stat_result: os.stat_result, accept_encoding: str) -> Optional[Tuple[str, str, os.stat_result]]:
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, suffix in PRECOMPRESSED_VARIANTS:
+            if accepted.get(encoding, 0) <= 0:
+                continue
+            try:
+                variant_stat = os.stat(full_path + suffix)
+            except OSError:
+                continue
+            # Ignore variants older than the source file
+            if variant_stat.st_mtime >= stat_result.st_mtime:
+                return encoding, full_path + suffix, variant_stat
+        return None
+
+    def is_not_modified(self, response_headers: Headers, request_headers: Headers) -> bool:
+        # Files without a precompressed variant are compressed on the fly, so clients hold "<etag>-gzip"
+        if_none_match = request_headers.get('if-none-match', '').strip()
+        if if_none_match and if_none_match != '*':
+            tags = [strip_encoding_suffix(tag.strip().removeprefix('W/')) for tag in if_none_match.split(',')]
+            return response_headers['etag'] in tags
+        return super().is_not_modified(response_headers, request_headers)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        variant = self._precompressed(str(full_path), stat_result, request_headers.get('accept-encoding', ''))
+
+        if variant:
+            encoding, variant_path, variant_stat = variant
+            media_type = mimetypes.guess_type(str(full_path))[0] or 'text/plain'
+            response = FileResponse(variant_path, status_code=status_code, stat_result=variant_stat,
+                                    media_type=media_type)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+        response.headers['Vary'] = 'Accept-Encoding'
+        # Short max-age, then cheap revalidation through the ETag
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}'
+        if self.is_not_modified(response.headers, request_headers):
+            record_not_modified(int(response.headers.get('content-length', 0)))
+            return NotModifiedResponse(response.headers)
+        if variant:
+            http_stats['static_precompressed'] += 1
+        return response
+
+
+def get_http_stats() -> Dict[str, Any]:
+    saved = http_stats['bytes_in'] - http_stats['bytes_out']
+    return {
+        **http_stats,
+        'compress_ms': round(http_stats['compress_ms'], 2),
+        'bytes_saved': saved,
+        'compression_ratio': round(http_stats['bytes_out'] / http_stats['bytes_in'], 3) if http_stats['bytes_in'] else None,
+        'brotli_available': brotli is not None
+    }
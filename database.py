@@ -1,17 +1,78 @@
 import asyncpg
+import asyncio
 import os
 import json
-from typing import List, Dict, Any, Tuple, Optional
+import hashlib
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator
+import re
 import time
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+
+from rollups import ROLLUP_TABLE_PREFIX
+from pool_controller import AdaptivePool, CONTROL_CONNECTIONS
+from cancellation import record_query_cancelled
 
 logger = logging.getLogger(__name__)
 
+# Short type names for the compact schema encoding
+# Results of queries reading the clock, random values or sequences change between runs, so they are
+# never served from the result cache. 'now'/'today' literals are matched too ('now'::timestamp)
+VOLATILE_PATTERN = re.compile(
+    r"\b(now|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday|random|gen_random_uuid"
+    r"|uuid_generate_v4|nextval|age)\s*\(|\b(current_date|current_time|current_timestamp|localtime|localtimestamp)\b"
+    r"|'(now|today|yesterday|tomorrow)'",
+    re.IGNORECASE
+)
+
+
+def is_volatile(sql_query: str) -> bool:
+    return bool(VOLATILE_PATTERN.search(sql_query))
+
+
+TYPE_ABBREVIATIONS = {
+    'integer': 'int',
+    'bigint': 'int8',
+    'smallint': 'int2',
+    'numeric': 'num',
+    'real': 'float4',
+    'double precision': 'float8',
+    'character varying': 'varchar',
+    'character': 'char',
+    'boolean': 'bool',
+    'timestamp with time zone': 'tstz',
+    'timestamp without time zone': 'ts',
+    'time without time zone': 'time',
+    'USER-DEFINED': 'enum',
+}
+
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, cache=None, tenant: Optional[str] = None, connection_params: Optional[Dict[str, Any]] = None,
+                 min_size: Optional[int] = None, max_size: Optional[int] = None,
+                 statement_timeout: Optional[str] = None):
         self.pool = None
-        self.connection_params = self._get_connection_params()
+        # Plant databases (tenants.py) bring their own connection parameters and pool limits
+        self.tenant = tenant
+        self.connection_params = connection_params or self._get_connection_params()
+        self.min_size = min_size if min_size is not None else int(os.getenv("POOL_MIN_SIZE", "2"))
+        self.max_size = max_size if max_size is not None else int(os.getenv("POOL_MAX_SIZE", "20"))
+        self.statement_timeout = statement_timeout or os.getenv("POOL_STATEMENT_TIMEOUT", "30s")
+        # Optional SharedCache for schema and result caching across workers
+        self.cache = cache
+        self.schema_cache_ttl = int(os.getenv("SCHEMA_CACHE_TTL", "300"))
+        self.result_cache_ttl = int(os.getenv("RESULT_CACHE_TTL", "60"))
+        self.controller_task = None
+        # Long-running exports may hold only a few of the interactive pool's connections at once
+        self.export_slots = asyncio.Semaphore(int(os.getenv("EXPORT_MAX_CONCURRENCY", "2")))
+    
+    @property
+    def max_connections(self) -> int:
+        """Connections the pool may open: the checkout limit plus the reserved control connection"""
+        return self.max_size + CONTROL_CONNECTIONS
+    
+    def cache_key(self, key: str) -> str:
+        """Scope a shared cache key to this database"""
+        return f"{self.tenant}/{key}" if self.tenant else key
     
     def _get_connection_params(self) -> Dict[str, str]:
         """Get database connection parameters from environment variables"""
@@ -36,29 +97,53 @@ class DatabaseManager:
         return params
     
     async def connect(self):
-        """Create connection pool"""
+        """Create the adaptive connection pool, pre-warm it and start its controller"""
         try:
-            if "dsn" in self.connection_params:
-                self.pool = await asyncpg.create_pool(
-                    dsn=self.connection_params["dsn"],
-                    min_size=1,
-                    max_size=10,
-                    command_timeout=30
-                )
-            else:
-                self.pool = await asyncpg.create_pool(
-                    **self.connection_params,
-                    min_size=1,
-                    max_size=10,
-                    command_timeout=30
-                )
-            logger.info("Database connection pool created successfully")
+            min_size = self.min_size
+            max_size = self.max_size
+            pool = await self.create_pool(
+                min_size=min_size,
+                max_size=self.max_connections,
+                command_timeout=30,
+                max_queries=int(os.getenv("POOL_MAX_QUERIES", "50000")),
+                max_inactive_connection_lifetime=float(os.getenv("POOL_MAX_INACTIVE_LIFETIME", "300")),
+                # Startup parameters survive the RESET ALL asyncpg runs when connections are released
+                server_settings={
+                    'search_path': os.getenv("POOL_SEARCH_PATH", "public"),
+                    'statement_timeout': self.statement_timeout,
+                    'application_name': f"nlp-sql:{self.tenant}" if self.tenant else 'nlp-sql'
+                }
+            )
+            self.pool = AdaptivePool(pool, min_size=min_size, max_size=max_size)
+            await self.pool.warm(min_size)
+            self.controller_task = asyncio.create_task(self.pool.run_controller())
+            logger.info(f"Database connection pool created successfully ({min_size}-{max_size} connections)")
         except Exception as e:
             logger.error(f"Failed to create database connection pool: {e}")
             raise
     
+    async def create_pool(self, min_size: int, max_size: int, command_timeout: float, **pool_options):
+        """Create an additional connection pool with the configured connection parameters"""
+        if "dsn" in self.connection_params:
+            return await asyncpg.create_pool(
+                dsn=self.connection_params["dsn"],
+                min_size=min_size,
+                max_size=max_size,
+                command_timeout=command_timeout,
+                **pool_options
+            )
+        return await asyncpg.create_pool(
+            **self.connection_params,
+            min_size=min_size,
+            max_size=max_size,
+            command_timeout=command_timeout,
+            **pool_options
+        )
+    
     async def disconnect(self):
         """Close connection pool"""
+        if self.controller_task:
+            self.controller_task.cancel()
         if self.pool:
             await self.pool.close()
             logger.info("Database connection pool closed")
@@ -69,7 +154,7 @@ class DatabaseManager:
             if not self.pool:
                 return False
             
-            async with self.pool.acquire() as conn:
+            async with self.pool.control(timeout=5) as conn:
                 await conn.fetchval("SELECT 1")
             return True
         except Exception as e:
@@ -78,6 +163,11 @@ class DatabaseManager:
     
     async def get_schema_info(self) -> List[Dict[str, Any]]:
         """Get database schema information"""
+        if self.cache:
+            cached = await self.cache.get("schema", self.cache_key("public"))
+            if cached is not None:
+                return cached
+        
         try:
             async with self.pool.acquire() as conn:
                 # Get tables and their columns
@@ -137,17 +227,28 @@ class DatabaseManager:
                         else:
                             tables[table_name]['columns'].append(column_info)
                 
-                return list(tables.values())
+                schema_info = list(tables.values())
+                if self.cache:
+                    await self.cache.set("schema", self.cache_key("public"), schema_info, ttl=self.schema_cache_ttl)
+                return schema_info
                 
         except Exception as e:
             logger.error(f"Failed to get schema info: {e}")
             raise
     
-    def format_schema_for_llm(self, schema_info: List[Dict[str, Any]]) -> str:
+    def schema_fingerprint(self, schema_info: List[Dict[str, Any]]) -> str:
+        """Stable hash of the schema, used to key caches that depend on it"""
+        return hashlib.sha256(json.dumps(schema_info, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    
+    def format_schema_for_llm(self, schema_info: List[Dict[str, Any]], rollup_context: Optional[str] = None) -> str:
         """Format schema information for LLM context"""
         schema_text = "Database Schema:\n\n"
         
         for table in schema_info:
+            # Rollup tables are described separately with their grain and freshness
+            if table['table_name'].startswith(ROLLUP_TABLE_PREFIX):
+                continue
+            
             schema_text += f"Table: {table['table_name']}\n"
             schema_text += "Columns:\n"
             
@@ -166,39 +267,196 @@ class DatabaseManager:
         schema_text += "Note: All timestamp columns use ISO 8601 format (YYYY-MM-DDTHH:MM:SS.sssZ)\n"
         schema_text += "When querying timestamps, use ISO 8601 format in your SQL queries.\n\n"
         
+        if rollup_context:
+            schema_text += rollup_context
+        
+        return schema_text
+    
+    def format_schema_compact(self, schema_info: List[Dict[str, Any]], rollup_context: Optional[str] = None) -> str:
+        """Format schema as one line per table with abbreviated types and shared columns factored out"""
+        tables = [t for t in schema_info if not t['table_name'].startswith(ROLLUP_TABLE_PREFIX)]
+        
+        def encode(column):
+            encoded = f"{column['column_name']} {TYPE_ABBREVIATIONS.get(column['data_type'], column['data_type'])}"
+            constraint = column.get('constraint_type') or ''
+            if 'PRIMARY KEY' in constraint:
+                encoded += " PK"
+            if 'FOREIGN KEY' in constraint:
+                encoded += " FK"
+            if column['is_nullable'] == 'NO' and 'PRIMARY KEY' not in constraint:
+                encoded += "!"
+            return encoded
+        
+        # Columns identical across at least three tables are listed once
+        counts = {}
+        for table in tables:
+            for column in table['columns']:
+                counts[encode(column)] = counts.get(encode(column), 0) + 1
+        common = [c for c, n in counts.items() if n >= 3]
+        
+        schema_text = "Schema (PK primary key, FK foreign key, ! NOT NULL"
+        if common:
+            schema_text += f"; tables marked + also have: {', '.join(common)}"
+        schema_text += "):\n"
+        
+        for table in tables:
+            encoded = [encode(column) for column in table['columns']]
+            marker = "+" if common and all(c in encoded for c in common) else ""
+            if marker:
+                encoded = [c for c in encoded if c not in common]
+            schema_text += f"{table['table_name']}{marker}({', '.join(encoded)})\n"
+        
+        schema_text += "Timestamps are ISO 8601 with milliseconds, e.g. '2025-03-10T09:46:40.541+00:00'.\n\n"
+        
+        if rollup_context:
+            schema_text += rollup_context
+        
         return schema_text
     
     async def execute_query(self, sql_query: str) -> Tuple[List[Dict[str, Any]], float]:
         """Execute SQL query and return results with execution time"""
+        results, execution_time, _ = await self._execute(sql_query, use_cache=False)
+        return results, execution_time
+    
+    async def execute_cached(self, sql_query: str) -> Tuple[List[Dict[str, Any]], float, Optional[str]]:
+        """Execute through the shared result cache; also returns when a served result was cached (else None)"""
+        return await self._execute(sql_query, use_cache=True)
+    
+    async def _execute(self, sql_query: str, use_cache: bool) -> Tuple[List[Dict[str, Any]], float, Optional[str]]:
         start_time = time.time()
+        start_monotonic = time.monotonic()
+        
+        cacheable = use_cache and self.cache and self.result_cache_ttl > 0 and not is_volatile(sql_query)
+        cache_key = self.cache_key(hashlib.sha256(sql_query.encode()).hexdigest()) if cacheable else None
+        if cache_key:
+            cached = await self.cache.get("result", cache_key)
+            if isinstance(cached, dict):
+                execution_time = time.time() - start_time
+                logger.info(f"Query served from shared cache in {execution_time:.3f}s")
+                return cached['rows'], execution_time, cached['cached_at']
         
+        running = False
         try:
             async with self.pool.acquire() as conn:
                 # Execute query
+                running = True
                 rows = await conn.fetch(sql_query)
                 
                 # Convert to list of dictionaries
-                results = []
-                for row in rows:
-                    row_dict = {}
-                    for key, value in row.items():
-                        # Handle datetime objects
-                        if isinstance(value, datetime):
-                            row_dict[key] = value.isoformat()
-                        else:
-                            row_dict[key] = value
-                    results.append(row_dict)
+                results = [self._row_to_dict(row) for row in rows]
                 
                 execution_time = time.time() - start_time
                 logger.info(f"Query executed successfully in {execution_time:.3f}s")
                 
-                return results, execution_time
+                if cache_key:
+                    await self.cache.set("result", cache_key, {
+                        'rows': results,
+                        'cached_at': datetime.now(timezone.utc).isoformat()
+                    }, ttl=self.result_cache_ttl)
                 
+                return results, execution_time, None
+                
+        except asyncio.CancelledError:
+            # asyncpg sends a server-side cancel for a running statement before releasing the connection
+            record_query_cancelled(start_monotonic, running)
+            raise
+        except Exception as e:
+            execution_time = time.time() - start_time
+            logger.error(f"Query execution failed after {execution_time:.3f}s: {e}")
+            raise Exception(f"Database query failed: {str(e)}")
+    
+    def _row_to_dict(self, row) -> Dict[str, Any]:
+        # Handle datetime objects
+        return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+    
+    async def execute_at_snapshot(self, sql_query: str, watermark_query: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any], float]:
+        """Run a query and its watermark query in one read-only snapshot, so the watermark matches the rows"""
+        start_time = time.time()
+        start_monotonic = time.monotonic()
+        running = False
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction(isolation='repeatable_read', readonly=True):
+                    running = True
+                    # The raw row keeps native timestamps for the next watermark predicate
+                    watermark = dict(await conn.fetchrow(watermark_query))
+                    rows = await conn.fetch(sql_query)
+            
+            results = [self._row_to_dict(row) for row in rows]
+            execution_time = time.time() - start_time
+            logger.info(f"Snapshot query executed successfully in {execution_time:.3f}s")
+            return results, watermark, execution_time
+        
+        except asyncio.CancelledError:
+            record_query_cancelled(start_monotonic, running)
+            raise
         except Exception as e:
             execution_time = time.time() - start_time
             logger.error(f"Query execution failed after {execution_time:.3f}s: {e}")
             raise Exception(f"Database query failed: {str(e)}")
     
+    async def stream_query_csv(self, sql_query: str, timeout: Optional[float] = None) -> AsyncIterator[bytes]:
+        """Stream a validated SELECT as CSV via COPY (...) TO STDOUT with bounded buffering"""
+        # A small queue applies backpressure so memory stays constant for any result size
+        chunks = asyncio.Queue(maxsize=8)
+        
+        async def run_copy():
+            try:
+                async with self.export_slots, self.pool.acquire() as conn:
+                    # Exports may outlive the pool's statement_timeout; RESET ALL on release restores it.
+                    # Without a timeout the pool's own statement_timeout still bounds the export
+                    if timeout:
+                        await conn.execute(f"SET statement_timeout = {int(timeout * 1000)}")
+                    await conn.copy_from_query(
+                        sql_query.rstrip().rstrip(';'),
+                        output=chunks.put,
+                        format='csv',
+                        header=True,
+                        timeout=timeout or None
+                    )
+            finally:
+                await chunks.put(None)
+        
+        start_time = time.time()
+        copy_task = asyncio.create_task(run_copy())
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            # Surface COPY errors to the caller
+            await copy_task
+            logger.info(f"CSV export streamed in {time.time() - start_time:.3f}s")
+        except Exception as e:
+            logger.error(f"CSV export failed after {time.time() - start_time:.3f}s: {e}")
+            raise
+        finally:
+            if not copy_task.done():
+                copy_task.cancel()
+    
+    async def cancel_backend(self, backend_pid: int) -> bool:
+        """Ask PostgreSQL to cancel the statement running on another backend"""
+        try:
+            async with self.pool.control(timeout=5) as conn:
+                return await conn.fetchval("SELECT pg_cancel_backend($1)", backend_pid)
+        except Exception as e:
+            logger.error(f"Failed to cancel backend {backend_pid}: {e}")
+            return False
+
+    async def estimate_query_cost(self, sql_query: str) -> float:
+        """Return the planner's total cost estimate for a query (EXPLAIN, not executed)"""
+        try:
+            async with self.pool.acquire() as conn:
+                plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql_query.rstrip().rstrip(';')}")
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return float(plan[0]["Plan"]["Total Cost"])
+
+        except Exception as e:
+            logger.error(f"Failed to estimate query cost: {e}")
+            raise
+
     async def get_table_sample_data(self, table_name: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Get sample data from a table for context"""
         try:
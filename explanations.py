@@ -0,0 +1,183 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_sql(sql_query: str) -> str:
+    """Canonical form for cache keys: no comments, upper-case keywords, collapsed whitespace"""
+    # Deferred until the first explanation so `import main` doesn't load sqlparse
+    import sqlparse
+    formatted = sqlparse.format(sql_query, strip_comments=True, keyword_case='upper')
+    return re.sub(r'\s+', ' ', formatted).strip().rstrip(';').strip()
+
+
+class PendingExplanation:
+    """An explanation being generated; any number of readers replay the chunks so far and follow the rest"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.failed = False
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, failed: bool = False):
+        self.done = True
+        self.failed = failed
+        self._notify()
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.chunks)
+
+    async def follow(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                return
+            await changed.wait()
+
+
+class QueryExplainer:
+    """Streams LLM explanations of SQL, cached by normalized-SQL hash in memory (LRU) and in the shared cache.
+
+    Generation runs as its own task, so it can start alongside query execution and still completes
+    (and is cached) when the reader that started it disconnects.
+    """
+
+    def __init__(self, db_manager, llm_service, cache=None):
+        self.db_manager = db_manager
+        self.llm_service = llm_service
+        self.cache = cache
+        self.max_entries = int(os.getenv("EXPLAIN_CACHE_SIZE", "256"))
+        self.ttl = int(os.getenv("EXPLAIN_CACHE_TTL", "604800"))
+        self.memory: "OrderedDict[str, str]" = OrderedDict()
+        self.in_flight: Dict[str, PendingExplanation] = {}
+        self.stats = {
+            'requests': 0,
+            'memory_hits': 0,
+            'shared_hits': 0,
+            'joined_in_flight': 0,
+            'generated': 0,
+            'failed': 0,
+            'prefetched': 0,
+            'evicted': 0
+        }
+
+    def cache_key(self, sql_query: str, db_manager=None) -> str:
+        """Normalized-SQL hash scoped to the database, since explanations use its schema as context"""
+        digest = hashlib.sha256(normalize_sql(sql_query).encode()).hexdigest()[:32]
+        return (db_manager or self.db_manager).cache_key(digest)
+
+    def _remember(self, key: str, text: str):
+        self.memory[key] = text
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    async def schema_context(self, sql_query: str, db_manager=None) -> str:
+        """Compact schema of only the tables the SQL references"""
+        db_manager = db_manager or self.db_manager
+        schema_info = await db_manager.get_schema_info()
+        referenced = [
+            table for table in schema_info
+            if re.search(rf"\b{re.escape(table['table_name'])}\b", sql_query, re.IGNORECASE)
+        ]
+        return db_manager.format_schema_compact(referenced) if referenced else ""
+
+    async def explain(self, sql_query: str, db_manager=None) -> PendingExplanation:
+        """Return a finished explanation from cache, or the in-flight or newly started generation.
+
+        `db_manager` selects the database whose schema is used as context (default: the main one).
+        """
+        self.stats['requests'] += 1
+        key = self.cache_key(sql_query, db_manager)
+
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return self._finished(self.memory[key])
+
+        if key in self.in_flight:
+            self.stats['joined_in_flight'] += 1
+            return self.in_flight[key]
+
+        if self.cache:
+            cached = await self.cache.get("explanation", key)
+            if cached is not None:
+                self.stats['shared_hits'] += 1
+                self._remember(key, cached)
+                return self._finished(cached)
+            # Another request may have started generating while the shared cache was read
+            if key in self.in_flight:
+                self.stats['joined_in_flight'] += 1
+                return self.in_flight[key]
+
+        pending = PendingExplanation()
+        self.in_flight[key] = pending
+        asyncio.create_task(self._generate(key, sql_query, pending, db_manager))
+        return pending
+
+    def prefetch(self, sql_query: str, db_manager=None):
+        """Start generating in the background, e.g. while the query itself executes"""
+        self.stats['prefetched'] += 1
+        asyncio.create_task(self.explain(sql_query, db_manager))
+
+    def _finished(self, text: str) -> PendingExplanation:
+        pending = PendingExplanation()
+        pending.append(text)
+        pending.finish()
+        return pending
+
+    async def _generate(self, key: str, sql_query: str, pending: PendingExplanation, db_manager=None):
+        try:
+            schema_context = await self.schema_context(sql_query, db_manager)
+            async for chunk in self.llm_service.stream_explanation(sql_query, schema_context):
+                pending.append(chunk)
+        except asyncio.CancelledError:
+            pending.finish(failed=True)
+            raise
+        except Exception as e:
+            logger.error(f"Failed to generate query explanation: {e}")
+            pending.failed = True
+        finally:
+            del self.in_flight[key]
+
+        if pending.failed or not pending.chunks:
+            self.stats['failed'] += 1
+            pending.finish(failed=True)
+            return
+
+        self.stats['generated'] += 1
+        self._remember(key, pending.text)
+        if self.cache:
+            await self.cache.set("explanation", key, pending.text, ttl=self.ttl)
+        pending.finish()
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits = self.stats['memory_hits'] + self.stats['shared_hits'] + self.stats['joined_in_flight']
+        return {
+            **self.stats,
+            'hit_rate': round(hits / self.stats['requests'], 3) if self.stats['requests'] else None,
+            'cached': len(self.memory),
+            'in_flight': len(self.in_flight),
+            'max_entries': self.max_entries
+        }
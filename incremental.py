@@ -0,0 +1,368 @@
+import os
+import re
+import hashlib
+import secrets
+import logging
+from datetime import date, datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TIME_TYPES = ('timestamp with time zone', 'timestamp without time zone', 'date')
+
+IDENTIFIER = r'[a-z_][a-z0-9_]*'
+COLUMN_REF = rf'(?:{IDENTIFIER}\.)?{IDENTIFIER}'
+
+# Top-level clause keywords of a single SELECT, in the order they may appear
+CLAUSE_PATTERN = re.compile(
+    r'\b(SELECT|FROM|WHERE|GROUP\s+BY|HAVING|WINDOW|ORDER\s+BY|LIMIT|OFFSET|FETCH)\b', re.IGNORECASE
+)
+
+# Time bucket expressions whose groups can be recomputed from a boundary onwards
+BUCKET_PATTERNS = [
+    (re.compile(rf'^DATE_TRUNC\(\s*__lit\d+__\s*,\s*({COLUMN_REF})\s*\)$', re.IGNORECASE), 'date_trunc'),
+    (re.compile(rf'^DATE\(\s*({COLUMN_REF})\s*\)$', re.IGNORECASE), 'date'),
+    (re.compile(rf'^({COLUMN_REF})\s*::\s*date$', re.IGNORECASE), None),
+    (re.compile(rf'^CAST\(\s*({COLUMN_REF})\s+AS\s+DATE\s*\)$', re.IGNORECASE), None),
+]
+
+# A window relative to the current time drops old rows the client would keep
+MOVING_WINDOW_PATTERN = re.compile(
+    r'\b(NOW|CLOCK_TIMESTAMP|STATEMENT_TIMESTAMP|TRANSACTION_TIMESTAMP)\s*\(|'
+    r'\b(CURRENT_DATE|CURRENT_TIMESTAMP|LOCALTIMESTAMP)\b',
+    re.IGNORECASE
+)
+RELATIVE_LITERALS = {"'now'", "'today'", "'yesterday'", "'tomorrow'"}
+
+TABLE_PATTERN = re.compile(
+    rf'(?:\bFROM|\bJOIN|,)\s+({IDENTIFIER})(?:\s+(?:AS\s+)?(?!(?:ON|USING|JOIN|LEFT|RIGHT|INNER|FULL|CROSS|NATURAL)\b)({IDENTIFIER}))?',
+    re.IGNORECASE
+)
+
+
+class RefreshPlan:
+    """How a query refreshes incrementally.
+
+    Both kinds re-read everything from a boundary just before the watermark and the client replaces
+    its rows whose `output_column` is at or after that boundary: 'rows' with the rows themselves,
+    'buckets' with the recomputed time buckets from the one holding the boundary onwards.
+    """
+
+    def __init__(self, kind: str, masked: str, literals: List[str], clauses: Dict[str, Tuple[int, int]],
+                 column_ref: str, table: str, column: str, data_type: str, position: str,
+                 bucket_expression: Optional[str] = None, output_column: Optional[str] = None):
+        self.kind = kind
+        self.masked = masked
+        self.literals = literals
+        self.clauses = clauses
+        self.column_ref = column_ref
+        self.table = table
+        self.column = column
+        self.data_type = data_type
+        self.position = position
+        self.bucket_expression = bucket_expression
+        self.output_column = output_column
+
+    def unmask(self, text: str) -> str:
+        return re.sub(r'__lit(\d+)__', lambda m: self.literals[int(m.group(1))], text)
+
+    def boundary(self, watermark: str, lookback: int) -> str:
+        """SQL for the first time (or time bucket) to re-read: `lookback` seconds before the watermark"""
+        value = f"('{watermark}'::{self.data_type} - interval '{lookback} seconds')"
+        if self.kind == 'rows':
+            # Cast back so a date column's boundary is a date (the whole watermark day is re-read)
+            return f"({value}::{self.data_type})"
+        return self.unmask(self.bucket_expression.replace(self.column_ref, value, 1))
+
+    def watermark_query(self, boundary: Optional[str] = None) -> str:
+        query = f"SELECT (SELECT MAX({self.column}) FROM {self.table}) AS watermark"
+        if boundary:
+            query += f", {boundary} AS replace_from"
+        return query
+
+    def with_predicate(self, predicate: str) -> str:
+        """The query with `predicate` ANDed into its top-level WHERE clause"""
+        masked = self.masked
+        if 'WHERE' in self.clauses:
+            start, end = self.clauses['WHERE']
+            condition = masked[start + len('WHERE'):end].strip()
+            masked = f"{masked[:start]}WHERE {predicate} AND ({condition}) {masked[end:]}"
+        else:
+            following = [start for name, (start, _) in self.clauses.items() if name not in ('SELECT', 'FROM')]
+            insert_at = min(following) if following else len(masked)
+            masked = f"{masked[:insert_at].rstrip()} WHERE {predicate} {masked[insert_at:]}"
+        return self.unmask(masked).strip()
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas outside parentheses"""
+    items, depth, current = [], 0, ''
+    for char in text:
+        depth += char == '('
+        depth -= char == ')'
+        if char == ',' and depth == 0:
+            items.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        items.append(current.strip())
+    return items
+
+
+def _clauses(masked: str) -> Optional[Dict[str, Tuple[int, int]]]:
+    """(start, end) offsets of each top-level clause, keyword included; None if a clause repeats"""
+    starts = []
+    for match in CLAUSE_PATTERN.finditer(masked):
+        prefix = masked[:match.start()]
+        if prefix.count('(') == prefix.count(')'):
+            starts.append((re.sub(r'\s+', ' ', match.group(1).upper()), match.start()))
+    names = [name for name, _ in starts]
+    if len(set(names)) != len(names) or names[:2] != ['SELECT', 'FROM']:
+        return None
+    return {
+        name: (start, starts[i + 1][1] if i + 1 < len(starts) else len(masked))
+        for i, (name, start) in enumerate(starts)
+    }
+
+
+def _normalize(expression: str) -> str:
+    return re.sub(r'\s+', '', expression).lower()
+
+
+def plan_refresh(sql_query: str, schema_info: List[Dict[str, Any]]) -> Tuple[Optional[RefreshPlan], Optional[str]]:
+    """Work out how the query can be refreshed incrementally, or (None, reason) when it can't"""
+    literals: List[str] = []
+
+    def mask(match):
+        literals.append(match.group(0))
+        return f"__lit{len(literals) - 1}__"
+
+    masked = re.sub(r"'(?:[^']|'')*'", mask, sql_query.strip().rstrip(';').strip())
+    upper = masked.upper()
+    if upper.count('SELECT') != 1 or re.search(r'\b(WITH|UNION|INTERSECT|EXCEPT)\b', upper):
+        return None, "not a single SELECT"
+    if re.search(r'\bOVER\b', upper):
+        return None, "window functions span the whole history"
+    if MOVING_WINDOW_PATTERN.search(masked) or RELATIVE_LITERALS & {literal.lower() for literal in literals}:
+        return None, "relative time window moves between refreshes"
+    clauses = _clauses(masked)
+    if clauses is None:
+        return None, "unrecognized query shape"
+    if {'LIMIT', 'OFFSET', 'FETCH'} & set(clauses):
+        return None, "LIMIT/OFFSET results can't be extended"
+
+    def clause(name: str) -> str:
+        if name not in clauses:
+            return ''
+        start, end = clauses[name]
+        return masked[start:end][len(name):].strip()
+
+    # Tables by name and alias, then the time columns they hold
+    tables = {}
+    for match in TABLE_PATTERN.finditer('FROM ' + clause('FROM')):
+        tables[match.group(1).lower()] = match.group(1).lower()
+        if match.group(2):
+            tables[match.group(2).lower()] = match.group(1).lower()
+    columns = {
+        table['table_name']: {c['column_name']: c['data_type'] for c in table['columns']}
+        for table in schema_info if table['table_name'] in tables.values()
+    }
+
+    def time_column(column_ref: str) -> Optional[Tuple[str, str, str]]:
+        """(table, column, data_type) when the reference is a timestamp or date column"""
+        qualifier, _, column = column_ref.lower().rpartition('.')
+        if qualifier:
+            candidates = [tables[qualifier]] if qualifier in tables else []
+        else:
+            candidates = [t for t in set(tables.values()) if column in columns.get(t, {})]
+        if len(candidates) != 1:
+            return None
+        data_type = columns.get(candidates[0], {}).get(column)
+        return (candidates[0], column, data_type) if data_type in TIME_TYPES else None
+
+    # query_rewriter pulls in sqlparse, so it is imported on first use rather than at startup
+    from query_rewriter import AGGREGATE_FUNCTIONS
+
+    select_items = _split_top_level(re.sub(r'^DISTINCT\b', '', clause('SELECT'), flags=re.IGNORECASE).strip())
+    order_items = _split_top_level(clause('ORDER BY'))
+    aggregate = 'GROUP BY' in clauses or any(
+        re.search(rf'\b{name}\s*\(', item, re.IGNORECASE) for item in select_items for name in AGGREGATE_FUNCTIONS
+    )
+
+    if not aggregate:
+        if re.match(r'^SELECT\s+DISTINCT\b', masked, re.IGNORECASE):
+            return None, "DISTINCT rows can't be appended"
+        if order_items:
+            # New rows land at one end only when the time column is the leading sort key
+            match = re.match(rf'^({COLUMN_REF})(?:\s+(ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?$', order_items[0], re.IGNORECASE)
+            resolved = time_column(match.group(1)) if match else None
+            if not resolved:
+                return None, "not ordered by a timestamp column"
+            column_ref = match.group(1)
+            position = 'start' if (match.group(2) or '').upper() == 'DESC' else 'end'
+        else:
+            refs = re.findall(rf'({COLUMN_REF})\s*(?:>=|<=|>|<|\bBETWEEN\b)', clause('WHERE'), re.IGNORECASE)
+            column_ref = next((ref for ref in refs if time_column(ref)), None)
+            if not column_ref:
+                return None, "not ordered or filtered by a timestamp column"
+            resolved = time_column(column_ref)
+            position = 'end'
+        # The client finds the rows to replace by the time column, so the result has to include it
+        output_column = None
+        for item in select_items:
+            if item == '*' or (re.fullmatch(rf'{IDENTIFIER}\.\*', item, re.IGNORECASE)
+                               and tables.get(item[:-2].lower()) == resolved[0]):
+                output_column = resolved[1]
+                break
+            match = re.match(rf'^({COLUMN_REF})(?:\s+(?:AS\s+)?({IDENTIFIER}))?$', item, re.IGNORECASE)
+            if match and time_column(match.group(1)) == resolved:
+                output_column = (match.group(2) or resolved[1]).lower()
+                break
+        if output_column is None:
+            return None, "timestamp column not in the result"
+        table, column, data_type = resolved
+        return RefreshPlan('rows', masked, literals, clauses, column_ref, table, column, data_type, position,
+                           output_column=output_column), None
+
+    if 'GROUP BY' not in clauses:
+        return None, "aggregate without a time bucket"
+    group_items = {_normalize(item) for item in _split_top_level(clause('GROUP BY'))}
+    for index, item in enumerate(select_items, start=1):
+        alias_match = re.match(rf'^(.*?)(?:\s+AS)?\s+({IDENTIFIER})$', item, re.IGNORECASE | re.DOTALL)
+        expression, alias = (alias_match.group(1).strip(), alias_match.group(2)) if alias_match else (item, None)
+        for pattern, default_name in BUCKET_PATTERNS:
+            match = pattern.match(expression)
+            resolved = time_column(match.group(1)) if match else None
+            if not resolved:
+                continue
+            output_column = (alias or default_name or match.group(1).rpartition('.')[2]).lower()
+            keys = {_normalize(expression), str(index), output_column}
+            if not keys & group_items:
+                continue
+            if order_items:
+                leading = re.match(r'^(.*?)(?:\s+(ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?$', order_items[0],
+                                   re.IGNORECASE | re.DOTALL)
+                if _normalize(leading.group(1)) not in keys:
+                    return None, "not ordered by its time bucket"
+                position = 'start' if (leading.group(2) or '').upper() == 'DESC' else 'end'
+            else:
+                position = 'end'
+            table, column, data_type = resolved
+            return RefreshPlan('buckets', masked, literals, clauses, match.group(1), table, column, data_type,
+                               position, bucket_expression=expression, output_column=output_column), None
+    return None, "not grouped by a time bucket"
+
+
+def _watermark_literal(value: Any) -> Optional[str]:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return None
+
+
+class IncrementalRefresher:
+    """Result tokens for /api/execute-sql so a repeated dashboard query only fetches what changed.
+
+    Each response carries a token for the watermark (the time column's maximum in the snapshot the
+    rows came from). Passing it back returns the rows, or recomputed time buckets, from REFRESH_LOOKBACK
+    seconds before the watermark onwards; anything else gets the full result. Rows committed later
+    than that with an older time only appear once the token expires and a full result is fetched.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.token_ttl = int(os.getenv("REFRESH_TOKEN_TTL", "3600"))
+        # Re-read from this many seconds before the watermark to pick up rows committed late
+        self.lookback = int(os.getenv("REFRESH_LOOKBACK", "3600"))
+        self.stats = {'full': 0, 'delta': 0, 'full_rows': 0, 'delta_rows': 0, 'fallbacks': {}}
+
+    def _fallback(self, reason: str):
+        self.stats['fallbacks'][reason] = self.stats['fallbacks'].get(reason, 0) + 1
+
+    async def execute(self, db_manager, sql_query: str, result_token: Optional[str], rewriter):
+        """Run the query fully or as a delta against the token; returns (rewrite_result, results, execution_time, refresh)"""
+        query_hash = hashlib.sha256(re.sub(r'\s+', ' ', sql_query.strip()).encode()).hexdigest()
+        plan, reason = plan_refresh(sql_query, await db_manager.get_schema_info())
+
+        state = None
+        if result_token:
+            state = await self.cache.get("refresh", db_manager.cache_key(result_token))
+            if state is None:
+                reason = reason or "result token expired"
+            elif state['query_hash'] != query_hash:
+                reason, state = reason or "query changed", None
+
+        refresh = {'mode': 'full', 'kind': plan.kind if plan else None, 'position': plan.position if plan else None,
+                   'column': plan.output_column if plan else None, 'replace_from': None, 'watermark': None,
+                   'result_token': None, 'fallback_reason': None, 'cached_at': None}
+
+        if plan is None:
+            rewrite_result = rewriter.rewrite_query(sql_query)
+            results, execution_time, refresh['cached_at'] = await db_manager.execute_cached(rewrite_result.rewritten_query)
+            self._record_full(results, reason if result_token else None)
+            refresh['fallback_reason'] = reason
+            return rewrite_result, results, execution_time, refresh
+
+        if state and state.get('watermark'):
+            boundary = plan.boundary(state['watermark'], self.lookback)
+            predicate = f"{plan.column_ref} >= {boundary}"
+
+            rewrite_result = rewriter.rewrite_query(plan.with_predicate(predicate))
+            results, watermark, execution_time = await db_manager.execute_at_snapshot(
+                rewrite_result.rewritten_query, plan.watermark_query(boundary)
+            )
+            if rewrite_result.limit_applied and len(results) >= rewrite_result.limit_applied:
+                # More new rows than one response holds; the client needs the full result again
+                reason = "delta exceeded the row limit"
+            else:
+                self.stats['delta'] += 1
+                self.stats['delta_rows'] += len(results)
+                replace_from = watermark.get('replace_from')
+                refresh.update(
+                    mode='delta',
+                    replace_from=replace_from.isoformat() if isinstance(replace_from, (datetime, date)) else None,
+                    watermark=_watermark_literal(watermark['watermark']) or state['watermark'],
+                    result_token=await self._issue(db_manager, query_hash,
+                                                   _watermark_literal(watermark['watermark']) or state['watermark'])
+                )
+                return rewrite_result, results, execution_time, refresh
+        elif result_token and state is not None:
+            reason = "no watermark yet"
+
+        rewrite_result = rewriter.rewrite_query(sql_query)
+        results, watermark, execution_time = await db_manager.execute_at_snapshot(
+            rewrite_result.rewritten_query, plan.watermark_query()
+        )
+        self._record_full(results, reason if result_token else None)
+        refresh['fallback_reason'] = reason if result_token else None
+        if rewrite_result.limit_applied and len(results) >= rewrite_result.limit_applied:
+            # A truncated result has rows below the watermark the client never received
+            refresh['fallback_reason'] = "result truncated by the row limit"
+            return rewrite_result, results, execution_time, refresh
+
+        literal = _watermark_literal(watermark['watermark'])
+        refresh.update(watermark=literal, result_token=await self._issue(db_manager, query_hash, literal))
+        return rewrite_result, results, execution_time, refresh
+
+    def _record_full(self, results: List[Dict[str, Any]], reason: Optional[str]):
+        self.stats['full'] += 1
+        self.stats['full_rows'] += len(results)
+        if reason:
+            self._fallback(reason)
+
+    async def _issue(self, db_manager, query_hash: str, watermark: Optional[str]) -> str:
+        # A fresh token per response, so a retried refresh still finds the state it was issued against
+        token = secrets.token_urlsafe(16)
+        await self.cache.set(
+            "refresh", db_manager.cache_key(token), {'query_hash': query_hash, 'watermark': watermark}, ttl=self.token_ttl
+        )
+        return token
+
+    def get_stats(self) -> Dict[str, Any]:
+        refreshes = self.stats['full'] + self.stats['delta']
+        return {
+            **self.stats,
+            'delta_rate': round(self.stats['delta'] / refreshes, 3) if refreshes else None,
+            'token_ttl': self.token_ttl,
+            'lookback': self.lookback
+        }
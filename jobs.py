@@ -0,0 +1,251 @@
+import os
+import json
+import mmap
+import uuid
+import time
+import asyncio
+import logging
+import tempfile
+from array import array
+from datetime import datetime, date, timezone
+from decimal import Decimal
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+from models import JobStatus, QueryJobInfo
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED}
+
+
+def _serialize_value(value):
+    """JSON encoder fallback for PostgreSQL result values"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+class QueryJobManager:
+    """Runs long analytical queries in a bounded background worker pool and spools results to disk"""
+
+    def __init__(self, db_manager, sql_resolver: Callable[[Optional[str], Optional[str], Optional[str]], Awaitable[str]]):
+        self.db_manager = db_manager
+        # Turns (question, sql_query, context) into validated, executable SQL
+        self.sql_resolver = sql_resolver
+        self.worker_count = int(os.getenv("JOB_WORKERS", "2"))
+        self.queue_size = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+        self.command_timeout = float(os.getenv("JOB_COMMAND_TIMEOUT", "600"))
+        self.result_ttl = int(os.getenv("JOB_RESULT_TTL", "3600"))
+        self.spool_dir = os.getenv("JOB_SPOOL_DIR") or tempfile.gettempdir()
+        self.fetch_batch_size = 500
+
+        self.pool = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self):
+        """Create the dedicated job connection pool and start the workers"""
+        # Jobs get their own pool so they never starve interactive queries
+        self.pool = await self.db_manager.create_pool(
+            min_size=0,
+            max_size=self.worker_count,
+            command_timeout=self.command_timeout
+        )
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self._workers.append(asyncio.create_task(self._cleanup_loop()))
+        logger.info(f"Query job manager started with {self.worker_count} workers")
+
+    async def stop(self):
+        """Stop workers, cancel running jobs and remove spool files"""
+        for worker in self._workers:
+            worker.cancel()
+        for job_id in list(self.jobs):
+            self._discard(job_id)
+        if self.pool:
+            await self.pool.close()
+
+    def submit(self, question: Optional[str] = None, sql_query: Optional[str] = None,
+               context: Optional[str] = None) -> QueryJobInfo:
+        """Queue a question or SQL query; raises asyncio.QueueFull when the backlog is full"""
+        job_id = uuid.uuid4().hex
+        info = QueryJobInfo(
+            job_id=job_id,
+            status=JobStatus.QUEUED,
+            question=question,
+            sql_query=sql_query,
+            submitted_at=datetime.now(timezone.utc)
+        )
+        job = {
+            'info': info,
+            'context': context,
+            'spool_path': None,
+            'offsets': array('Q'),
+            'mmap': None,
+            'task': None,
+            'backend_pid': None,
+            'updated': asyncio.Event()
+        }
+        self.queue.put_nowait(job_id)
+        self.jobs[job_id] = job
+        return info
+
+    def get_job(self, job_id: str) -> Optional[QueryJobInfo]:
+        job = self.jobs.get(job_id)
+        return job['info'] if job else None
+
+    async def wait_for_update(self, job_id: str, timeout: float) -> Optional[QueryJobInfo]:
+        """Wait until the job changes state (or the timeout passes) and return its info"""
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        if job['info'].status not in TERMINAL_STATUSES:
+            try:
+                await asyncio.wait_for(job['updated'].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.get_job(job_id)
+
+    def get_results(self, job_id: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """Read a page of spooled rows through the memory-mapped result file"""
+        job = self.jobs[job_id]
+        if job['info'].status != JobStatus.COMPLETED:
+            raise ValueError(f"Job is {job['info'].status.value}, results are not available")
+
+        offsets = job['offsets']
+        row_count = len(offsets) - 1
+        if job['mmap'] is None or offset >= row_count:
+            return []
+
+        columns = job['info'].columns
+        end = min(offset + limit, row_count)
+        results = []
+        for i in range(offset, end):
+            values = json.loads(job['mmap'][offsets[i]:offsets[i + 1]])
+            results.append(dict(zip(columns, values)))
+        return results
+
+    async def cancel(self, job_id: str) -> Optional[QueryJobInfo]:
+        """Cancel a queued or running job, cancelling its statement server-side"""
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        if job['info'].status in TERMINAL_STATUSES:
+            return job['info']
+
+        if job['backend_pid']:
+            await self.db_manager.cancel_backend(job['backend_pid'])
+        if job['task']:
+            job['task'].cancel()
+        self._set_status(job, JobStatus.CANCELLED, error="Cancelled by user")
+        return job['info']
+
+    def _set_status(self, job: Dict[str, Any], status: JobStatus, error: Optional[str] = None):
+        info = job['info']
+        if info.status in TERMINAL_STATUSES:
+            return
+        info.status = status
+        if error:
+            info.error = error
+        if status == JobStatus.RUNNING:
+            info.started_at = datetime.now(timezone.utc)
+        elif status in TERMINAL_STATUSES:
+            info.finished_at = datetime.now(timezone.utc)
+
+        # Wake subscribers and arm a fresh event for the next change
+        job['updated'].set()
+        job['updated'] = asyncio.Event()
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            try:
+                if not job or job['info'].status != JobStatus.QUEUED:
+                    continue
+                job['task'] = asyncio.create_task(self._run(job))
+                try:
+                    await job['task']
+                except asyncio.CancelledError:
+                    # Only the job was cancelled - keep the worker alive
+                    if asyncio.current_task().cancelling():
+                        raise
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: Dict[str, Any]):
+        info = job['info']
+        self._set_status(job, JobStatus.RUNNING)
+        start_time = time.time()
+
+        try:
+            info.sql_query = await self.sql_resolver(info.question, info.sql_query, job['context'])
+            await self._spool(job, info.sql_query)
+            self._set_status(job, JobStatus.COMPLETED)
+            logger.info(f"Job {info.job_id} completed: {info.row_count} rows in {time.time() - start_time:.3f}s")
+        except asyncio.CancelledError:
+            self._set_status(job, JobStatus.CANCELLED, error="Cancelled by user")
+            raise
+        except Exception as e:
+            logger.error(f"Job {info.job_id} failed after {time.time() - start_time:.3f}s: {e}")
+            self._set_status(job, JobStatus.FAILED, error=str(e))
+        finally:
+            job['backend_pid'] = None
+
+    async def _spool(self, job: Dict[str, Any], sql_query: str):
+        """Stream rows through a server-side cursor into a JSON-lines spool file"""
+        info = job['info']
+        fd, path = tempfile.mkstemp(prefix=f"nlpsql-job-{info.job_id}-", suffix=".jsonl", dir=self.spool_dir)
+        job['spool_path'] = path
+        offsets = job['offsets']
+        offsets.append(0)
+
+        with os.fdopen(fd, 'wb') as spool:
+            async with self.pool.acquire() as conn:
+                job['backend_pid'] = conn.get_server_pid()
+                async with conn.transaction(readonly=True):
+                    statement = await conn.prepare(sql_query.rstrip().rstrip(';'))
+                    info.columns = [attribute.name for attribute in statement.get_attributes()]
+
+                    batch = []
+                    async for record in statement.cursor(prefetch=self.fetch_batch_size):
+                        line = json.dumps(list(record.values()), default=_serialize_value).encode() + b"\n"
+                        batch.append(line)
+                        offsets.append(offsets[-1] + len(line))
+                        if len(batch) >= self.fetch_batch_size:
+                            spool.write(b"".join(batch))
+                            batch = []
+                            info.row_count = len(offsets) - 1
+                    spool.write(b"".join(batch))
+                    info.row_count = len(offsets) - 1
+
+        if info.row_count:
+            with open(path, 'rb') as spool:
+                job['mmap'] = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+
+    async def _cleanup_loop(self):
+        """Drop finished jobs and their spool files once they outlive the result TTL"""
+        while True:
+            await asyncio.sleep(60)
+            now = datetime.now(timezone.utc)
+            for job_id, job in list(self.jobs.items()):
+                finished_at = job['info'].finished_at
+                if finished_at and (now - finished_at).total_seconds() > self.result_ttl:
+                    self._discard(job_id)
+
+    def _discard(self, job_id: str):
+        job = self.jobs.pop(job_id, None)
+        if not job:
+            return
+        if job['task'] and not job['task'].done():
+            job['task'].cancel()
+        if job['mmap'] is not None:
+            job['mmap'].close()
+        if job['spool_path']:
+            try:
+                os.unlink(job['spool_path'])
+            except OSError:
+                pass
@@ -1,12 +1,51 @@
 import os
+import re
 import json
+import time
 import logging
-from typing import Optional, Dict, Any
-import aiohttp
+from typing import Optional, Dict, Any, AsyncIterator
 import asyncio
 
+from rate_limiter import GroqRateLimiter
+from cancellation import record_llm_cancelled
+from traffic_capture import LLMReplay, annotate, prompt_hash
+
 logger = logging.getLogger(__name__)
 
+SYSTEM_MESSAGE = "You are an expert PostgreSQL analyst for manufacturing data. Return only one PostgreSQL SELECT query, no explanations or formatting."
+
+EXPLAIN_SYSTEM_MESSAGE = "You are an expert PostgreSQL analyst for manufacturing data. Explain SQL queries to non-technical users in plain language."
+
+PROMPT_RULES = """RULES:
+1. ONLY SELECT (CTEs allowed) - never INSERT, UPDATE, DELETE, DROP, CREATE, ALTER or TRUNCATE
+2. Use JOINs, CTEs, window functions, CASE and aggregations as needed; GROUP BY/HAVING/ORDER BY appropriately
+3. Compute metrics (efficiency, percentages, durations, totals) with EXTRACT, DATE_TRUNC, AGE
+4. Timestamp literals use exactly YYYY-MM-DDTHH:MM:SS.sss+00:00, e.g. '2025-03-10T09:46:40.541+00:00'
+5. Never wrap filtered columns in casts or functions (no column::date, DATE(column), DATE_TRUNC(..., column) in WHERE); use half-open ranges
+6. Return ONLY the SQL query"""
+
+PROMPT_DOMAIN_CONTEXT = """CONTEXT: production_runs links machines, operations, shifts and operators with timestamps; quality_checks are inspections of runs; machine_downtime holds maintenance/failure records. Join machines→departments, runs→employees, etc."""
+
+PROMPT_EXAMPLES = """EXAMPLES:
+- FROM production_runs pr JOIN machines m ON pr.machine_id = m.id
+- EXTRACT(EPOCH FROM (end_timestamp - start_timestamp))/3600 AS duration_hours
+- (actual_units * 100.0 / planned_units) AS efficiency_percent
+- ROW_NUMBER() OVER (PARTITION BY machine_id ORDER BY start_timestamp DESC)
+- WHERE start_timestamp = '2025-03-10T09:46:40.541+00:00'
+- WHERE start_timestamp >= '2025-03-10T06:00:00.000+00:00' AND start_timestamp < '2025-03-11T06:00:00.000+00:00'
+- WHERE start_timestamp >= '2025-03-10' AND start_timestamp < '2025-03-11'
+- WHERE start_timestamp >= (CURRENT_TIMESTAMP - INTERVAL '7 days')
+- WITH machine_stats AS (SELECT machine_id, COUNT(*) AS runs ...)"""
+
+# A table line of DatabaseManager.format_schema_compact, e.g. "machines+(name varchar, ...)"
+COMPACT_TABLE_LINE = re.compile(r'^([a-z_][a-z0-9_]*)\+?\(')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Llama-family tokenizers (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
 class GroqLLMService:
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY", "")
@@ -22,17 +61,67 @@ class GroqLLMService:
         ]
         self.model = self.available_models[0]  # Start with the best model
         
+        # Token limits: prompt budget for generate_sql and completion cap per call
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+        self.max_tokens = int(os.getenv("LLM_MAX_TOKENS", "800"))
+        
+        # Client-side pacing per model so 429s queue instead of cascading through every model
+        self.rate_limiter = GroqRateLimiter()
+        
+        # Offline replay: serve SQL-generation responses recorded by traffic capture instead of calling Groq
+        self.replay = LLMReplay.from_env()
+        
+        # One HTTP session for all calls so requests reuse warm keep-alive connections
+        self._session = None
+        
         if not self.api_key:
             logger.warning("GROQ_API_KEY not found in environment variables")
     
+    async def _client(self):
+        """Shared aiohttp session, created on first use (aiohttp is imported lazily to speed up startup)"""
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(keepalive_timeout=float(os.getenv("GROQ_KEEPALIVE_TIMEOUT", "60")))
+            )
+        return self._session
+    
+    async def warm_up(self) -> bool:
+        """Open a keep-alive TLS connection to Groq before the first question (listing models costs no tokens)"""
+        import aiohttp
+        if not self.api_key:
+            return False
+        session = await self._client()
+        async with session.get(
+            "https://api.groq.com/openai/v1/models",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            await response.read()
+            return response.status == 200
+    
+    async def close(self):
+        if self._session:
+            await self._session.close()
+    
     async def generate_sql(self, question: str, schema_context: str, additional_context: str = None) -> Optional[str]:
         """Generate SQL query from natural language question"""
         try:
-            # Construct the prompt
-            prompt = self._build_prompt(question, schema_context, additional_context)
+            # Construct the prompt within the token budget
+            prompt = self._fit_prompt(question, schema_context, additional_context)
             
-            # Make API call to Groq
-            response = await self._call_groq_api(prompt)
+            # Make API call to Groq (or serve the recorded response when replaying a capture)
+            digest = prompt_hash(prompt)
+            started = time.monotonic()
+            response = await self.replay.lookup(digest, question) if self.replay else None
+            if response is None:
+                response = await self._call_groq_api(prompt)
+            annotate(
+                prompt_hash=digest,
+                llm_response=response,
+                llm_model=self.model,
+                llm_ms=round((time.monotonic() - started) * 1000, 2)
+            )
             
             if response:
                 # Extract SQL from response
@@ -45,45 +134,56 @@ class GroqLLMService:
             logger.error(f"Failed to generate SQL: {e}")
             return None
     
-    def _build_prompt(self, question: str, schema_context: str, additional_context: str = None) -> str:
+    def _fit_prompt(self, question: str, schema_context: str, additional_context: str = None) -> str:
+        """Build the prompt, dropping examples and then low-relevance tables until it fits the budget"""
+        prompt = self._build_prompt(question, schema_context, additional_context)
+        if estimate_tokens(SYSTEM_MESSAGE + prompt) <= self.prompt_token_budget:
+            return prompt
+        
+        prompt = self._build_prompt(question, schema_context, additional_context, include_examples=False)
+        
+        # Table lines of the compact schema encoding, least relevant first
+        lines = schema_context.split("\n")
+        table_lines = sorted(
+            (i for i, line in enumerate(lines) if COMPACT_TABLE_LINE.match(line)),
+            key=lambda i: self._table_relevance(question, lines[i])
+        )
+        dropped = []
+        # Always keep the most relevant table
+        for index in table_lines[:-1]:
+            if estimate_tokens(SYSTEM_MESSAGE + prompt) <= self.prompt_token_budget:
+                break
+            dropped.append(COMPACT_TABLE_LINE.match(lines[index]).group(1))
+            lines[index] = None
+            schema_context = "\n".join(line for line in lines if line is not None)
+            prompt = self._build_prompt(question, schema_context, additional_context, include_examples=False)
+        
+        logger.info(
+            f"Prompt trimmed to ~{estimate_tokens(SYSTEM_MESSAGE + prompt)} tokens "
+            f"(budget {self.prompt_token_budget}); examples dropped, tables dropped: {dropped or 'none'}"
+        )
+        return prompt
+    
+    def _table_relevance(self, question: str, table_line: str) -> int:
+        """Score a compact schema line by how many question words hit its table and column names"""
+        words = {w.rstrip('s') for w in re.findall(r'[a-z]+', question.lower()) if len(w) > 2}
+        match = COMPACT_TABLE_LINE.match(table_line)
+        table_words = {w.rstrip('s') for w in match.group(1).split('_')}
+        column_words = {w.rstrip('s') for w in re.findall(r'[a-z]+', table_line[match.end():].lower())}
+        return 3 * len(words & table_words) + len(words & column_words)
+    
+    def _build_prompt(self, question: str, schema_context: str, additional_context: str = None,
+                      include_examples: bool = True) -> str:
         """Build enhanced prompt for complex SQL generation"""
-        prompt = f"""You are an expert PostgreSQL database analyst specializing in manufacturing data analysis.
-
-{schema_context}
-
-ADVANCED SQL GENERATION RULES:
-1. ONLY generate SELECT queries - no INSERT, UPDATE, DELETE, DROP, CREATE, ALTER, or TRUNCATE
-2. Use sophisticated PostgreSQL features: JOINs, subqueries, CTEs (WITH clauses), window functions
-3. For complex questions, use multiple table JOINs and advanced aggregations
-4. Calculate metrics: efficiency rates, percentages, time differences, totals
-5. CRITICAL: Handle timestamps in EXACT format '2025-03-10T09:46:40.541+00:00' with milliseconds
-6. Use window functions for ranking, running totals, and comparisons
-7. Apply CASE statements for conditional logic and categorization
-8. Include date/time extractions: EXTRACT, DATE_TRUNC, AGE functions
-9. Use appropriate GROUP BY, HAVING, ORDER BY clauses
-10. Return ONLY the SQL query without explanations or formatting
-
-MANUFACTURING CONTEXT:
-- production_runs: Links machines, operations, shifts, operators with timestamps
-- quality_checks: Inspection results linked to production runs
-- machine_downtime: Maintenance and failure records with duration
-- Use JOINs to connect: machines→departments, runs→employees, etc.
-
-ADVANCED PATTERNS TO USE:
-- Multi-table JOINs: FROM production_runs pr JOIN machines m ON pr.machine_id = m.id
-- Time calculations: EXTRACT(EPOCH FROM (end_timestamp - start_timestamp))/3600 AS duration_hours
-- Efficiency calculations: (actual_units * 100.0 / planned_units) AS efficiency_percent
-- Window functions: ROW_NUMBER() OVER (PARTITION BY machine_id ORDER BY start_timestamp DESC)
-- TIMESTAMP FILTERING EXAMPLES:
-  * Exact timestamp: WHERE start_timestamp = '2025-03-10T09:46:40.541+00:00'
-  * Time range: WHERE start_timestamp >= '2025-03-10T06:00:00.000+00:00' AND start_timestamp < '2025-03-11T06:00:00.000+00:00'
-  * Date filtering: WHERE start_timestamp::date = '2025-03-10'
-  * Recent data: WHERE start_timestamp >= (CURRENT_TIMESTAMP - INTERVAL '7 days')
-- CTEs for complex logic: WITH machine_stats AS (SELECT machine_id, COUNT(*) as runs...)
-- Millisecond precision: Always use format YYYY-MM-DDTHH:MM:SS.sss+00:00 for timestamp literals
-
-Question: {question}"""
-
+        prompt = f"""{schema_context}
+{PROMPT_RULES}
+{PROMPT_DOMAIN_CONTEXT}"""
+        
+        if include_examples:
+            prompt += f"\n{PROMPT_EXAMPLES}"
+        
+        prompt += f"\nQuestion: {question}"
+        
         if additional_context:
             prompt += f"\n\nAdditional Context: {additional_context}"
         
@@ -102,61 +202,101 @@ Question: {question}"""
             "Content-Type": "application/json"
         }
         
-        # Try each model until one works
+        # Try each model until one works; rate limits are waited out on the same model
         for model_name in self.available_models:
-            payload = {
-                "model": model_name,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an expert PostgreSQL database analyst specializing in complex manufacturing data queries. Generate sophisticated SELECT queries using advanced SQL features like JOINs, subqueries, CTEs, window functions, and calculations. Return only the SQL query without explanations or formatting."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": 1500,
-                "temperature": 0.2,
-                "top_p": 0.9,
-                "stream": False
-            }
+            content = await self._call_model(model_name, prompt, headers)
+            if content:
+                # Update the working model for future requests
+                if self.model != model_name:
+                    logger.info(f"Switched to working model: {model_name}")
+                    self.model = model_name
+                return content
+        
+        logger.error("All available models failed")
+        return None
+    
+    async def _call_model(self, model_name: str, prompt: str, headers: Dict[str, str]) -> Optional[str]:
+        """Call one model, pacing with its rate limiter and retrying 429s after Retry-After"""
+        import aiohttp
+        limiter = self.rate_limiter.for_model(model_name)
+        # Groq counts max_tokens against the token quota up front; unused tokens are refunded below
+        reserved = estimate_tokens(SYSTEM_MESSAGE + prompt) + self.max_tokens
+        payload = {
+            "model": model_name,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_MESSAGE
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
+            ],
+            "max_tokens": self.max_tokens,
+            "temperature": 0.2,
+            "top_p": 0.9,
+            "stream": False
+        }
+        
+        started = time.monotonic()
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            try:
+                acquired = await limiter.acquire(reserved, self.rate_limiter.max_wait)
+            except asyncio.CancelledError:
+                record_llm_cancelled(started, queued=True)
+                raise
+            if not acquired:
+                logger.warning(
+                    f"Model {model_name} is rate limited beyond {self.rate_limiter.max_wait}s, trying next model"
+                )
+                return None
             
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        self.base_url,
-                        headers=headers,
-                        json=payload,
-                        timeout=aiohttp.ClientTimeout(total=30)
-                    ) as response:
+                session = await self._client()
+                async with session.post(
+                    self.base_url,
+                    headers=headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=30)
+                ) as response:
+                    
+                    if response.status == 429:
+                        delay = limiter.record_rate_limited(response.headers, attempt)
+                        limiter.update_from_headers(response.headers)
+                        logger.warning(f"Model {model_name} rate limited, retrying in {delay:.1f}s")
+                        continue
+                    
+                    if response.status == 200:
+                        data = await response.json()
+                        used = (data.get("usage") or {}).get("total_tokens")
+                        if used is not None:
+                            limiter.refund(reserved - used)
+                        # Headers reflect the server's quota after this call and override local estimates
+                        limiter.update_from_headers(response.headers)
                         
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            if "choices" in data and len(data["choices"]) > 0:
-                                content = data["choices"][0]["message"]["content"]
-                                # Update the working model for future requests
-                                if self.model != model_name:
-                                    logger.info(f"Switched to working model: {model_name}")
-                                    self.model = model_name
-                                return content.strip()
-                            else:
-                                logger.error(f"No choices in Groq API response for model {model_name}")
-                        else:
-                            error_text = await response.text()
-                            logger.warning(f"Model {model_name} failed: {response.status} - {error_text}")
-                            # Try next model
-                            continue
-                            
+                        if "choices" in data and len(data["choices"]) > 0:
+                            return data["choices"][0]["message"]["content"].strip()
+                        logger.error(f"No choices in Groq API response for model {model_name}")
+                        return None
+                    
+                    limiter.update_from_headers(response.headers)
+                    error_text = await response.text()
+                    logger.warning(f"Model {model_name} failed: {response.status} - {error_text}")
+                    return None
+                    
+            except asyncio.CancelledError:
+                # The caller went away; Groq has already counted the reserved tokens
+                record_llm_cancelled(started, queued=False)
+                raise
             except asyncio.TimeoutError:
                 logger.warning(f"Model {model_name} timed out, trying next model")
-                continue
+                return None
             except Exception as e:
                 logger.warning(f"Model {model_name} failed with error: {e}, trying next model")
-                continue
+                return None
         
-        logger.error("All available models failed")
+        logger.warning(f"Model {model_name} still rate limited after {self.rate_limiter.max_retries} retries")
         return None
     
     def _extract_sql_from_response(self, response: str) -> Optional[str]:
@@ -200,20 +340,116 @@ Question: {question}"""
         
         return response
     
-    async def explain_query(self, sql_query: str, schema_context: str) -> Optional[str]:
-        """Generate explanation for SQL query"""
-        try:
-            prompt = f"""Explain the following PostgreSQL query in simple terms:
+    def _build_explain_prompt(self, sql_query: str, schema_context: str) -> str:
+        return f"""Explain the following PostgreSQL query in simple terms:
 
 {schema_context}
 
 SQL Query: {sql_query}
 
 Explain what this query does, which tables it accesses, what data it returns, and any important details about the query structure. Keep the explanation concise and user-friendly."""
-
-            explanation = await self._call_groq_api(prompt)
-            return explanation
+    
+    async def explain_query(self, sql_query: str, schema_context: str) -> Optional[str]:
+        """Generate explanation for SQL query"""
+        try:
+            chunks = [chunk async for chunk in self.stream_explanation(sql_query, schema_context)]
+            return ''.join(chunks) or None
             
         except Exception as e:
             logger.error(f"Failed to generate query explanation: {e}")
             return None
+    
+    async def stream_explanation(self, sql_query: str, schema_context: str) -> AsyncIterator[str]:
+        """Stream an explanation as it is generated, with the same model fallback as SQL generation"""
+        if not self.api_key:
+            logger.error("GROQ_API_KEY is required but not provided")
+            return
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        prompt = self._build_explain_prompt(sql_query, schema_context)
+        
+        for model_name in self.available_models:
+            streamed = False
+            async for chunk in self._stream_model(model_name, prompt, headers):
+                streamed = True
+                yield chunk
+            if streamed:
+                return
+        
+        logger.error("All available models failed")
+    
+    async def _stream_model(self, model_name: str, prompt: str, headers: Dict[str, str]) -> AsyncIterator[str]:
+        """Stream one model's completion; yields nothing if the model can't be used.
+        
+        Failures after the first chunk are raised, since falling back would repeat the text.
+        """
+        import aiohttp
+        limiter = self.rate_limiter.for_model(model_name)
+        reserved = estimate_tokens(EXPLAIN_SYSTEM_MESSAGE + prompt) + self.max_tokens
+        payload = {
+            "model": model_name,
+            "messages": [
+                {"role": "system", "content": EXPLAIN_SYSTEM_MESSAGE},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": self.max_tokens,
+            "temperature": 0.3,
+            "stream": True
+        }
+        
+        yielded = False
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if not await limiter.acquire(reserved, self.rate_limiter.max_wait):
+                logger.warning(f"Model {model_name} is rate limited beyond {self.rate_limiter.max_wait}s")
+                return
+            
+            try:
+                session = await self._client()
+                async with session.post(
+                    self.base_url,
+                    headers=headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=60, sock_read=30)
+                ) as response:
+                    
+                    if response.status == 429:
+                        delay = limiter.record_rate_limited(response.headers, attempt)
+                        limiter.update_from_headers(response.headers)
+                        logger.warning(f"Model {model_name} rate limited, retrying in {delay:.1f}s")
+                        continue
+                    
+                    limiter.update_from_headers(response.headers)
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.warning(f"Model {model_name} failed: {response.status} - {error_text}")
+                        return
+                    
+                    # Server-sent events: "data: {json}" lines ending with "data: [DONE]"
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8').strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        event = json.loads(data)
+                        usage = (event.get("x_groq") or {}).get("usage")
+                        if usage and usage.get("total_tokens") is not None:
+                            limiter.refund(reserved - usage["total_tokens"])
+                        choices = event.get("choices") or [{}]
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yielded = True
+                            yield content
+                    return
+                    
+            except Exception as e:
+                if yielded:
+                    raise
+                logger.warning(f"Model {model_name} failed with error: {e}, trying next model")
+                return
+        
+        logger.warning(f"Model {model_name} still rate limited after {self.rate_limiter.max_retries} retries")
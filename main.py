@@ -1,10 +1,13 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request, Header
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, JSONResponse
 from pydantic import BaseModel
 import asyncpg
+import asyncio
+import hashlib
+import time
 import os
+import zlib
 from typing import List, Dict, Any, Optional
 import logging
 from contextlib import asynccontextmanager
@@ -18,8 +21,23 @@ except ImportError:
     pass
 
 from database import DatabaseManager
-from validators import SQLValidator
 from llm_service import GroqLLMService
+from rollups import RollupManager
+from column_profiles import ColumnProfiler
+from jobs import QueryJobManager, TERMINAL_STATUSES
+from query_templates import QueryHistory, TemplateMatcher
+from shared_cache import SharedCache
+from sessions import SessionStore, RefinementPlanner, ColumnarResult
+from explanations import QueryExplainer
+from traffic_capture import TrafficCapture, annotate
+from tenants import TenantRegistry, TenantMiddleware, current_tenant
+from startup import StartupTracker
+from speculation import SpeculationManager
+from incremental import IncrementalRefresher
+from cancellation import cancel_on_disconnect, ClientDisconnected, get_cancellation_stats
+from compression import CompressionMiddleware, PrecompressedStaticFiles, record_not_modified, get_http_stats
+from models import RollupRoute, QueryJobInfo
+from build_static import build as build_static
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,42 +47,134 @@ logger = logging.getLogger(__name__)
 class NLPQuery(BaseModel):
     question: str
     context: Optional[str] = None
+    session_id: Optional[str] = None
+    # Start generating an explanation of the SQL while it executes (fetch it from /api/explain)
+    explain: bool = False
 
 class SQLResponse(BaseModel):
     sql_query: str
     results: List[Dict[str, Any]]
+    original_sql_query: Optional[str] = None
+    rewrites_applied: List[str] = []
+    rollup: Optional[RollupRoute] = None
+    answered_by: Optional[str] = None
+    has_more: bool = False
+    # When the results came from the shared result cache: the time they were computed
+    cached_at: Optional[str] = None
+    session_id: Optional[str] = None
     success: bool
     error: Optional[str] = None
     execution_time: Optional[float] = None
 
+class SpeculateRequest(BaseModel):
+    partial_question: str
+    session_id: str
+    context: Optional[str] = None
+
+class ExplainRequest(BaseModel):
+    sql_query: str
+
+class JobRequest(BaseModel):
+    question: Optional[str] = None
+    sql_query: Optional[str] = None
+    context: Optional[str] = None
+
 class SchemaResponse(BaseModel):
     tables: List[Dict[str, Any]]
     success: bool
     error: Optional[str] = None
 
 # Global variables
+shared_cache = None
 db_manager = None
 sql_validator = None
+sql_rewriter = None
 llm_service = None
+query_explainer = None
+traffic_capture = None
+tenant_registry = None
+startup_tracker = None
+speculation_manager = None
+incremental_refresher = None
+rollup_manager = None
+column_profiler = None
+job_manager = None
+query_history = None
+template_matcher = None
+session_store = None
+refinement_planner = None
+
+def _build_services():
+    """Construct the SQL validator, rewriter and template matcher (CPU-bound, run in a thread)"""
+    # sqlparse is imported here, overlapping the pool connecting instead of delaying `import main`
+    from validators import SQLValidator
+    from query_rewriter import SQLRewriter
+    validator = SQLValidator()
+    rewriter = SQLRewriter()
+    history = QueryHistory()
+    matcher = TemplateMatcher(history)
+    matcher.load()
+    return validator, rewriter, history, matcher
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global db_manager, sql_validator, llm_service
+    global shared_cache, db_manager, sql_validator, sql_rewriter, llm_service, rollup_manager, job_manager
+    global query_history, template_matcher, column_profiler, session_store, refinement_planner, query_explainer
+    global traffic_capture, tenant_registry, startup_tracker, speculation_manager, incremental_refresher
+    refresh_task = None
+    startup_tracker = StartupTracker()
+    
+    async def warm_up():
+        """Pre-load the schema, then build rollups and profiles while the Groq connection is opened"""
+        nonlocal refresh_task
+        schema_info = await startup_tracker.phase("schema", db_manager.get_schema_info())
+        await asyncio.gather(
+            startup_tracker.phase("rollups", rollup_manager.initialize(schema_info)),
+            startup_tracker.phase("column_profiles", column_profiler.get_profiles(schema_info)),
+            # Without Groq the app still answers templates and refinements, so this doesn't gate readiness
+            startup_tracker.phase("groq", llm_service.warm_up(), required=False)
+        )
+        if rollup_manager.refresh_interval > 0 and refresh_task is None:
+            refresh_task = asyncio.create_task(rollup_manager.run_refresh_loop())
     
     try:
-        # Initialize services with detailed logging
-        logger.info("Initializing database manager...")
-        db_manager = DatabaseManager()
-        
-        logger.info("Attempting database connection...")
-        await db_manager.connect()
+        logger.info("Opening shared cache...")
+        shared_cache = SharedCache()
         
-        logger.info("Initializing SQL validator...")
-        sql_validator = SQLValidator()
+        # The pool connects while the CPU-bound services are built in a thread
+        logger.info("Connecting to the database and initializing services...")
+        db_manager = DatabaseManager(cache=shared_cache)
+        # Static assets are precompressed here so no deploy step has to remember build_static.py
+        _, (sql_validator, sql_rewriter, query_history, template_matcher), _ = await asyncio.gather(
+            startup_tracker.phase("database", db_manager.connect()),
+            startup_tracker.phase("services", asyncio.to_thread(_build_services)),
+            startup_tracker.phase("static_assets", asyncio.to_thread(build_static, "static", False), required=False)
+        )
         
-        logger.info("Initializing LLM service...")
         llm_service = GroqLLMService()
+        query_explainer = QueryExplainer(db_manager, llm_service, cache=shared_cache)
+        session_store = SessionStore()
+        refinement_planner = RefinementPlanner()
+        speculation_manager = SpeculationManager(_generate_sql)
+        incremental_refresher = IncrementalRefresher(shared_cache)
+        rollup_manager = RollupManager(db_manager)
+        column_profiler = ColumnProfiler(db_manager)
+        
+        logger.info("Starting query job workers...")
+        job_manager = QueryJobManager(db_manager, _resolve_job_sql)
+        await job_manager.start()
+        
+        traffic_capture = TrafficCapture()
+        traffic_capture.start()
+        
+        logger.info("Initializing plant database registry...")
+        tenant_registry = TenantRegistry(cache=shared_cache)
+        tenant_registry.start()
+        
+        # Serve from here; GET /ready stays 503 until the warm-up completes
+        startup_tracker.serving()
+        startup_tracker.start_warmup(warm_up)
         
         logger.info("Application startup completed successfully")
         yield
@@ -85,8 +195,21 @@ async def lifespan(app: FastAPI):
         raise
     finally:
         # Shutdown
+        startup_tracker.stop()
+        if refresh_task:
+            refresh_task.cancel()
+        if job_manager:
+            await job_manager.stop()
+        if traffic_capture:
+            await traffic_capture.close()
+        if tenant_registry:
+            await tenant_registry.close()
+        if llm_service:
+            await llm_service.close()
         if db_manager:
             await db_manager.disconnect()
+        if shared_cache:
+            shared_cache.close()
         logger.info("Application shutdown completed")
 
 # Create FastAPI app
@@ -97,8 +220,14 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Mount static files and templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Negotiated br/gzip for large JSON, HTML, CSS and JavaScript responses
+app.add_middleware(CompressionMiddleware)
+
+# Per-plant databases selected by X-Plant header or /plants/{id} path prefix
+app.add_middleware(TenantMiddleware, registry=lambda: tenant_registry)
+
+# Mount static files (serving build_static.py's precompressed variants) and templates
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 @app.get("/", response_class=HTMLResponse)
@@ -117,7 +246,11 @@ async def health_check():
             "services": {
                 "database": "connected" if is_connected else "disconnected",
                 "llm": "available" if llm_service else "unavailable"
-            }
+            },
+            "llm_queue_depth": llm_service.rate_limiter.get_metrics()['queue_depth'] if llm_service else 0,
+            "ready": startup_tracker.ready if startup_tracker else False,
+            "pool": db_manager.pool.get_status() if db_manager.pool else None,
+            "plant_pools_open": len(tenant_registry.tenants) if tenant_registry else 0
         }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
@@ -127,15 +260,43 @@ async def health_check():
             "error": str(e)
         }
 
+def _database() -> DatabaseManager:
+    """The plant database selected for this request (see TenantMiddleware), else the default one"""
+    tenant = current_tenant.get()
+    return tenant.db if tenant else db_manager
+
+def _column_profiler() -> ColumnProfiler:
+    tenant = current_tenant.get()
+    return tenant.column_profiler if tenant else column_profiler
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the schema, rollups, profiles and connections are warm"""
+    status = startup_tracker.get_status() if startup_tracker else {"ready": False}
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+# Body size per schema ETag, to report bytes saved by 304 responses
+schema_response_bytes: Dict[str, int] = {}
+
 @app.get("/api/schema", response_model=SchemaResponse)
-async def get_database_schema():
-    """Get database schema information"""
+async def get_database_schema(request: Request):
+    """Get database schema information (ETag tied to the schema fingerprint)"""
     try:
-        schema_info = await db_manager.get_schema_info()
-        return SchemaResponse(
-            tables=schema_info,
-            success=True
-        )
+        database = _database()
+        schema_info = await database.get_schema_info()
+        # Weak validator: the same schema may be sent gzip, br or identity encoded
+        etag = f'W/"schema-{database.schema_fingerprint(schema_info)}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag[2:] in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+            record_not_modified(schema_response_bytes.get(etag, 0))
+            return Response(status_code=304, headers=headers)
+        
+        body = SchemaResponse(tables=schema_info, success=True).model_dump_json()
+        schema_response_bytes.clear()
+        schema_response_bytes[etag] = len(body)
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         logger.error(f"Failed to get schema: {e}")
         return SchemaResponse(
@@ -144,20 +305,159 @@ async def get_database_schema():
             error=str(e)
         )
 
+async def _generate_sql(question: str, context: Optional[str] = None) -> Optional[str]:
+    """Generate SQL from natural language with the current schema as context"""
+    database = _database()
+    schema_info = await database.get_schema_info()
+    # Rollup tables only exist in the default database
+    schema_context = database.format_schema_compact(
+        schema_info, None if current_tenant.get() else rollup_manager.format_rollups_for_llm()
+    )
+    
+    # Exact spellings of enum-like values (shift names, statuses) for the tables the question touches
+    profiler = _column_profiler()
+    profiles = await profiler.get_profiles(schema_info)
+    schema_context += profiler.format_value_hints(question, profiles)
+    
+    # Identical question against identical context yields reusable SQL across workers
+    cache_key = hashlib.sha256(f"{question}\n{context or ''}\n{schema_context}".encode()).hexdigest()
+    sql_query = await shared_cache.get("sql", cache_key)
+    if sql_query:
+        annotate(sql_cache_hit=True)
+        return sql_query
+    
+    sql_query = await llm_service.generate_sql(
+        question=question,
+        schema_context=schema_context,
+        additional_context=context
+    )
+    if sql_query:
+        await shared_cache.set("sql", cache_key, sql_query, ttl=int(os.getenv("SQL_CACHE_TTL", "86400")))
+    return sql_query
+
+async def _shadow_check_template(question: str, template_id: str, template_results: List[Dict[str, Any]]):
+    """Cross-check a template answer against the LLM path to measure template precision"""
+    try:
+        sql_query = await _generate_sql(question)
+        if not sql_query or not sql_validator.validate_query(sql_query).is_valid:
+            return
+        llm_results, _ = await db_manager.execute_query(sql_rewriter.rewrite_query(sql_query).rewritten_query)
+        
+        # Compare row values only - column names and order legitimately differ
+        def signature(results):
+            return sorted(sorted(str(value) for value in row.values()) for row in results)
+        
+        template_matcher.record_shadow(template_id, signature(llm_results) == signature(template_results))
+    except Exception as e:
+        logger.warning(f"Template shadow check failed: {e}")
+
+async def _load_session(session_id: str):
+    """Get the conversation, restoring its question/SQL history from the shared cache on a new worker"""
+    session = session_store.get(session_id)
+    if not session.messages:
+        for entry in await shared_cache.get("session", session_id) or []:
+            session.add_message(entry['question'], is_user=True)
+            session.add_message(entry['question'], is_user=False, sql_query=entry['sql_query'])
+    return session
+
+async def _remember_answer(session, question: str, sql_query: str, results: List[Dict[str, Any]],
+                           complete: bool, execution_time: Optional[float]):
+    """Record the exchange and cache its result set for local refinements"""
+    session.add_message(question, is_user=True)
+    session.add_message(question, is_user=False, sql_query=sql_query, execution_time=execution_time)
+    session.add_result(ColumnarResult(question, sql_query, results, complete))
+    
+    # Result sets stay in this worker; the question/SQL trail is shared so follow-ups work on any worker
+    history = [
+        {'question': m.message, 'sql_query': m.sql_query}
+        for m in session.messages if not m.is_user and m.sql_query
+    ]
+    await shared_cache.set("session", session.session_id, history[-5:], ttl=session_store.ttl)
+
+def _follow_up_context(session, question: str) -> Optional[str]:
+    """LLM context carrying the conversation's previous SQL when the question is a follow-up, else None"""
+    if session_store.classify(question, session) != 'follow_up':
+        return None
+    query_context = session.build_context(question)
+    return (
+        "Previous questions and SQL in this conversation:\n"
+        + "\n\n".join(query_context.previous_queries)
+        + "\nThe new question continues this conversation; adapt the most recent SQL."
+    )
+
+def _tenant_scope() -> Optional[str]:
+    tenant = current_tenant.get()
+    return tenant.tenant_id if tenant else None
+
 @app.post("/api/query", response_model=SQLResponse)
-async def process_nlp_query(query: NLPQuery):
+async def process_nlp_query(query: NLPQuery, request: Request):
     """Process natural language query and return SQL results"""
+    capture = traffic_capture.begin("/api/query", query.model_dump())
     try:
-        # Get database schema for context
-        schema_info = await db_manager.get_schema_info()
-        schema_context = db_manager.format_schema_for_llm(schema_info)
-        
-        # Generate SQL from natural language
-        sql_query = await llm_service.generate_sql(
-            question=query.question,
-            schema_context=schema_context,
-            additional_context=query.context
-        )
+        response = await cancel_on_disconnect(request, _answer_question(query))
+    except ClientDisconnected:
+        traffic_capture.finish(capture, success=False, error="client disconnected")
+        # Nobody is listening; 499 (client closed request) only shows up in access logs
+        return Response(status_code=499)
+    
+    traffic_capture.finish(
+        capture,
+        success=response.success,
+        error=response.error,
+        validated_sql=response.original_sql_query or response.sql_query,
+        sql_query=response.sql_query,
+        answered_by=response.answered_by,
+        row_count=len(response.results),
+        execute_ms=round(response.execution_time * 1000, 2) if response.execution_time is not None else None
+    )
+    return response
+
+async def _answer_question(query: NLPQuery) -> SQLResponse:
+    """Generate, validate, rewrite and run the SQL for a question"""
+    template_match = None
+    context = query.context
+    session = await _load_session(query.session_id) if query.session_id else None
+    try:
+        if session and not context:
+            # Refinements of the last complete result set are answered without the LLM or the database
+            latest = session.latest
+            plan = refinement_planner.plan(query.question, latest) if latest else None
+            if plan:
+                start_time = time.time()
+                results, derived_sql = refinement_planner.apply(plan, latest)
+                execution_time = time.time() - start_time
+                session_store.stats['local_refinements'] += 1
+                await _remember_answer(session, query.question, derived_sql, results, True, execution_time)
+                return SQLResponse(
+                    sql_query=derived_sql,
+                    results=results,
+                    answered_by="session",
+                    session_id=session.session_id,
+                    success=True,
+                    execution_time=execution_time
+                )
+            
+            # True follow-ups go to the LLM with the conversation's previous SQL as context
+            context = _follow_up_context(session, query.question)
+            session_store.stats['llm_follow_ups' if context else 'new_questions'] += 1
+        
+        # Answer recurring question shapes from curated templates without calling the LLM
+        if not context:
+            template_match = template_matcher.match(query.question)
+        
+        if template_match:
+            sql_query = template_match['sql_query']
+            answered_by = f"template:{template_match['template_id']}"
+        else:
+            # Reuse the generation started while the question was being typed, if the text still matches
+            sql_query = None
+            if query.session_id:
+                sql_query = await speculation_manager.take(
+                    query.session_id, query.question, context, _tenant_scope()
+                )
+            answered_by = "llm:speculative" if sql_query else "llm"
+            if not sql_query:
+                sql_query = await _generate_sql(query.question, context)
         
         if not sql_query:
             return SQLResponse(
@@ -177,18 +477,60 @@ async def process_nlp_query(query: NLPQuery):
                 error=f"Query validation failed: {validation_result.error_message}"
             )
         
+        # Rewrite into index-friendly form
+        rewrite_result = sql_rewriter.rewrite_query(sql_query)
+        final_query = rewrite_result.rewritten_query
+        
+        # Serve eligible aggregates from the pre-aggregated rollups (default database only)
+        tenant = current_tenant.get()
+        rollup = rollup_manager.route_query(final_query) if not tenant else None
+        if rollup:
+            final_query = rollup.routed_query
+        elif not tenant:
+            rollup = rollup_manager.get_freshness(validation_result.tables_accessed)
+        
+        if query.explain:
+            query_explainer.prefetch(final_query, _database())
+        
         # Execute SQL query
-        results, execution_time = await db_manager.execute_query(sql_query)
+        results, execution_time, cached_at = await _database().execute_cached(final_query)
+        
+        if template_match:
+            template_matcher.record_outcome(template_match['template_id'], success=True)
+            # Shadow checks outlive the request, so they only run against the default database
+            if not tenant and template_matcher.should_shadow():
+                asyncio.create_task(
+                    _shadow_check_template(query.question, template_match['template_id'], results)
+                )
+        elif not context:
+            # Follow-ups only make sense with their context, so they don't feed template mining
+            query_history.record(query.question, sql_query)
+        
+        # The injected row cap was hit; the UI pages the rest through a background job
+        has_more = not tenant and bool(rewrite_result.limit_applied) and len(results) >= rewrite_result.limit_applied
+        if session:
+            await _remember_answer(
+                session, query.question, rewrite_result.rewritten_query, results, not has_more, execution_time
+            )
         
         return SQLResponse(
-            sql_query=sql_query,
+            sql_query=final_query,
             results=results,
+            original_sql_query=sql_query,
+            rewrites_applied=rewrite_result.rewrites_applied,
+            rollup=rollup,
+            answered_by=answered_by,
+            has_more=has_more,
+            cached_at=cached_at,
+            session_id=session.session_id if session else None,
             success=True,
             execution_time=execution_time
         )
         
     except Exception as e:
         logger.error(f"Failed to process query: {e}")
+        if template_match:
+            template_matcher.record_outcome(template_match['template_id'], success=False)
         return SQLResponse(
             sql_query="",
             results=[],
@@ -196,9 +538,66 @@ async def process_nlp_query(query: NLPQuery):
             error=str(e)
         )
 
+@app.post("/api/speculate")
+async def speculate_sql(speculate_request: SpeculateRequest):
+    """Start generating SQL for a partially typed question so submitting it can skip the LLM wait"""
+    question = speculate_request.partial_question
+    context = speculate_request.context
+    session = await _load_session(speculate_request.session_id)
+    
+    if not context:
+        # Questions answered without the LLM don't need a head start
+        latest = session.latest
+        if (latest and refinement_planner.plan(question, latest)) or template_matcher.match(question):
+            speculation_manager.stats['skipped'] += 1
+            return {"speculating": False}
+        context = _follow_up_context(session, question)
+    
+    # Never let speculative calls queue ahead of submitted questions for the Groq quota
+    if llm_service.rate_limiter.queue_depth > 0:
+        speculation_manager.stats['skipped'] += 1
+        return {"speculating": False}
+    
+    speculating = speculation_manager.speculate(session.session_id, question, context, _tenant_scope())
+    return {"speculating": speculating}
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Get a conversation's messages and the result sets cached for refinements"""
+    session = session_store.sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {
+        "session_id": session_id,
+        "messages": session.messages,
+        "cached_results": [
+            {
+                "result_id": result.result_id,
+                "question": result.question,
+                "row_count": result.row_count,
+                "complete": result.complete,
+                "bytes": result.nbytes
+            }
+            for result in session.results.values()
+        ],
+        "bytes": session.nbytes,
+        "success": True
+    }
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Forget a conversation and its cached result sets"""
+    session_store.delete(session_id)
+    await shared_cache.invalidate("session", session_id)
+    return {"success": True}
+
 @app.post("/api/execute-sql")
-async def execute_raw_sql(request: dict):
-    """Execute raw SQL query (with validation)"""
+async def execute_raw_sql(request: dict, http_request: Request):
+    """Execute raw SQL query (with validation).
+    
+    With "incremental": true (or a "result_token" from a previous response) the response carries a
+    result_token; passing it back returns only the rows or time buckets that changed ("refresh").
+    """
     try:
         sql_query = request.get("sql_query", "").strip()
         
@@ -213,22 +612,328 @@ async def execute_raw_sql(request: dict):
                 detail=f"Query validation failed: {validation_result.error_message}"
             )
         
-        # Execute SQL query
-        results, execution_time = await db_manager.execute_query(sql_query)
+        result_token = request.get("result_token")
+        if request.get("incremental") or result_token:
+            # Dashboard refresh: rows past the token's watermark or recomputed time buckets
+            rewrite_result, results, execution_time, refresh = await cancel_on_disconnect(
+                http_request,
+                incremental_refresher.execute(_database(), sql_query, result_token, sql_rewriter)
+            )
+        else:
+            # Rewrite into index-friendly form
+            rewrite_result = sql_rewriter.rewrite_query(sql_query)
+            
+            # Execute SQL query
+            results, execution_time, cached_at = await cancel_on_disconnect(
+                http_request, _database().execute_cached(rewrite_result.rewritten_query)
+            )
+            refresh = None
         
         return {
-            "sql_query": sql_query,
+            "sql_query": rewrite_result.rewritten_query,
+            "original_sql_query": sql_query,
+            "rewrites_applied": rewrite_result.rewrites_applied,
             "results": results,
+            "has_more": not current_tenant.get() and bool(rewrite_result.limit_applied) and len(results) >= rewrite_result.limit_applied,
+            "result_token": refresh['result_token'] if refresh else None,
+            "refresh": refresh,
+            "cached_at": refresh['cached_at'] if refresh else cached_at,
             "success": True,
             "execution_time": execution_time
         }
         
     except HTTPException:
         raise
+    except ClientDisconnected:
+        return Response(status_code=499)
     except Exception as e:
         logger.error(f"Failed to execute SQL: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/explain")
+async def explain_sql(explain_request: ExplainRequest):
+    """Stream a plain-language explanation of a validated query as text"""
+    sql_query = explain_request.sql_query.strip()
+    if not sql_query:
+        raise HTTPException(status_code=400, detail="SQL query is required")
+    
+    validation_result = sql_validator.validate_query(sql_query)
+    if not validation_result.is_valid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Query validation failed: {validation_result.error_message}"
+        )
+    
+    explanation = await query_explainer.explain(sql_query, _database())
+    chunks = explanation.follow()
+    
+    # Wait for the first chunk so a failed generation still produces a proper HTTP error
+    first_chunk = await anext(chunks, "")
+    if explanation.failed and not first_chunk:
+        raise HTTPException(status_code=502, detail="Failed to generate query explanation")
+    
+    async def body():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+    
+    # Generation continues (and is cached) if the client disconnects mid-stream
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8",
+                             headers={"Cache-Control": "no-store"})
+
+@app.post("/api/export-csv")
+async def export_csv(request: dict, http_request: Request):
+    """Stream the full result of a validated SELECT as (gzipped) CSV"""
+    sql_query = (request.get("sql_query") or "").strip()
+    if not sql_query:
+        raise HTTPException(status_code=400, detail="SQL query is required")
+    
+    # User SQL is validated as usual - COPY itself stays banned and is only added server-side
+    validation_result = sql_validator.validate_query(sql_query)
+    if not validation_result.is_valid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Query validation failed: {validation_result.error_message}"
+        )
+    
+    # Exports want every row, so no LIMIT is injected
+    export_query = sql_rewriter.rewrite_query(sql_query, inject_limit=False).rewritten_query
+    timeout = float(os.getenv("EXPORT_COMMAND_TIMEOUT", "600"))
+    chunks = _database().stream_query_csv(export_query, timeout=timeout)
+    
+    # Pull the first chunk so query errors still produce a proper HTTP error
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except Exception as e:
+        logger.error(f"Failed to export CSV: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    use_gzip = "gzip" in http_request.headers.get("accept-encoding", "").lower()
+    
+    async def body():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+        yield compressor.compress(first_chunk) if compressor else first_chunk
+        async for chunk in chunks:
+            yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+    
+    headers = {"Content-Disposition": 'attachment; filename="export.csv"'}
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(body(), media_type="text/csv", headers=headers)
+
+async def _resolve_job_sql(question: Optional[str], sql_query: Optional[str], context: Optional[str]) -> str:
+    """Generate (for questions), validate and rewrite the SQL a background job will run"""
+    if question:
+        sql_query = await _generate_sql(question, context)
+        if not sql_query:
+            raise Exception("Failed to generate SQL query from natural language")
+    
+    validation_result = sql_validator.validate_query(sql_query)
+    if not validation_result.is_valid:
+        raise Exception(f"Query validation failed: {validation_result.error_message}")
+    
+    # Results are paged from the spool, so no LIMIT is injected
+    return sql_rewriter.rewrite_query(sql_query, inject_limit=False).rewritten_query
+
+@app.post("/api/jobs", response_model=QueryJobInfo)
+async def submit_query_job(job_request: JobRequest):
+    """Submit a question or SQL query to run in the background"""
+    question = (job_request.question or "").strip()
+    sql_query = (job_request.sql_query or "").strip()
+    if not question and not sql_query:
+        raise HTTPException(status_code=400, detail="Either question or sql_query is required")
+    if current_tenant.get():
+        raise HTTPException(status_code=400, detail="Background jobs only run against the default database")
+    
+    if sql_query and not question:
+        validation_result = sql_validator.validate_query(sql_query)
+        if not validation_result.is_valid:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Query validation failed: {validation_result.error_message}"
+            )
+    
+    try:
+        return job_manager.submit(
+            question=question or None,
+            sql_query=sql_query or None,
+            context=job_request.context
+        )
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=429, detail="Too many queued jobs, try again later")
+
+@app.get("/api/jobs/{job_id}", response_model=QueryJobInfo)
+async def get_query_job(job_id: str):
+    """Get the status of a background query job"""
+    job = job_manager.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_query_job_events(job_id: str):
+    """Subscribe to job status changes as server-sent events"""
+    if not job_manager.get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def event_stream():
+        last_event = None
+        while True:
+            job = await job_manager.wait_for_update(job_id, timeout=15)
+            if not job:
+                break
+            event = job.model_dump_json()
+            if event != last_event:
+                yield f"data: {event}\n\n"
+                last_event = event
+            else:
+                # Keep idle connections open through proxies
+                yield ": keep-alive\n\n"
+            if job.status in TERMINAL_STATUSES:
+                break
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_query_job_results(job_id: str, offset: int = 0, limit: int = 100):
+    """Page through the spooled results of a completed job"""
+    job = job_manager.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    limit = max(1, min(limit, 10000))
+    try:
+        results = job_manager.get_results(job_id, max(0, offset), limit)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return {
+        "job_id": job_id,
+        "columns": job.columns,
+        "results": results,
+        "offset": offset,
+        "row_count": job.row_count,
+        "success": True
+    }
+
+@app.delete("/api/jobs/{job_id}", response_model=QueryJobInfo)
+async def cancel_query_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = await job_manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _require_admin(admin_token: Optional[str]):
+    """Reject admin calls unless ADMIN_API_TOKEN is configured and matches"""
+    expected = os.getenv("ADMIN_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin API is disabled (ADMIN_API_TOKEN not set)")
+    if admin_token != expected:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/api/admin/rollups")
+async def get_rollup_status(x_admin_token: Optional[str] = Header(None)):
+    """Get rollup tables and their freshness"""
+    _require_admin(x_admin_token)
+    return {"rollups": rollup_manager.get_status(), "success": True}
+
+@app.post("/api/admin/rollups/refresh")
+async def refresh_rollups(request: dict = None, x_admin_token: Optional[str] = Header(None)):
+    """Incrementally refresh the rollup tables (pass {"full": true} to rebuild)"""
+    _require_admin(x_admin_token)
+    try:
+        full = bool((request or {}).get("full", False))
+        summary = await rollup_manager.refresh(full=full)
+        return {"refreshed": summary, "success": True}
+    except Exception as e:
+        logger.error(f"Failed to refresh rollups: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/cache")
+async def get_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    """Get shared cache size and this worker's hit rates"""
+    _require_admin(x_admin_token)
+    return {"cache": shared_cache.get_stats(), "success": True}
+
+@app.get("/api/admin/llm")
+async def get_llm_rate_limits(x_admin_token: Optional[str] = Header(None)):
+    """Get Groq rate-limit pacing (queue depth, throttle time, per-model quota) and explanation cache stats"""
+    _require_admin(x_admin_token)
+    return {
+        "rate_limits": llm_service.rate_limiter.get_metrics(),
+        "explanations": query_explainer.get_stats(),
+        "success": True
+    }
+
+@app.get("/api/admin/speculation")
+async def get_speculation_stats(x_admin_token: Optional[str] = Header(None)):
+    """Get speculative SQL generation hit rate, time saved and wasted or cancelled LLM calls"""
+    _require_admin(x_admin_token)
+    return {"speculation": speculation_manager.get_stats(), "success": True}
+
+@app.get("/api/admin/refresh")
+async def get_refresh_stats(x_admin_token: Optional[str] = Header(None)):
+    """Get full versus delta /api/execute-sql refreshes, rows returned and why deltas fell back"""
+    _require_admin(x_admin_token)
+    return {"refresh": incremental_refresher.get_stats(), "success": True}
+
+@app.get("/api/admin/http")
+async def get_http_metrics(x_admin_token: Optional[str] = Header(None)):
+    """Get bytes saved by response compression, precompressed static assets and 304 responses"""
+    _require_admin(x_admin_token)
+    return {"http": get_http_stats(), "success": True}
+
+@app.get("/api/admin/cancellations")
+async def get_cancellations(x_admin_token: Optional[str] = Header(None)):
+    """Get LLM calls and database statements cancelled because their client disconnected"""
+    _require_admin(x_admin_token)
+    return {"cancellations": get_cancellation_stats(), "success": True}
+
+@app.get("/api/admin/capture")
+async def get_capture_stats(x_admin_token: Optional[str] = Header(None)):
+    """Get traffic capture counters and, when replaying a capture, recorded-response hits"""
+    _require_admin(x_admin_token)
+    return {
+        "capture": traffic_capture.get_stats(),
+        "replay": llm_service.replay.stats if llm_service.replay else None,
+        "success": True
+    }
+
+@app.get("/api/admin/tenants")
+async def get_tenant_pools(x_admin_token: Optional[str] = Header(None)):
+    """Get open plant pools, their connection reservations and LRU/idle evictions"""
+    _require_admin(x_admin_token)
+    return {"tenants": tenant_registry.get_status(), "success": True}
+
+@app.get("/api/admin/sessions")
+async def get_session_stats(x_admin_token: Optional[str] = Header(None)):
+    """Get conversation session counts, memory use and how follow-ups were answered"""
+    _require_admin(x_admin_token)
+    return {"sessions": session_store.get_stats(), "success": True}
+
+@app.get("/api/admin/templates")
+async def get_template_metrics(x_admin_token: Optional[str] = Header(None)):
+    """Get template fast-path hit rate, precision and per-template statistics"""
+    _require_admin(x_admin_token)
+    return {"metrics": template_matcher.get_metrics(), "success": True}
+
+@app.post("/api/admin/templates/curate")
+async def curate_templates(x_admin_token: Optional[str] = Header(None)):
+    """Re-mine query templates from the persisted question/SQL history"""
+    _require_admin(x_admin_token)
+    try:
+        summary = await asyncio.to_thread(template_matcher.curate)
+        return {"curated": summary, "success": True}
+    except Exception as e:
+        logger.error(f"Failed to curate templates: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -13,6 +13,13 @@ class QueryType(str, Enum):
     ALTER = "ALTER"
     TRUNCATE = "TRUNCATE"
 
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
 class ValidationResult(BaseModel):
     is_valid: bool
     error_message: Optional[str] = None
@@ -20,6 +27,18 @@ class ValidationResult(BaseModel):
     tables_accessed: List[str] = []
     potentially_dangerous: bool = False
 
+class RewriteResult(BaseModel):
+    original_query: str
+    rewritten_query: str
+    rewrites_applied: List[str] = []
+    limit_applied: Optional[int] = None
+
+class RollupRoute(BaseModel):
+    rollup_name: str
+    routed_query: Optional[str] = None
+    refreshed_at: Optional[str] = None
+    watermark: Optional[str] = None
+
 class DatabaseColumn(BaseModel):
     column_name: str
     data_type: str
@@ -54,3 +73,15 @@ class LLMResponse(BaseModel):
     explanation: Optional[str] = None
     confidence: Optional[float] = None
     suggested_improvements: List[str] = []
+
+class QueryJobInfo(BaseModel):
+    job_id: str
+    status: JobStatus
+    question: Optional[str] = None
+    sql_query: Optional[str] = None
+    columns: List[str] = []
+    row_count: int = 0
+    error: Optional[str] = None
+    submitted_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
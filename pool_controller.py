@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Connections each pool holds outside the checkout limit for AdaptivePool.control()
+CONTROL_CONNECTIONS = 1
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class AdaptivePool:
+    """asyncpg pool wrapper whose concurrency limit grows and shrinks with acquire-wait percentiles.
+
+    The underlying pool is created with one connection more than the maximum size; the limit
+    decides how many connections queries may check out at once. It starts at the maximum, shrinks
+    while the pool is mostly idle and grows straight away when a caller would otherwise wait, so
+    a burst after an idle period never queues behind a shrunken limit. The spare connection is
+    kept for `control()` so health checks and cancellations never queue behind saturated traffic.
+    """
+
+    def __init__(self, pool, min_size: int, max_size: int):
+        self.pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.limit = max_size
+        self.interval = float(os.getenv("POOL_CONTROL_INTERVAL", "10"))
+        self.grow_wait_ms = float(os.getenv("POOL_GROW_WAIT_MS", "20"))
+        self.shrink_wait_ms = float(os.getenv("POOL_SHRINK_WAIT_MS", "1"))
+        self._condition = asyncio.Condition()
+        self._in_use = 0
+        self._waiting = 0
+        self._peak_in_use = 0
+        self._waits: List[float] = []
+        self.decisions = deque(maxlen=20)
+        self.last_window: Dict[str, Any] = {}
+
+    @asynccontextmanager
+    async def acquire(self, timeout: Optional[float] = None):
+        """Check out a connection, recording how long the caller waited for it"""
+        start = time.monotonic()
+        async with self._condition:
+            if self._in_use >= self.limit and self.limit < self.max_size:
+                # Grow on demand instead of queueing until the next controller tick
+                self._set_limit(self._in_use + 1, "caller waiting for a connection")
+            self._waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self._in_use < self.limit)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        try:
+            async with self.pool.acquire(timeout=timeout) as conn:
+                self._waits.append(time.monotonic() - start)
+                yield conn
+        finally:
+            async with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+
+    @asynccontextmanager
+    async def control(self, timeout: Optional[float] = None):
+        """Check out a connection outside the limit, for health checks and cancellations"""
+        async with self.pool.acquire(timeout=timeout) as conn:
+            yield conn
+
+    async def warm(self, count: int):
+        """Open and exercise up to `count` connections so the next burst skips connection setup"""
+        async def touch():
+            try:
+                async with self.pool.acquire(timeout=5) as conn:
+                    await conn.fetchval("SELECT 1")
+            except Exception as e:
+                logger.warning(f"Connection warm-up failed: {e}")
+
+        await asyncio.gather(*(touch() for _ in range(count)))
+
+    async def run_controller(self):
+        """Periodically resize the limit from the last window's acquire waits"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.adjust()
+            except Exception as e:
+                logger.error(f"Pool controller tick failed: {e}")
+
+    async def adjust(self):
+        waits = sorted(self._waits)
+        self._waits = []
+        peak = self._peak_in_use
+        self._peak_in_use = self._in_use
+
+        p50 = _percentile(waits, 0.5)
+        p95 = _percentile(waits, 0.95)
+        p95_ms = (p95 or 0.0) * 1000
+        waiting = self._waiting
+        self.last_window = {
+            'acquires': len(waits),
+            'waiting': waiting,
+            'wait_p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+            'wait_p95_ms': round(p95_ms, 2) if p95 is not None else None,
+            'peak_in_use': peak
+        }
+
+        if (waiting or p95_ms > self.grow_wait_ms) and self.limit < self.max_size:
+            # Callers still queued at the tick have no completed wait yet, so they count as contention too.
+            # Double on contention and shrink one at a time, so bursts are absorbed quickly without flapping
+            reason = (f"{waiting} callers waiting" if waiting
+                      else f"p95 acquire wait {p95_ms:.1f}ms > {self.grow_wait_ms}ms")
+            await self._resize(min(self.max_size, max(self.limit * 2, self.limit + waiting)), reason)
+        elif not waiting and p95_ms <= self.shrink_wait_ms and peak <= self.limit // 2 and self.limit > self.min_size:
+            await self._resize(self.limit - 1, f"peak {peak} in use of {self.limit}, p95 wait {p95_ms:.1f}ms")
+
+    async def _resize(self, new_limit: int, reason: str):
+        if new_limit > self.limit:
+            # Open the new connections before waiters are released onto them
+            await self.warm(min(new_limit, self.max_size - self._in_use))
+        async with self._condition:
+            self._set_limit(new_limit, reason)
+
+    def _set_limit(self, new_limit: int, reason: str):
+        """Change the limit and wake waiters; the caller holds the condition"""
+        old_limit = self.limit
+        self.limit = new_limit
+        self._condition.notify_all()
+
+        self.decisions.append({
+            'at': datetime.now(timezone.utc).isoformat(),
+            'action': 'grow' if new_limit > old_limit else 'shrink',
+            'from': old_limit,
+            'to': new_limit,
+            'reason': reason
+        })
+        logger.info(f"Pool limit {old_limit} -> {new_limit}: {reason}")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'in_use': self._in_use,
+            'waiting': self._waiting,
+            'open_connections': self.pool.get_size(),
+            'idle_connections': self.pool.get_idle_size(),
+            'last_window': self.last_window,
+            'decisions': list(self.decisions)
+        }
+
+    async def close(self):
+        await self.pool.close()
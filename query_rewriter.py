@@ -0,0 +1,309 @@
+import os
+import re
+import logging
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+import sqlparse
+from sqlparse import sql, tokens
+
+from models import RewriteResult
+
+logger = logging.getLogger(__name__)
+
+# Plain (optionally alias-qualified) column reference, e.g. "pr.start_timestamp"
+COLUMN_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+AGGREGATE_FUNCTIONS = {
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'BOOL_AND', 'BOOL_OR', 'EVERY',
+    'STRING_AGG', 'ARRAY_AGG', 'JSON_AGG', 'JSONB_AGG', 'STDDEV', 'VARIANCE',
+    'PERCENTILE_CONT', 'PERCENTILE_DISC', 'MODE'
+}
+
+TRUNCATE_UNITS = ('year', 'month', 'day', 'hour', 'minute')
+
+
+class SQLRewriter:
+    """Rewrites validated SELECT queries into index-friendly (sargable) form"""
+
+    def __init__(self, default_limit: Optional[int] = None):
+        if default_limit is None:
+            default_limit = int(os.getenv("SQL_DEFAULT_LIMIT", "1000"))
+        # A limit of 0 disables LIMIT injection
+        self.default_limit = default_limit
+
+    def rewrite_query(self, sql_query: str, inject_limit: bool = True) -> RewriteResult:
+        """Rewrite wrapped timestamp predicates and inject a LIMIT when missing"""
+        try:
+            parsed = sqlparse.parse(sql_query)
+            if not parsed:
+                return RewriteResult(original_query=sql_query, rewritten_query=sql_query)
+
+            statement = parsed[0]
+            rewrites_applied = []
+            self._rewrite_token_list(statement, rewrites_applied)
+
+            rewritten = str(statement).strip()
+            limit_applied = None
+            if inject_limit and self.default_limit and self._needs_limit(statement):
+                rewritten = rewritten.rstrip(';').rstrip()
+                rewritten += f"\nLIMIT {self.default_limit};"
+                limit_applied = self.default_limit
+
+            if rewrites_applied or limit_applied:
+                logger.info(f"Query rewritten: {len(rewrites_applied)} predicate(s), limit={limit_applied}")
+
+            return RewriteResult(
+                original_query=sql_query,
+                rewritten_query=rewritten,
+                rewrites_applied=rewrites_applied,
+                limit_applied=limit_applied
+            )
+
+        except Exception as e:
+            # Rewriting is an optimization only - never fail the query because of it
+            logger.warning(f"Query rewrite skipped: {e}")
+            return RewriteResult(original_query=sql_query, rewritten_query=sql_query)
+
+    def _rewrite_token_list(self, token_list, rewrites_applied: List[str]):
+        """Walk the parse tree and replace non-sargable predicates in place"""
+        self._rewrite_between(token_list, rewrites_applied)
+
+        for token in token_list.tokens:
+            if isinstance(token, sql.Comparison):
+                replacement = self._rewrite_comparison(token)
+                if replacement:
+                    rewrites_applied.append(f"{str(token).strip()} -> {replacement}")
+                    self._replace_token(token, replacement)
+                    continue
+            if token.is_group:
+                self._rewrite_token_list(token, rewrites_applied)
+
+    def _rewrite_comparison(self, comparison) -> Optional[str]:
+        """Rewrite '<wrapped column> <op> <literal>' as a half-open range predicate"""
+        parts = [t for t in comparison.tokens if not t.is_whitespace]
+        if len(parts) != 3:
+            return None
+
+        left, operator, right = parts
+        operator = str(operator).strip()
+        wrapped = self._unwrap_column(left)
+        if not wrapped:
+            return None
+
+        column, unit = wrapped
+        bucket = self._bucket_for_literal(right, unit)
+        if not bucket:
+            return None
+
+        lower, upper = bucket
+        if operator == '=':
+            return f"({column} >= {lower} AND {column} < {upper})"
+        if operator == '>=':
+            return f"{column} >= {lower}"
+        if operator == '>':
+            return f"{column} >= {upper}"
+        if operator == '<':
+            return f"{column} < {lower}"
+        if operator == '<=':
+            return f"{column} < {upper}"
+        return None
+
+    def _rewrite_between(self, token_list, rewrites_applied: List[str]):
+        """Rewrite '<wrapped column> BETWEEN <a> AND <b>' as a half-open range"""
+        children = token_list.tokens
+        index = 0
+        while index < len(children):
+            token = children[index]
+            if not token.is_keyword or token.normalized != 'BETWEEN':
+                index += 1
+                continue
+
+            # Locate the operands around BETWEEN, skipping whitespace
+            left_idx = self._neighbour(children, index, -1)
+            start_idx = self._neighbour(children, index, 1)
+            and_idx = self._neighbour(children, start_idx, 1)
+            end_idx = self._neighbour(children, and_idx, 1)
+            if None in (left_idx, start_idx, and_idx, end_idx) or children[and_idx].normalized != 'AND':
+                index += 1
+                continue
+
+            # NOT BETWEEN leaves a NOT keyword on the left and is never unwrapped
+            wrapped = self._unwrap_column(children[left_idx])
+            if not wrapped:
+                index += 1
+                continue
+
+            column, unit = wrapped
+            start_bucket = self._bucket_for_literal(children[start_idx], unit)
+            end_bucket = self._bucket_for_literal(children[end_idx], unit)
+            if not start_bucket or not end_bucket:
+                index += 1
+                continue
+
+            original = ''.join(str(t) for t in children[left_idx:end_idx + 1])
+            replacement = f"({column} >= {start_bucket[0]} AND {column} < {end_bucket[1]})"
+            rewrites_applied.append(f"{original} -> {replacement}")
+
+            new_token = sql.Token(tokens.Text, replacement)
+            new_token.parent = token_list
+            children[left_idx:end_idx + 1] = [new_token]
+            index = left_idx + 1
+
+    def _neighbour(self, children, index: Optional[int], step: int) -> Optional[int]:
+        """Return the index of the next non-whitespace sibling"""
+        if index is None:
+            return None
+        index += step
+        while 0 <= index < len(children):
+            if not children[index].is_whitespace:
+                return index
+            index += step
+        return None
+
+    def _unwrap_column(self, token) -> Optional[Tuple[str, str]]:
+        """Return (column, truncation unit) if the token wraps a bare column in a date/time function or cast"""
+        if isinstance(token, sql.Identifier):
+            # col::date
+            children = [t for t in token.tokens if not t.is_whitespace]
+            for i, child in enumerate(children):
+                if child.match(tokens.Punctuation, '::'):
+                    column = ''.join(str(t) for t in children[:i])
+                    cast_type = ''.join(str(t) for t in children[i + 1:]).strip().lower()
+                    if cast_type == 'date' and COLUMN_PATTERN.match(column):
+                        return column, 'day'
+                    return None
+            return None
+
+        if not isinstance(token, sql.Function):
+            return None
+
+        name = token.get_name()
+        if not name:
+            return None
+        name = name.upper()
+        parenthesis = next((t for t in token.tokens if isinstance(t, sql.Parenthesis)), None)
+        if parenthesis is None:
+            return None
+        inner = str(parenthesis)[1:-1].strip()
+
+        if name == 'DATE' and COLUMN_PATTERN.match(inner):
+            return inner, 'day'
+
+        if name == 'CAST':
+            match = re.match(r'^(\S+)\s+AS\s+DATE$', inner, re.IGNORECASE)
+            if match and COLUMN_PATTERN.match(match.group(1)):
+                return match.group(1), 'day'
+            return None
+
+        if name == 'DATE_TRUNC':
+            match = re.match(r"^'(\w+)'\s*,\s*(\S+)$", inner)
+            if match and match.group(1).lower() in TRUNCATE_UNITS and COLUMN_PATTERN.match(match.group(2)):
+                return match.group(2), match.group(1).lower()
+            return None
+
+        if name == 'EXTRACT':
+            # Only YEAR is monotonic in the underlying timestamp
+            match = re.match(r'^YEAR\s+FROM\s+(\S+)$', inner, re.IGNORECASE)
+            if match and COLUMN_PATTERN.match(match.group(1)):
+                return match.group(1), 'extract_year'
+            return None
+
+        return None
+
+    def _bucket_for_literal(self, token, unit: str) -> Optional[Tuple[str, str]]:
+        """Return the [lower, upper) SQL literals of the bucket the literal denotes"""
+        if unit == 'extract_year':
+            if token.ttype not in tokens.Literal.Number.Integer:
+                return None
+            year = int(str(token))
+            return self._format_literal(datetime(year, 1, 1)), self._format_literal(datetime(year + 1, 1, 1))
+
+        if token.ttype not in tokens.Literal.String.Single:
+            return None
+
+        value = str(token)[1:-1]
+        try:
+            if unit == 'day' and len(value) == 10:
+                start = datetime.combine(date.fromisoformat(value), datetime.min.time())
+            else:
+                start = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+        # A comparison against an unaligned value is not a bucket boundary
+        if start.tzinfo is not None or start != self._truncate(start, unit):
+            return None
+
+        return self._format_literal(start), self._format_literal(self._next_bucket(start, unit))
+
+    def _truncate(self, value: datetime, unit: str) -> datetime:
+        """Truncate a timestamp to the start of its bucket"""
+        if unit == 'year':
+            return value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        if unit == 'month':
+            return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if unit == 'day':
+            return value.replace(hour=0, minute=0, second=0, microsecond=0)
+        if unit == 'hour':
+            return value.replace(minute=0, second=0, microsecond=0)
+        return value.replace(second=0, microsecond=0)
+
+    def _next_bucket(self, value: datetime, unit: str) -> datetime:
+        """Return the start of the bucket following the one starting at value"""
+        if unit == 'year':
+            return value.replace(year=value.year + 1)
+        if unit == 'month':
+            if value.month == 12:
+                return value.replace(year=value.year + 1, month=1)
+            return value.replace(month=value.month + 1)
+        if unit == 'day':
+            return value + timedelta(days=1)
+        if unit == 'hour':
+            return value + timedelta(hours=1)
+        return value + timedelta(minutes=1)
+
+    def _format_literal(self, value: datetime) -> str:
+        """Format a bucket boundary as a SQL literal"""
+        if value.hour == value.minute == value.second == 0:
+            return f"'{value.date().isoformat()}'"
+        return f"'{value.isoformat()}'"
+
+    def _replace_token(self, token, replacement: str):
+        """Replace a grouped token's contents with literal SQL text"""
+        new_token = sql.Token(tokens.Text, replacement)
+        new_token.parent = token
+        token.tokens = [new_token]
+        token.value = replacement
+
+    def _needs_limit(self, statement) -> bool:
+        """Check whether the outermost query lacks a LIMIT and returns unaggregated rows"""
+        in_select_list = False
+        for token in statement.tokens:
+            if token.is_whitespace:
+                continue
+            if token.ttype is tokens.Keyword.DML and token.normalized == 'SELECT':
+                in_select_list = True
+                continue
+            if token.is_keyword and token.normalized in ('LIMIT', 'FETCH', 'GROUP BY'):
+                return False
+            if token.is_keyword and token.normalized == 'FROM':
+                in_select_list = False
+                continue
+            if in_select_list and self._has_aggregate(token):
+                return False
+        return True
+
+    def _has_aggregate(self, token) -> bool:
+        """Check whether a select-list item calls an aggregate function (window functions excluded)"""
+        if isinstance(token, sql.Function):
+            name = (token.get_name() or '').upper()
+            is_window = any(isinstance(t, sql.Over) for t in token.tokens)
+            if name in AGGREGATE_FUNCTIONS:
+                return not is_window
+            # Aggregates wrapped in scalar functions, e.g. ROUND(AVG(x), 1)
+            return any(self._has_aggregate(t) for p in token.tokens if isinstance(p, sql.Parenthesis)
+                       for t in p.tokens)
+        if token.is_group and not isinstance(token, sql.Parenthesis):
+            return any(self._has_aggregate(t) for t in token.tokens)
+        return False
@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import random
+import hashlib
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+# Slot patterns in priority order; earlier matches win over overlapping later ones
+SLOT_PATTERNS = [
+    ('timestamp', re.compile(r'\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?')),
+    ('date', re.compile(r'\b\d{4}-\d{2}-\d{2}\b')),
+    ('date', re.compile(
+        r'\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?(?:,?\s+(\d{4}))?\b',
+        re.IGNORECASE
+    )),
+    ('machine', re.compile(r'\b[A-Z]{2,4}-\d{2,4}\b')),
+    ('shift', re.compile(r'\b(day|night|morning|afternoon|evening|swing)(?=\s+shifts?\b)', re.IGNORECASE)),
+    ('number', re.compile(r'\b\d+(?:\.\d+)?\b')),
+]
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+?)_(\d+)(?::(\w+))?\}')
+
+# Filler words a question may add, drop or swap without changing its meaning. Anything else that
+# differs from a template's shape (passed/failed, top/bottom, total/average, not) goes to the LLM
+STOP_WORDS = {
+    'a', 'an', 'the', 'please', 'kindly', 'me', 'us', 'i', 'you', 'can', 'could', 'would',
+    'show', 'list', 'give', 'get', 'tell', 'display', 'find', 'return', 'see', 'want', 'to', 'need', 'just'
+}
+
+
+class QueryHistory:
+    """Append-only JSON-lines log of successful question/SQL pairs"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("QUERY_HISTORY_PATH", "query_history.jsonl")
+
+    def record(self, question: str, sql_query: str):
+        """Persist a question whose LLM-generated SQL executed successfully"""
+        try:
+            with open(self.path, 'a', encoding='utf-8') as history_file:
+                history_file.write(json.dumps({
+                    'question': question,
+                    'sql_query': sql_query,
+                    'recorded_at': datetime.now(timezone.utc).isoformat()
+                }) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to record query history: {e}")
+
+    def load(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, encoding='utf-8') as history_file:
+            for line in history_file:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+
+class TemplateMatcher:
+    """Answers recurring question shapes from parameterized SQL templates mined from query history"""
+
+    def __init__(self, history: QueryHistory, templates_path: Optional[str] = None):
+        self.history = history
+        self.templates_path = templates_path or os.getenv("QUERY_TEMPLATES_PATH", "query_templates.json")
+        self.min_support = int(os.getenv("TEMPLATE_MIN_SUPPORT", "2"))
+        self.shadow_rate = float(os.getenv("TEMPLATE_SHADOW_RATE", "0.05"))
+        self.min_precision = float(os.getenv("TEMPLATE_MIN_PRECISION", "0.8"))
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        self.stats = {'requests': 0, 'template_hits': 0, 'fallthroughs': 0}
+
+    def load(self):
+        """Load curated templates, curating from history if none were saved yet"""
+        if os.path.exists(self.templates_path):
+            with open(self.templates_path, encoding='utf-8') as templates_file:
+                self.templates = {t['template_id']: t for t in json.load(templates_file)}
+        else:
+            self.curate()
+        logger.info(f"Loaded {len(self.templates)} query templates")
+
+    def save(self):
+        with open(self.templates_path, 'w', encoding='utf-8') as templates_file:
+            json.dump(list(self.templates.values()), templates_file, indent=2)
+
+    def extract_slots(self, question: str) -> Tuple[str, List[Tuple[str, Any]]]:
+        """Replace dates, machines, shifts and numbers with typed markers; return (shape, slots)"""
+        spans = []
+        for slot_type, pattern in SLOT_PATTERNS:
+            for match in pattern.finditer(question):
+                if any(match.start() < end and start < match.end() for start, end, _, _ in spans):
+                    continue
+                value = self._parse_slot(slot_type, match, question)
+                if value is not None:
+                    spans.append((match.start(), match.end(), slot_type, value))
+        spans.sort()
+
+        shape, slots, cursor = "", [], 0
+        for start, end, slot_type, value in spans:
+            shape += question[cursor:start] + f" <{slot_type}> "
+            slots.append((slot_type, value))
+            cursor = end
+        shape += question[cursor:]
+        shape = re.sub(r"[^a-z0-9<> ]+", " ", shape.lower())
+        return re.sub(r"\s+", " ", shape).strip(), slots
+
+    def _parse_slot(self, slot_type: str, match, question: str):
+        text = match.group(0)
+        if slot_type == 'timestamp':
+            return text
+        if slot_type == 'date':
+            if match.lastindex:
+                year = int(match.group(3)) if match.group(3) else self._implied_year(question)
+                try:
+                    return date(year, MONTHS[match.group(1).lower()[:3]], int(match.group(2)))
+                except ValueError:
+                    return None
+            try:
+                return date.fromisoformat(text)
+            except ValueError:
+                return None
+        if slot_type == 'shift':
+            return text.lower()
+        return text
+
+    def _implied_year(self, question: str) -> int:
+        """Year for month-day dates without one: another year in the question, else the current year"""
+        years = re.findall(r'\b(20\d{2})\b', question)
+        return int(years[0]) if years else datetime.now(timezone.utc).year
+
+    def _literal_forms(self, slot_type: str, value) -> List[Tuple[str, str, bool]]:
+        """SQL text forms of a slot value as (literal, placeholder modifier, derived from the value)"""
+        if slot_type == 'date':
+            return [(value.isoformat(), '', False), ((value + timedelta(days=1)).isoformat(), 'next', True)]
+        if slot_type == 'shift':
+            return [(value.title(), 'title', False), (value.upper(), 'upper', False), (value, '', False)]
+        return [(str(value), '', False)]
+
+    def _generalize_sql(self, sql_query: str, slots: List[Tuple[str, Any]]) -> Optional[str]:
+        """Replace slot values inside the SQL with placeholders; None if a slot can't be located"""
+        generalized = sql_query
+        found = [False] * len(slots)
+        # Exact forms of every slot first, so derived forms (next day) can't steal another slot's value
+        for derived in (False, True):
+            for index, (slot_type, value) in enumerate(slots):
+                for literal, modifier, is_derived in self._literal_forms(slot_type, value):
+                    if is_derived != derived:
+                        continue
+                    placeholder = f"{{{slot_type}_{index}{':' + modifier if modifier else ''}}}"
+                    if slot_type in ('date', 'timestamp'):
+                        pattern = re.escape(literal)
+                    else:
+                        pattern = rf'(?<![\w.-]){re.escape(literal)}(?![\w-]|\.\d)'
+                    generalized, count = re.subn(pattern, placeholder, generalized)
+                    found[index] = found[index] or count > 0
+        if not all(found):
+            return None
+        return generalized
+
+    def curate(self) -> Dict[str, Any]:
+        """Promote question shapes whose generalized SQL agrees across enough history entries"""
+        candidates: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for entry in self.history.load():
+            shape, slots = self.extract_slots(entry['question'])
+            generalized = self._generalize_sql(entry['sql_query'], slots)
+            if generalized is None:
+                continue
+            key = (shape, generalized)
+            candidate = candidates.setdefault(key, {'questions': set(), 'slot_types': [t for t, _ in slots]})
+            candidate['questions'].add(entry['question'].strip().lower())
+
+        templates = {}
+        for (shape, generalized), candidate in candidates.items():
+            if len(candidate['questions']) < self.min_support:
+                continue
+            template_id = hashlib.sha256(f"{shape}\n{generalized}".encode()).hexdigest()[:12]
+            previous = self.templates.get(template_id, {})
+            templates[template_id] = {
+                'template_id': template_id,
+                'shape': shape,
+                'slot_types': candidate['slot_types'],
+                'sql_template': generalized,
+                'support': len(candidate['questions']),
+                'enabled': previous.get('enabled', True),
+                'stats': previous.get('stats', {'hits': 0, 'errors': 0, 'shadow_checks': 0, 'shadow_agreements': 0})
+            }
+
+        # Keep the best supported template per shape
+        by_shape: Dict[str, Dict[str, Any]] = {}
+        for template in templates.values():
+            best = by_shape.get(template['shape'])
+            if not best or template['support'] > best['support']:
+                by_shape[template['shape']] = template
+
+        self.templates = {t['template_id']: t for t in by_shape.values()}
+        self.save()
+        logger.info(f"Curated {len(self.templates)} query templates from history")
+        return {'templates': len(self.templates), 'candidates': len(candidates)}
+
+    def match(self, question: str) -> Optional[Dict[str, Any]]:
+        """Return {template_id, sql_query, match} when a template's shape matches the question's.
+
+        The shapes must be equal, or differ only in STOP_WORDS; a rendered template is never
+        a guess, since near-miss shapes often ask something else entirely.
+        """
+        self.stats['requests'] += 1
+        shape, slots = self.extract_slots(question)
+        slot_types = [t for t, _ in slots]
+        content = self._content_words(shape)
+
+        best, best_rank = None, None
+        for template in self.templates.values():
+            if not template['enabled'] or template['slot_types'] != slot_types:
+                continue
+            if template['shape'] == shape:
+                rank = (1, template['support'])
+            elif self._content_words(template['shape']) == content:
+                rank = (0, template['support'])
+            else:
+                continue
+            if best_rank is None or rank > best_rank:
+                best, best_rank = template, rank
+
+        if not best:
+            self.stats['fallthroughs'] += 1
+            return None
+
+        self.stats['template_hits'] += 1
+        best['stats']['hits'] += 1
+        return {
+            'template_id': best['template_id'],
+            'sql_query': self._render(best['sql_template'], slots),
+            'match': 'exact' if best_rank[0] else 'stop_words'
+        }
+
+    def _content_words(self, shape: str) -> List[str]:
+        return [word for word in shape.split() if word not in STOP_WORDS]
+
+    def _render(self, sql_template: str, slots: List[Tuple[str, Any]]) -> str:
+        def replace(match):
+            slot_type, value = slots[int(match.group(2))]
+            modifier = match.group(3)
+            if slot_type == 'date':
+                return (value + timedelta(days=1 if modifier == 'next' else 0)).isoformat()
+            if modifier == 'title':
+                return str(value).title()
+            if modifier == 'upper':
+                return str(value).upper()
+            return str(value)
+        return PLACEHOLDER_PATTERN.sub(replace, sql_template)
+
+    def should_shadow(self) -> bool:
+        """Sample template answers for verification against the LLM"""
+        return random.random() < self.shadow_rate
+
+    def record_outcome(self, template_id: str, success: bool):
+        template = self.templates.get(template_id)
+        if template and not success:
+            template['stats']['errors'] += 1
+
+    def record_shadow(self, template_id: str, agreed: bool):
+        """Record an LLM cross-check; disable templates whose precision drops below the minimum"""
+        template = self.templates.get(template_id)
+        if not template:
+            return
+        stats = template['stats']
+        stats['shadow_checks'] += 1
+        stats['shadow_agreements'] += int(agreed)
+        if stats['shadow_checks'] >= 5 and self._precision(template) < self.min_precision:
+            template['enabled'] = False
+            logger.warning(f"Template {template_id} disabled: precision {self._precision(template):.2f}")
+
+    def _precision(self, template: Dict[str, Any]) -> Optional[float]:
+        stats = template['stats']
+        if not stats['shadow_checks']:
+            return None
+        return stats['shadow_agreements'] / stats['shadow_checks']
+
+    def get_metrics(self) -> Dict[str, Any]:
+        requests = self.stats['requests']
+        checks = sum(t['stats']['shadow_checks'] for t in self.templates.values())
+        agreements = sum(t['stats']['shadow_agreements'] for t in self.templates.values())
+        return {
+            **self.stats,
+            'hit_rate': self.stats['template_hits'] / requests if requests else None,
+            'precision': agreements / checks if checks else None,
+            'templates': [
+                {
+                    'template_id': t['template_id'],
+                    'shape': t['shape'],
+                    'support': t['support'],
+                    'enabled': t['enabled'],
+                    'precision': self._precision(t),
+                    **t['stats']
+                }
+                for t in self.templates.values()
+            ]
+        }
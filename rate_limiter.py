@@ -0,0 +1,216 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds from Groq reset headers ("7.66s", "2m59.56s", "120ms") or plain numbers"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header given as delay-seconds or an HTTP date"""
+    seconds = parse_duration(value)
+    if seconds is not None or not value:
+        return seconds
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Continuously refilling bucket; the level may go negative when a reservation exceeds it"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # Requests larger than the whole bucket wait for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_per_second
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    def set_level(self, level: float, now: float):
+        self._refill(now)
+        self.level = min(level, self.capacity)
+
+    def reconfigure(self, capacity: float, refill_per_second: float, now: float):
+        self._refill(now)
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = min(self.level, capacity)
+
+
+class ModelRateLimiter:
+    """Request and token buckets for one Groq model, synced from x-ratelimit-* response headers"""
+
+    def __init__(self, model: str, requests_per_minute: int, tokens_per_minute: int):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        # Hard pause from Retry-After or an exhausted server-side quota
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+        self.stats = {
+            'requests': 0,
+            'throttled_requests': 0,
+            'throttled_seconds': 0.0,
+            'rate_limited_responses': 0,
+            'rejected': 0
+        }
+
+    async def acquire(self, tokens: int, max_wait: float) -> bool:
+        """Wait in FIFO order until one request and `tokens` tokens are available.
+
+        Returns False without consuming anything when the wait would exceed max_wait.
+        """
+        deadline = time.monotonic() + max_wait
+        throttled = False
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    wait = max(
+                        self.blocked_until - now,
+                        self.requests.wait_time(1, now),
+                        self.tokens.wait_time(tokens, now)
+                    )
+                    if wait <= 0:
+                        self.requests.consume(1, now)
+                        self.tokens.consume(tokens, now)
+                        self.stats['requests'] += 1
+                        return True
+                    if now + wait > deadline:
+                        self.stats['rejected'] += 1
+                        return False
+                    if not throttled:
+                        self.stats['throttled_requests'] += 1
+                        throttled = True
+                    self.stats['throttled_seconds'] += wait
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+    def refund(self, tokens: int):
+        """Return reserved tokens the call didn't use"""
+        if tokens > 0:
+            self.tokens.consume(-tokens, time.monotonic())
+            self.tokens.level = min(self.tokens.level, self.tokens.capacity)
+
+    def update_from_headers(self, headers):
+        """Adopt the server's view of the remaining quota"""
+        now = time.monotonic()
+
+        # Groq reports tokens per minute; the request limit is per day, so only its exhaustion is enforced
+        limit_tokens = _parse_int(headers.get('x-ratelimit-limit-tokens'))
+        if limit_tokens:
+            self.tokens.reconfigure(limit_tokens, limit_tokens / 60, now)
+        remaining_tokens = _parse_int(headers.get('x-ratelimit-remaining-tokens'))
+        if remaining_tokens is not None:
+            self.tokens.set_level(remaining_tokens, now)
+
+        remaining_requests = _parse_int(headers.get('x-ratelimit-remaining-requests'))
+        reset_requests = parse_duration(headers.get('x-ratelimit-reset-requests'))
+        if remaining_requests == 0 and reset_requests:
+            self.blocked_until = max(self.blocked_until, now + reset_requests)
+
+    def record_rate_limited(self, headers, attempt: int):
+        """Pause the model after a 429 for Retry-After, else the token reset, else exponential backoff"""
+        self.stats['rate_limited_responses'] += 1
+        delay = parse_retry_after(headers.get('retry-after'))
+        if delay is None:
+            delay = parse_duration(headers.get('x-ratelimit-reset-tokens'))
+        if delay is None:
+            delay = min(2 ** attempt, 30)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    def get_metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        return {
+            **self.stats,
+            'throttled_seconds': round(self.stats['throttled_seconds'], 3),
+            'queue_depth': self.waiting,
+            'available_requests': round(self.requests.level, 1),
+            'available_tokens': round(self.tokens.level),
+            'tokens_per_minute': self.tokens.capacity,
+            'blocked_for_seconds': round(max(0.0, self.blocked_until - now), 3)
+        }
+
+
+class GroqRateLimiter:
+    """Per-model client-side pacing for the Groq API"""
+
+    def __init__(self):
+        self.requests_per_minute = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+        self.tokens_per_minute = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "6000"))
+        # Longest a call queues for one model before moving to the next
+        self.max_wait = float(os.getenv("GROQ_MAX_QUEUE_WAIT", "30"))
+        self.max_retries = int(os.getenv("GROQ_MAX_RATE_LIMIT_RETRIES", "3"))
+        self.models: Dict[str, ModelRateLimiter] = {}
+
+    def for_model(self, model: str) -> ModelRateLimiter:
+        if model not in self.models:
+            self.models[model] = ModelRateLimiter(model, self.requests_per_minute, self.tokens_per_minute)
+        return self.models[model]
+
+    @property
+    def queue_depth(self) -> int:
+        """Calls currently waiting for quota across all models"""
+        return sum(limiter.waiting for limiter in self.models.values())
+
+    def get_metrics(self) -> Dict[str, Any]:
+        models = {name: limiter.get_metrics() for name, limiter in self.models.items()}
+        return {
+            'queue_depth': sum(m['queue_depth'] for m in models.values()),
+            'throttled_requests': sum(m['throttled_requests'] for m in models.values()),
+            'throttled_seconds': round(sum(m['throttled_seconds'] for m in models.values()), 3),
+            'rate_limited_responses': sum(m['rate_limited_responses'] for m in models.values()),
+            'rejected': sum(m['rejected'] for m in models.values()),
+            'max_wait': self.max_wait,
+            'models': models
+        }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Traffic replay
+Re-drives captured /api/query traffic against a running server and compares latency with the capture
+Usage: python replay_traffic.py CAPTURE_PATH [SPEED] [BASE_URL] [RESULTS_JSON]
+
+CAPTURE_PATH  a capture-*.jsonl.gz file or the CAPTURE_DIR holding them
+SPEED         1 = original pacing, 2 = twice as fast, 0 = back to back (default 1)
+BASE_URL      server under test (default http://localhost:5000)
+RESULTS_JSON  where to write per-request latencies for comparing builds
+
+For deterministic runs start the server under test with LLM_REPLAY_PATH=CAPTURE_PATH, so recorded
+Groq responses are served from the capture, and an empty SQL cache.
+"""
+
+import sys
+import json
+import time
+import asyncio
+from typing import List, Dict, Any, Optional
+
+import aiohttp
+
+from traffic_capture import read_capture
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    ordered = sorted(values)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+    return f"p50 {pick(0.5):8.1f}ms  p95 {pick(0.95):8.1f}ms  p99 {pick(0.99):8.1f}ms  max {ordered[-1]:8.1f}ms"
+
+
+async def replay_one(session: aiohttp.ClientSession, base_url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        async with session.post(f"{base_url}{entry['endpoint']}", json=entry['request']) as response:
+            body = await response.json()
+        error = body.get('error')
+        success = body.get('success', False)
+        sql_query = body.get('sql_query')
+    except Exception as e:
+        error, success, sql_query = str(e), False, None
+    return {
+        'question': entry['request'].get('question'),
+        'captured_ms': entry.get('total_ms'),
+        'replayed_ms': round((time.perf_counter() - started) * 1000, 2),
+        'captured_success': entry.get('success'),
+        'success': success,
+        'error': error,
+        'same_sql': sql_query == entry.get('sql_query')
+    }
+
+
+async def replay(capture_path: str, speed: float, base_url: str) -> List[Dict[str, Any]]:
+    entries = sorted(
+        (e for e in read_capture(capture_path) if e.get('error') != "client disconnected"),
+        key=lambda e: e['ts']
+    )
+    if not entries:
+        return []
+
+    print(f"Replaying {len(entries)} requests at {'unpaced' if speed <= 0 else f'{speed}x'} against {base_url}")
+    first_ts = entries[0]['ts']
+    replay_start = time.monotonic()
+
+    async def paced(entry):
+        if speed > 0:
+            await asyncio.sleep(max(0.0, replay_start + (entry['ts'] - first_ts) / speed - time.monotonic()))
+        return await replay_one(session, base_url, entry)
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        if speed > 0:
+            return await asyncio.gather(*(paced(entry) for entry in entries))
+        return [await replay_one(session, base_url, entry) for entry in entries]
+
+
+def report(results: List[Dict[str, Any]], results_path: Optional[str]):
+    if not results:
+        print("No captured requests found")
+        return
+
+    captured = [r['captured_ms'] for r in results if r['captured_ms'] is not None and r['captured_success']]
+    replayed = [r['replayed_ms'] for r in results if r['success']]
+    print(f"captured  {percentiles(captured)}")
+    print(f"replayed  {percentiles(replayed)}")
+    print(f"succeeded {sum(r['success'] for r in results)}/{len(results)} "
+          f"(captured {sum(bool(r['captured_success']) for r in results)}), "
+          f"same SQL {sum(r['same_sql'] for r in results)}/{len(results)}")
+
+    slowest = sorted(
+        (r for r in results if r['success'] and r['captured_ms']),
+        key=lambda r: r['replayed_ms'] - r['captured_ms'],
+        reverse=True
+    )[:5]
+    for r in slowest:
+        print(f"  {r['replayed_ms'] - r['captured_ms']:+9.1f}ms  {r['question']}")
+
+    if results_path:
+        with open(results_path, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+        print(f"Per-request results written to {results_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    capture_path = sys.argv[1]
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    base_url = (sys.argv[3] if len(sys.argv) > 3 else "http://localhost:5000").rstrip("/")
+    results_path = sys.argv[4] if len(sys.argv) > 4 else None
+
+    print("=== Traffic Replay ===")
+    report(asyncio.run(replay(capture_path, speed, base_url)), results_path)
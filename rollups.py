@@ -0,0 +1,475 @@
+import os
+import re
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
+
+from models import RollupRoute
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE_PREFIX = "rollup_"
+ROLLUP_STATE_TABLE = "rollup_state"
+
+# Daily summary tables maintained from the raw fact tables. Dimensions and
+# measures that don't exist in the connected schema are dropped at startup.
+# Derived measures map a column name to (expression, required source columns).
+ROLLUP_DEFINITIONS = [
+    {
+        "name": "rollup_production_daily",
+        "source_table": "production_runs",
+        "time_column": "start_timestamp",
+        "dimensions": ["machine_id", "shift_id", "operation_id", "operator_id"],
+        "sum_measures": ["planned_units", "actual_units", "rejected_units"],
+        "derived_measures": {
+            "run_hours": ("EXTRACT(EPOCH FROM (end_timestamp - start_timestamp)) / 3600",
+                          ["start_timestamp", "end_timestamp"])
+        },
+        "description": "production totals per day, machine and shift",
+    },
+    {
+        "name": "rollup_downtime_daily",
+        "source_table": "machine_downtime",
+        "time_column": "start_timestamp",
+        "dimensions": ["machine_id", "reason", "downtime_type"],
+        "sum_measures": [],
+        "derived_measures": {
+            "downtime_hours": ("EXTRACT(EPOCH FROM (end_timestamp - start_timestamp)) / 3600",
+                               ["start_timestamp", "end_timestamp"])
+        },
+        "description": "downtime events and hours per day and machine",
+    },
+    {
+        "name": "rollup_quality_daily",
+        "source_table": "quality_checks",
+        "time_column": "check_timestamp",
+        "dimensions": ["result", "check_type"],
+        "sum_measures": [],
+        "derived_measures": {},
+        "description": "quality check counts per day and result",
+    },
+]
+
+ROW_COUNT_COLUMN = "row_count"
+BUCKET_COLUMN = "bucket_date"
+# Non-NULL count stored beside each summed measure so routed AVG ignores NULLs like AVG does
+MEASURE_COUNT_SUFFIX = "_count"
+
+
+def measure_count_column(column: str) -> str:
+    return f"{column}{MEASURE_COUNT_SUFFIX}"
+
+
+class RollupManager:
+    """Maintains pre-aggregated daily rollup tables and routes eligible queries to them"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.lookback_days = int(os.getenv("ROLLUP_LOOKBACK_DAYS", "1"))
+        self.max_staleness = int(os.getenv("ROLLUP_MAX_STALENESS", "3600"))
+        self.refresh_interval = int(os.getenv("ROLLUP_REFRESH_INTERVAL", "0"))
+        self.rollups: Dict[str, Dict[str, Any]] = {}
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self._refresh_lock = asyncio.Lock()
+
+    async def initialize(self, schema_info: List[Dict[str, Any]]):
+        """Resolve rollup definitions against the schema and load refresh state"""
+        columns_by_table = {
+            table['table_name']: {column['column_name'] for column in table['columns']}
+            for table in schema_info
+        }
+
+        self.rollups = {}
+        for definition in ROLLUP_DEFINITIONS:
+            columns = columns_by_table.get(definition["source_table"])
+            if not columns or definition["time_column"] not in columns:
+                logger.info(f"Rollup {definition['name']} disabled: source columns not found")
+                continue
+
+            derived = {
+                name: expression for name, (expression, required) in definition["derived_measures"].items()
+                if all(col in columns for col in required)
+            }
+            self.rollups[definition["name"]] = {
+                **definition,
+                "dimensions": [col for col in definition["dimensions"] if col in columns],
+                "sum_measures": [col for col in definition["sum_measures"] if col in columns],
+                "derived_measures": derived,
+            }
+
+        if ROLLUP_STATE_TABLE in columns_by_table:
+            await self._load_state()
+
+    async def _load_state(self):
+        """Load refresh timestamps and watermarks from the state table"""
+        try:
+            async with self.db_manager.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    f"SELECT rollup_name, refreshed_at, watermark FROM {ROLLUP_STATE_TABLE}"
+                )
+            self.state = {
+                row['rollup_name']: {
+                    'refreshed_at': row['refreshed_at'],
+                    'watermark': row['watermark']
+                }
+                for row in rows if row['rollup_name'] in self.rollups
+            }
+        except Exception as e:
+            logger.warning(f"Failed to load rollup state: {e}")
+
+    def _select_list(self, rollup: Dict[str, Any]) -> str:
+        """Build the aggregate select list shared by table creation and refresh"""
+        items = [f"({rollup['time_column']})::date AS {BUCKET_COLUMN}"]
+        items += rollup["dimensions"]
+        items.append(f"COUNT(*) AS {ROW_COUNT_COLUMN}")
+        items += [f"SUM({col}) AS {col}" for col in rollup["sum_measures"]]
+        items += [f"SUM({expr}) AS {name}" for name, expr in rollup["derived_measures"].items()]
+        # Last, so tables created before these columns existed line up after ALTER TABLE ADD COLUMN
+        items += [f"COUNT({col}) AS {measure_count_column(col)}" for col in rollup["sum_measures"]]
+        return ", ".join(items)
+
+    def _measures(self, rollup: Dict[str, Any]) -> set:
+        """Columns of the rollup that may only be read through SUM()"""
+        return (set(rollup["sum_measures"]) | set(rollup["derived_measures"]) | {ROW_COUNT_COLUMN}
+                | {measure_count_column(col) for col in rollup["sum_measures"]})
+
+    def _group_by(self, rollup: Dict[str, Any]) -> str:
+        """GROUP BY positions for the bucket and dimension columns"""
+        return ", ".join(str(i) for i in range(1, len(rollup["dimensions"]) + 2))
+
+    async def _ensure_tables(self, conn) -> set:
+        """Create the state table and any missing rollup tables; returns rollups that need a full rebuild"""
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+                rollup_name text PRIMARY KEY,
+                refreshed_at timestamptz NOT NULL,
+                watermark timestamptz
+            )
+        """)
+        rebuild = set()
+        for name, rollup in self.rollups.items():
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} AS "
+                f"SELECT {self._select_list(rollup)} FROM {rollup['source_table']} "
+                f"GROUP BY {self._group_by(rollup)} WITH NO DATA"
+            )
+            await conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {name}_{BUCKET_COLUMN}_idx ON {name} ({BUCKET_COLUMN})"
+            )
+
+            # Tables from before the per-measure counts get the columns and are rebuilt to fill them
+            existing = {
+                row['column_name'] for row in await conn.fetch(
+                    "SELECT column_name FROM information_schema.columns WHERE table_name = $1", name
+                )
+            }
+            for col in rollup["sum_measures"]:
+                if measure_count_column(col) not in existing:
+                    await conn.execute(f"ALTER TABLE {name} ADD COLUMN {measure_count_column(col)} bigint")
+                    rebuild.add(name)
+        return rebuild
+
+    async def refresh(self, full: bool = False) -> Dict[str, Any]:
+        """Incrementally refresh every rollup, recomputing days from the watermark minus the lookback"""
+        async with self._refresh_lock:
+            summary = {}
+            async with self.db_manager.pool.acquire() as conn:
+                rebuild = await self._ensure_tables(conn)
+
+                for name, rollup in self.rollups.items():
+                    start_time = datetime.now(timezone.utc)
+                    watermark = self.state.get(name, {}).get('watermark')
+                    source = rollup['source_table']
+                    time_column = rollup['time_column']
+
+                    async with conn.transaction():
+                        if full or watermark is None or name in rebuild:
+                            await conn.execute(f"DELETE FROM {name}")
+                            await conn.execute(
+                                f"INSERT INTO {name} SELECT {self._select_list(rollup)} "
+                                f"FROM {source} GROUP BY {self._group_by(rollup)}"
+                            )
+                            from_date = None
+                        else:
+                            from_date = watermark.date() - timedelta(days=self.lookback_days)
+                            # Rows without a timestamp live in the NULL bucket and are recomputed every time
+                            await conn.execute(
+                                f"DELETE FROM {name} WHERE {BUCKET_COLUMN} >= $1::date OR {BUCKET_COLUMN} IS NULL",
+                                from_date
+                            )
+                            await conn.execute(
+                                f"INSERT INTO {name} SELECT {self._select_list(rollup)} FROM {source} "
+                                f"WHERE {time_column} >= $1::date OR {time_column} IS NULL "
+                                f"GROUP BY {self._group_by(rollup)}",
+                                from_date
+                            )
+
+                        new_watermark = await conn.fetchval(f"SELECT MAX({time_column}) FROM {source}")
+                        refreshed_at = datetime.now(timezone.utc)
+                        await conn.execute(
+                            f"""INSERT INTO {ROLLUP_STATE_TABLE} (rollup_name, refreshed_at, watermark)
+                            VALUES ($1, $2, $3)
+                            ON CONFLICT (rollup_name) DO UPDATE
+                            SET refreshed_at = EXCLUDED.refreshed_at, watermark = EXCLUDED.watermark""",
+                            name, refreshed_at, new_watermark
+                        )
+
+                    self.state[name] = {'refreshed_at': refreshed_at, 'watermark': new_watermark}
+                    summary[name] = {
+                        'mode': 'full' if from_date is None else 'incremental',
+                        'recomputed_from': from_date.isoformat() if from_date else None,
+                        'duration': (refreshed_at - start_time).total_seconds()
+                    }
+                    logger.info(f"Rollup {name} refreshed ({summary[name]['mode']})")
+
+            # New tables change the schema and refreshed data invalidates cached results
+            if self.db_manager.cache:
+                await self.db_manager.cache.invalidate("schema")
+                await self.db_manager.cache.invalidate("result")
+
+            return summary
+
+    async def run_refresh_loop(self):
+        """Periodically refresh rollups (enabled with ROLLUP_REFRESH_INTERVAL seconds)"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Rollup refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """Describe each rollup and its freshness"""
+        status = []
+        for name, rollup in self.rollups.items():
+            state = self.state.get(name, {})
+            status.append({
+                'rollup_name': name,
+                'source_table': rollup['source_table'],
+                'refreshed_at': state['refreshed_at'].isoformat() if state.get('refreshed_at') else None,
+                'watermark': state['watermark'].isoformat() if state.get('watermark') else None,
+                'fresh': self._is_fresh(name)
+            })
+        return status
+
+    def _is_fresh(self, name: str) -> bool:
+        """Check whether a rollup has been refreshed within the allowed staleness"""
+        refreshed_at = self.state.get(name, {}).get('refreshed_at')
+        if not refreshed_at:
+            return False
+        age = (datetime.now(timezone.utc) - refreshed_at).total_seconds()
+        return age <= self.max_staleness
+
+    def format_rollups_for_llm(self) -> str:
+        """Describe the available rollup tables for the LLM prompt"""
+        available = [name for name in self.rollups if self._is_fresh(name)]
+        if not available:
+            return ""
+
+        text = "Pre-aggregated rollup tables (one row per day and dimension combination). "
+        text += "Prefer these over the raw tables for daily, shift or machine totals and rates; "
+        text += f"sum the measure columns and use SUM({ROW_COUNT_COLUMN}) instead of COUNT(*) "
+        text += f"and SUM(col) / SUM(col{MEASURE_COUNT_SUFFIX}) instead of AVG(col):\n"
+        for name in available:
+            rollup = self.rollups[name]
+            measures = [ROW_COUNT_COLUMN] + rollup["sum_measures"] + list(rollup["derived_measures"])
+            measures += [measure_count_column(col) for col in rollup["sum_measures"]]
+            columns = [BUCKET_COLUMN] + rollup["dimensions"] + measures
+            watermark = self.state[name].get('watermark')
+            text += f"Table: {name} ({rollup['description']}, from {rollup['source_table']}.{rollup['time_column']}"
+            if watermark:
+                text += f", data through {watermark.isoformat()}"
+            text += f")\n  Columns: {', '.join(columns)}\n"
+        return text + "\n"
+
+    def get_freshness(self, tables_accessed: List[str]) -> Optional[RollupRoute]:
+        """Return freshness metadata when a query reads a rollup table directly"""
+        for name in self.rollups:
+            if name in tables_accessed and name in self.state:
+                return self._route(name, None)
+        return None
+
+    def _route(self, name: str, sql_query: Optional[str]) -> RollupRoute:
+        state = self.state[name]
+        return RollupRoute(
+            rollup_name=name,
+            routed_query=sql_query,
+            refreshed_at=state['refreshed_at'].isoformat() if state.get('refreshed_at') else None,
+            watermark=state['watermark'].isoformat() if state.get('watermark') else None
+        )
+
+    def route_query(self, sql_query: str) -> Optional[RollupRoute]:
+        """Rewrite a single-table aggregate over a raw fact table to read from its rollup"""
+        try:
+            query = sql_query.strip().rstrip(';').strip()
+            upper = query.upper()
+
+            # Only plain single-table aggregates are routable
+            if re.search(r'\b(JOIN|WITH|UNION|INTERSECT|EXCEPT|OVER|DISTINCT)\b', upper) or upper.count('SELECT') != 1:
+                return None
+            if not re.search(r'\bGROUP\s+BY\b', upper) and not re.search(r'\b(COUNT|SUM|AVG)\s*\(', upper):
+                return None
+
+            match = re.search(
+                r'\bFROM\s+([a-z_][a-z0-9_]*)(?:\s+(?:AS\s+)?([a-z_][a-z0-9_]*))?\s*(?=\bWHERE\b|\bGROUP\b|\bORDER\b|\bLIMIT\b|\bHAVING\b|$)',
+                query, re.IGNORECASE
+            )
+            if not match:
+                return None
+
+            source_table = match.group(1).lower()
+            alias = match.group(2)
+            name = next(
+                (n for n, r in self.rollups.items() if r['source_table'] == source_table), None
+            )
+            if not name or not self._is_fresh(name):
+                return None
+
+            rollup = self.rollups[name]
+            routed = self._rewrite_for_rollup(query, rollup, alias)
+            if not routed:
+                return None
+
+            # Swap the source table for the rollup, keeping the alias
+            routed = re.sub(
+                r'\bFROM\s+' + re.escape(match.group(1)) + r'\b',
+                f"FROM {name}", routed, count=1, flags=re.IGNORECASE
+            )
+            logger.info(f"Query routed to rollup {name}")
+            return self._route(name, routed + ";")
+
+        except Exception as e:
+            logger.warning(f"Rollup routing skipped: {e}")
+            return None
+
+    def _rewrite_for_rollup(self, query: str, rollup: Dict[str, Any], alias: Optional[str]) -> Optional[str]:
+        """Map raw-table expressions onto rollup columns; None if anything can't be mapped exactly"""
+        prefix = f"{alias}." if alias else ""
+        qualifier = rf'(?:{re.escape(alias)}\.)?' if alias else ''
+        time_column = qualifier + re.escape(rollup['time_column'])
+        sum_measures = set(rollup['sum_measures'])
+
+        # Mask string literals so substitutions never touch them
+        literals = []
+
+        def mask(match):
+            literals.append(match.group(0))
+            return f"__lit{len(literals) - 1}__"
+
+        masked = re.sub(r"'(?:[^']|'')*'", mask, query)
+        masked = self._alias_aggregates(masked)
+        # The source table name disappears from FROM, so drop it as a qualifier
+        masked = re.sub(rf"\b{rollup['source_table']}\.", prefix, masked, flags=re.IGNORECASE)
+
+        substitutions = [
+            # Day buckets of the time column
+            (rf"DATE_TRUNC\(\s*__lit(\d+)__\s*,\s*{time_column}\s*\)", self._day_trunc(literals, prefix)),
+            (rf"DATE\(\s*{time_column}\s*\)", f"{prefix}{BUCKET_COLUMN}"),
+            (rf"{time_column}\s*::\s*date\b", f"{prefix}{BUCKET_COLUMN}"),
+            # Day-aligned half-open range predicates
+            (rf"{time_column}\s*(>=|<)\s*__lit(\d+)__", self._day_range(literals, prefix)),
+            # Aggregates
+            (r"COUNT\(\s*\*\s*\)", f"COALESCE(SUM({prefix}{ROW_COUNT_COLUMN}), 0)"),
+            (rf"AVG\(\s*{qualifier}([a-z_][a-z0-9_]*)\s*\)", self._average(sum_measures, prefix)),
+        ]
+        for pattern, replacement in substitutions:
+            masked = re.sub(pattern, replacement, masked, flags=re.IGNORECASE)
+
+        # Anything left referring to unmapped aggregates is not routable
+        if re.search(r'\b(COUNT|AVG|MIN|MAX)\s*\(|__unroutable__', masked, re.IGNORECASE):
+            return None
+
+        # Every SUM must aggregate a stored measure
+        measures = self._measures(rollup)
+        for argument in re.findall(r'\bSUM\(([^()]*)\)', masked, re.IGNORECASE):
+            column = argument.strip().split('.')[-1].lower()
+            if column not in measures:
+                return None
+
+        # Measures may only appear inside SUM()
+        without_sums = re.sub(r'\bSUM\([^()]*\)', '', masked, flags=re.IGNORECASE)
+        for column in measures:
+            if re.search(rf'\b{column}\b', without_sums, re.IGNORECASE):
+                return None
+
+        routed = re.sub(r'__lit(\d+)__', lambda m: literals[int(m.group(1))], masked)
+
+        # Every remaining column reference (including the raw time column) must exist in the rollup
+        allowed = {BUCKET_COLUMN, *rollup['dimensions'], *measures}
+        if alias:
+            allowed.add(alias.lower())
+        output_aliases = {a.lower() for a in re.findall(r'\bAS\s+([a-z_][a-z0-9_]*)', routed, re.IGNORECASE)}
+        function_names = {f.lower() for f in re.findall(r'\b([a-z_][a-z0-9_]*)\s*\(', routed, re.IGNORECASE)}
+        # sqlparse is loaded on the first routed query, not when the app starts
+        import sqlparse
+        from sqlparse import tokens
+        statement = sqlparse.parse(routed)[0]
+        for token in statement.flatten():
+            if token.ttype is tokens.Name:
+                name = token.value.lower()
+                if name not in allowed | output_aliases | function_names and name != rollup['source_table']:
+                    return None
+
+        return routed
+
+    def _day_trunc(self, literals: List[str], prefix: str):
+        def replace(match):
+            if literals[int(match.group(1))].strip("'").lower() != 'day':
+                return '__unroutable__'
+            return f"{prefix}{BUCKET_COLUMN}"
+        return replace
+
+    def _day_range(self, literals: List[str], prefix: str):
+        def replace(match):
+            literal = literals[int(match.group(2))].strip("'")
+            try:
+                value = datetime.fromisoformat(literal)
+            except ValueError:
+                return '__unroutable__'
+            if (value.hour, value.minute, value.second, value.microsecond) != (0, 0, 0, 0) or value.tzinfo:
+                return '__unroutable__'
+            return f"{prefix}{BUCKET_COLUMN} {match.group(1)} '{value.date().isoformat()}'"
+        return replace
+
+    def _average(self, sum_measures: set, prefix: str):
+        def replace(match):
+            column = match.group(1).lower()
+            if column not in sum_measures:
+                return '__unroutable__'
+            count_column = measure_count_column(column)
+            return f"(SUM({prefix}{column})::numeric / NULLIF(SUM({prefix}{count_column}), 0))"
+        return replace
+
+    def _alias_aggregates(self, query: str) -> str:
+        """Alias bare COUNT(*) and AVG(...) select items to the names Postgres gives them,
+        so the routed query returns the same column names as the original"""
+        depth = 0
+        select = re.match(r'\s*SELECT\s+', query, re.IGNORECASE)
+        if not select:
+            return query
+        for match in re.finditer(r'[()]|\bFROM\b', query[select.end():], re.IGNORECASE):
+            token = match.group(0)
+            depth += {'(': 1, ')': -1}.get(token, 0)
+            if depth == 0 and token.upper() == 'FROM':
+                end = select.end() + match.start()
+                break
+        else:
+            return query
+
+        items, item_depth, current = [], 0, ''
+        for char in query[select.end():end]:
+            item_depth += {'(': 1, ')': -1}.get(char, 0)
+            if char == ',' and item_depth == 0:
+                items.append(current)
+                current = ''
+            else:
+                current += char
+        items.append(current)
+
+        aliased = []
+        for item in items:
+            expression = item.strip()
+            name = re.match(r'^(COUNT|AVG)\s*\([^()]*\)$', expression, re.IGNORECASE)
+            aliased.append(item.replace(expression, f"{expression} AS {name.group(1).lower()}", 1) if name else item)
+        return query[:select.end()] + ",".join(aliased) + query[end:]
@@ -0,0 +1,443 @@
+import os
+import re
+import sys
+import time
+import uuid
+import logging
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List, Dict, Any, Optional, Tuple
+
+from models import ChatMessage, QueryContext
+
+logger = logging.getLogger(__name__)
+
+# Words a local refinement may contain besides column names and matched values
+FILLER_WORDS = {
+    'now', 'only', 'just', 'show', 'me', 'the', 'a', 'an', 'it', 'them', 'those', 'these', 'that', 'this',
+    'result', 'row', 'record', 'please', 'and', 'then', 'with', 'for', 'of', 'in', 'on', 'by', 'per', 'each',
+    'sort', 'sorted', 'order', 'ordered', 'rank', 'filter', 'filtered', 'to', 'can', 'you', 'give', 'list',
+    'exclude', 'excluding', 'except', 'without', 'not', 'top', 'first', 'bottom', 'last', 'highest', 'lowest',
+    'largest', 'smallest', 'most', 'least', 'asc', 'ascending', 'desc', 'descending', 'total', 'sum', 'average',
+    'avg', 'mean', 'max', 'maximum', 'min', 'minimum', 'count', 'number', 'how', 'many', 'what', 'is', 'are',
+    'where', 'above', 'below', 'over', 'under', 'more', 'less', 'than', 'at', 'greater', 'fewer', 'equal'
+}
+
+# Cues that a question builds on the previous answer rather than starting over
+FOLLOW_UP_CUES = re.compile(
+    r'^(now|and|also|then|what about|how about|instead|same|only|just)\b|\b(those|them|these|that|it|previous|same)\b'
+)
+
+AGGREGATES = {
+    'total': 'SUM', 'sum': 'SUM', 'average': 'AVG', 'avg': 'AVG', 'mean': 'AVG',
+    'max': 'MAX', 'maximum': 'MAX', 'highest': 'MAX', 'min': 'MIN', 'minimum': 'MIN', 'lowest': 'MIN',
+    'count': 'COUNT', 'number of': 'COUNT', 'how many': 'COUNT'
+}
+
+COMPARISONS = {
+    '>': '>', '>=': '>=', '<': '<', '<=': '<=', '=': '=',
+    'above': '>', 'over': '>', 'more than': '>', 'greater than': '>', 'at least': '>=',
+    'below': '<', 'under': '<', 'less than': '<', 'fewer than': '<', 'at most': '<='
+}
+
+SORT_PATTERN = re.compile(
+    r'\b(?:sort|order|rank)(?:ed)?\s+(?:it\s+|them\s+|this\s+|results\s+)?by\s+(?:the\s+)?([a-z_ ]+?)'
+    r'(?:\s+(asc|ascending|desc|descending|highest first|lowest first|largest first|smallest first))?$'
+)
+TOP_PATTERN = re.compile(r'\b(top|first|bottom|last)\s+(\d+)(?:\s+by\s+(?:the\s+)?([a-z_ ]+?))?(?=$|\s+(?:only|please)\b)')
+COMPARE_PATTERN = re.compile(
+    r'\b([a-z_]+(?:\s[a-z_]+)?)\s*(>=|<=|>|<|=|above|over|more than|greater than|at least|below|under|'
+    r'less than|fewer than|at most)\s*(-?\d+(?:\.\d+)?)\b'
+)
+AGGREGATE_PATTERN = re.compile(
+    r'\b(total|sum|average|avg|mean|max|maximum|min|minimum|count|number of|how many)'
+    r'(?:\s+(?:of\s+)?(?:the\s+)?(?!by\b|per\b|for each\b)([a-z_ ]+?))?(?:\s+(?:by|per|for each)\s+(?:the\s+)?([a-z_ ]+?))?$'
+)
+
+
+def _words(text: str) -> List[str]:
+    return [w.rstrip('s') for w in re.findall(r'[a-z0-9]+', text.lower())]
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+class ColumnarResult:
+    """A cached result set stored column-wise: numeric columns as typed arrays, repetitive strings dictionary-encoded"""
+
+    def __init__(self, question: str, sql_query: str, rows: List[Dict[str, Any]], complete: bool):
+        self.result_id = uuid.uuid4().hex[:12]
+        self.question = question
+        self.sql_query = sql_query
+        # Only a complete result set can answer refinements locally
+        self.complete = complete
+        self.columns = list(rows[0].keys()) if rows else []
+        self.row_count = len(rows)
+        self.data: Dict[str, Any] = {}
+        self.dictionaries: Dict[str, List[Any]] = {}
+        for column in self.columns:
+            self._encode(column, [row[column] for row in rows])
+        self.nbytes = self._estimate_bytes()
+
+    def _encode(self, column: str, values: List[Any]):
+        if values and all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            self.data[column] = array('q', values)
+            return
+        if values and all(isinstance(v, float) for v in values):
+            self.data[column] = array('d', values)
+            return
+        if values and all(v is None or isinstance(v, str) for v in values):
+            distinct = list(dict.fromkeys(values))
+            if len(distinct) <= max(1, len(values) // 2) and len(distinct) < 65536:
+                codes = {value: i for i, value in enumerate(distinct)}
+                self.dictionaries[column] = distinct
+                self.data[column] = array('H', (codes[v] for v in values))
+                return
+        self.data[column] = values
+
+    def _estimate_bytes(self) -> int:
+        total = 0
+        for column, values in self.data.items():
+            if isinstance(values, array):
+                total += values.itemsize * len(values)
+                for value in self.dictionaries.get(column, []):
+                    total += sys.getsizeof(value)
+            elif values:
+                # Sample the per-value size rather than walking every object
+                sample = values[:100]
+                total += sys.getsizeof(values) + sum(sys.getsizeof(v) for v in sample) * len(values) // len(sample)
+        return total
+
+    def value(self, column: str, index: int):
+        if column in self.dictionaries:
+            return self.dictionaries[column][self.data[column][index]]
+        return self.data[column][index]
+
+    def column_values(self, column: str, indices: List[int]) -> List[Any]:
+        return [self.value(column, i) for i in indices]
+
+    def distinct_strings(self, column: str, max_values: int = 50) -> List[str]:
+        if column in self.dictionaries:
+            values = self.dictionaries[column]
+        else:
+            values = self.data[column]
+            if isinstance(values, array) or not all(v is None or isinstance(v, str) for v in values[:100]):
+                return []
+            values = list(dict.fromkeys(values))
+        values = [v for v in values if isinstance(v, str)]
+        return values if len(values) <= max_values else []
+
+    def is_numeric(self, column: str) -> bool:
+        values = self.data[column]
+        if isinstance(values, array):
+            return column not in self.dictionaries
+        present = [v for v in values[:100] if v is not None]
+        return bool(present) and all(_is_number(v) for v in present)
+
+    def rows(self, indices: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        indices = range(self.row_count) if indices is None else indices
+        return [{column: self.value(column, i) for column in self.columns} for i in indices]
+
+
+class ConversationSession:
+    """Chat history and recent result sets of one conversation, bounded by count and bytes"""
+
+    def __init__(self, session_id: str, max_results: int, max_bytes: int, max_messages: int):
+        self.session_id = session_id
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.messages: List[ChatMessage] = []
+        self.results: "OrderedDict[str, ColumnarResult]" = OrderedDict()
+        self.last_access = time.time()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(result.nbytes for result in self.results.values())
+
+    @property
+    def latest(self) -> Optional[ColumnarResult]:
+        return next(reversed(self.results.values()), None) if self.results else None
+
+    def add_message(self, message: str, is_user: bool, **fields):
+        self.messages.append(ChatMessage(
+            id=uuid.uuid4().hex[:12],
+            message=message,
+            is_user=is_user,
+            timestamp=datetime.now(timezone.utc),
+            **fields
+        ))
+        del self.messages[:-self.max_messages]
+
+    def add_result(self, result: ColumnarResult) -> bool:
+        """Cache a result set, evicting the oldest ones beyond the count and byte limits"""
+        if result.nbytes > self.max_bytes:
+            return False
+        self.results[result.result_id] = result
+        while len(self.results) > self.max_results or self.nbytes > self.max_bytes:
+            evicted_id, _ = self.results.popitem(last=False)
+            logger.debug(f"Session {self.session_id}: evicted result {evicted_id}")
+        return True
+
+    def build_context(self, question: str, max_queries: int = 3) -> QueryContext:
+        """Follow-up context: the new question plus the most recent questions and their SQL"""
+        previous = [
+            f"Q: {m.message}\nSQL: {m.sql_query}" for m in self.messages if not m.is_user and m.sql_query
+        ]
+        return QueryContext(question=question, schema_context="", previous_queries=previous[-max_queries:])
+
+
+class SessionStore:
+    """In-process conversation sessions with LRU eviction across sessions and TTL expiry"""
+
+    def __init__(self):
+        self.max_sessions = int(os.getenv("SESSION_MAX_SESSIONS", "500"))
+        self.ttl = int(os.getenv("SESSION_TTL", "1800"))
+        self.max_results = int(os.getenv("SESSION_MAX_RESULTS", "5"))
+        self.max_bytes = int(os.getenv("SESSION_MAX_BYTES", str(8 * 1024 * 1024)))
+        self.max_messages = int(os.getenv("SESSION_MAX_MESSAGES", "20"))
+        self.sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self.stats = {'local_refinements': 0, 'llm_follow_ups': 0, 'new_questions': 0, 'evicted_sessions': 0}
+
+    def get(self, session_id: str) -> ConversationSession:
+        """Return the session, creating it (and evicting expired or least recent ones) as needed"""
+        now = time.time()
+        for expired_id in [sid for sid, s in self.sessions.items() if now - s.last_access > self.ttl]:
+            del self.sessions[expired_id]
+            self.stats['evicted_sessions'] += 1
+
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = ConversationSession(session_id, self.max_results, self.max_bytes, self.max_messages)
+            self.sessions[session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.stats['evicted_sessions'] += 1
+        self.sessions.move_to_end(session_id)
+        session.last_access = now
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self.sessions.pop(session_id, None) is not None
+
+    def classify(self, question: str, session: ConversationSession) -> str:
+        """'new' without prior answers, 'follow_up' when the question builds on them, else 'new'"""
+        if not session.messages:
+            return 'new'
+        return 'follow_up' if FOLLOW_UP_CUES.search(question.lower().strip()) else 'new'
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'sessions': len(self.sessions),
+            'cached_results': sum(len(s.results) for s in self.sessions.values()),
+            'bytes': sum(s.nbytes for s in self.sessions.values()),
+            'max_bytes_per_session': self.max_bytes
+        }
+
+
+class RefinementPlanner:
+    """Turns follow-ups like "now only the night shift" or "sort by downtime" into operations on a cached result"""
+
+    def plan(self, question: str, result: ColumnarResult) -> Optional[List[Tuple]]:
+        """Return [(op, ...)] when the whole question is a filter/sort/aggregate/limit of the result, else None"""
+        if not result.complete or not result.row_count:
+            return None
+
+        text = question.lower().strip().rstrip('?.!')
+        covered: List[str] = []
+        filters, aggregate, sort, limit = [], None, None, None
+
+        # Comparisons on numeric columns: "downtime over 30", "units >= 100"
+        for match in COMPARE_PATTERN.finditer(text):
+            column = self._match_column(match.group(1), result, numeric=True)
+            if column is None:
+                return None
+            value = float(match.group(3))
+            filters.append(('compare', column, COMPARISONS[match.group(2)], value))
+            covered.append(match.group(0))
+
+        # Categorical values from the cached set: "only the night shift", "excluding CNC-001"
+        negate = bool(re.search(r'\b(exclude|excluding|except|without|not)\b', text))
+        value_filter = negate or re.search(r'\b(only|just|for|where|filter)\b', text)
+        for column in result.columns if value_filter else []:
+            matched = [v for v in result.distinct_strings(column)
+                       if len(v) > 1 and re.search(rf'(?<![\w-]){re.escape(v.lower())}(?![\w-])', text)]
+            if matched:
+                filters.append(('values', column, matched, negate))
+                covered.extend(v.lower() for v in matched)
+
+        match = SORT_PATTERN.search(text)
+        if match:
+            column = self._match_column(match.group(1), result)
+            if column is None:
+                return None
+            direction = match.group(2) or ''
+            # Without a direction, numbers sort largest first - "sort by downtime" means worst first
+            descending = direction.startswith(('desc', 'highest', 'largest')) or (
+                not direction and result.is_numeric(column)
+            )
+            sort = (column, descending)
+            covered.append(match.group(0))
+
+        match = TOP_PATTERN.search(text)
+        if match:
+            limit = int(match.group(2))
+            if match.group(3):
+                column = self._match_column(match.group(3), result, numeric=True)
+                if column is None:
+                    return None
+                sort = (column, match.group(1) in ('top', 'first'))
+            covered.append(match.group(0))
+
+        match = AGGREGATE_PATTERN.search(text)
+        if match and sort:
+            # Sorting an aggregate needs its alias; leave combined requests to the LLM
+            return None
+        if match:
+            function = AGGREGATES[match.group(1)]
+            measure = None
+            if function != 'COUNT':
+                measure = self._match_column(match.group(2) or '', result, numeric=True)
+                if measure is None:
+                    return None
+            group_by = None
+            if match.group(3):
+                group_by = self._match_column(match.group(3), result)
+                if group_by is None:
+                    return None
+            aggregate = (function, measure, group_by)
+            covered.append(match.group(0))
+
+        if not (filters or sort or limit or aggregate):
+            return None
+
+        # Anything left that isn't filler or a column name means the question asks for more than the cached set
+        column_words = {w for column in result.columns for w in _words(column)}
+        remaining = text
+        for span in covered:
+            remaining = remaining.replace(span, ' ')
+        leftover = [w for w in _words(remaining) if w not in FILLER_WORDS and w not in column_words]
+        if leftover:
+            return None
+
+        plan = [('filter',) + f[1:] if f[0] == 'values' else f for f in filters]
+        if aggregate:
+            plan.append(('aggregate',) + aggregate)
+        if sort:
+            plan.append(('sort',) + sort)
+        if limit:
+            plan.append(('limit', limit))
+        return plan
+
+    def _match_column(self, phrase: str, result: ColumnarResult, numeric: bool = False) -> Optional[str]:
+        """The single column whose name shares the most words with the phrase"""
+        phrase_words = set(_words(phrase)) - FILLER_WORDS
+        if not phrase_words:
+            return None
+        scored = []
+        for column in result.columns:
+            if numeric and not result.is_numeric(column):
+                continue
+            overlap = len(phrase_words & set(_words(column)))
+            if overlap:
+                scored.append((overlap, column))
+        scored.sort(reverse=True)
+        if not scored or (len(scored) > 1 and scored[0][0] == scored[1][0]):
+            return None
+        return scored[0][1]
+
+    def apply(self, plan: List[Tuple], result: ColumnarResult) -> Tuple[List[Dict[str, Any]], str]:
+        """Run the plan over the cached result; return rows and the equivalent SQL over the previous query"""
+        indices = list(range(result.row_count))
+        where, order, group, select, limit_sql = [], "", "", "*", ""
+        rows = None
+
+        for step in plan:
+            op = step[0]
+            if op == 'compare':
+                _, column, operator, value = step
+                compare = {
+                    '>': lambda a: a > value, '>=': lambda a: a >= value, '<': lambda a: a < value,
+                    '<=': lambda a: a <= value, '=': lambda a: a == value
+                }[operator]
+                indices = [i for i in indices if result.value(column, i) is not None and compare(float(result.value(column, i)))]
+                where.append(f"{column} {operator} {_sql_literal(value)}")
+            elif op == 'filter':
+                _, column, values, negate = step
+                wanted = {v.lower() for v in values}
+                indices = [
+                    i for i in indices
+                    if ((result.value(column, i) or '').lower() in wanted) != negate
+                ]
+                listed = ", ".join(_sql_literal(v) for v in values)
+                where.append(f"{column} {'NOT IN' if negate else 'IN'} ({listed})")
+            elif op == 'aggregate':
+                _, function, measure, group_by = step
+                rows, select, group = self._aggregate(result, indices, function, measure, group_by)
+            elif op == 'sort':
+                _, column, descending = step
+                present = [i for i in indices if result.value(column, i) is not None]
+                missing = [i for i in indices if result.value(column, i) is None]
+                # Nulls last regardless of direction
+                indices = sorted(present, key=lambda i: result.value(column, i), reverse=descending) + missing
+                order = f" ORDER BY {column} {'DESC' if descending else 'ASC'} NULLS LAST"
+            elif op == 'limit':
+                if rows is not None:
+                    rows = rows[:step[1]]
+                else:
+                    indices = indices[:step[1]]
+                limit_sql = f" LIMIT {step[1]}"
+
+        if rows is None:
+            rows = result.rows(indices)
+
+        previous = result.sql_query.strip().rstrip(';')
+        sql_query = f"SELECT {select} FROM ({previous}) AS previous"
+        if where:
+            sql_query += " WHERE " + " AND ".join(where)
+        sql_query += group + order + limit_sql + ";"
+        return rows, sql_query
+
+    def _aggregate(self, result: ColumnarResult, indices: List[int], function: str,
+                   measure: Optional[str], group_by: Optional[str]):
+        alias = f"{function.lower()}_{measure}" if measure else "count"
+        groups: "OrderedDict[Any, List[Any]]" = OrderedDict()
+        for i in indices:
+            key = result.value(group_by, i) if group_by else None
+            groups.setdefault(key, []).append(result.value(measure, i) if measure else 1)
+
+        rows = []
+        for key, values in groups.items():
+            present = [float(v) for v in values if v is not None]
+            if function == 'COUNT':
+                value = len(values)
+            elif not present:
+                value = None
+            elif function == 'SUM':
+                value = sum(present)
+            elif function == 'AVG':
+                value = sum(present) / len(present)
+            elif function == 'MAX':
+                value = max(present)
+            else:
+                value = min(present)
+            row = {group_by: key} if group_by else {}
+            row[alias] = value
+            rows.append(row)
+        if not rows and not group_by:
+            rows = [{alias: 0 if function == 'COUNT' else None}]
+
+        expression = "COUNT(*)" if function == 'COUNT' else f"{function}({measure})"
+        select = f"{group_by + ', ' if group_by else ''}{expression} AS {alias}"
+        group = f" GROUP BY {group_by}" if group_by else ""
+        return rows, select, group
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def json_default(value):
+    """JSON encoder fallback for cached PostgreSQL values"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+class SharedCache:
+    """Size-bounded key/value cache in a WAL-mode SQLite file shared by all uvicorn workers on a host"""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.path = path or os.getenv(
+            "SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "nlpsql-cache.sqlite3")
+        )
+        self.max_bytes = max_bytes or int(os.getenv("SHARED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.max_entry_bytes = int(os.getenv("SHARED_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+        self.touch_interval = float(os.getenv("SHARED_CACHE_TOUCH_INTERVAL", "60"))
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._conn = self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        # Autocommit mode; writes use explicit BEGIN IMMEDIATE so updates are atomic across processes
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access_idx ON cache (last_access)")
+        return conn
+
+    def _count(self, namespace: str, outcome: str):
+        counters = self.stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'sets': 0})
+        counters[outcome] += 1
+
+    def get_sync(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, last_access FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self._count(namespace, 'misses')
+                return None
+            # Access time feeds approximate LRU eviction. Refreshing it takes SQLite's write lock,
+            # so hot entries are touched at most once per touch interval instead of on every read
+            if now - row[2] >= self.touch_interval:
+                self._conn.execute(
+                    "UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key)
+                )
+        self._count(namespace, 'hits')
+        return json.loads(row[0])
+
+    def set_sync(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        payload = json.dumps(value, default=json_default).encode()
+        if len(payload) > self.max_entry_bytes:
+            return False
+
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, size, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, key, payload, len(payload), expires_at, now)
+                )
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._count(namespace, 'sets')
+        return True
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones until under the size bound"""
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Evict down to 90% so every write near the limit doesn't pay for an eviction scan
+        to_free = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for namespace, key, size in self._conn.execute(
+            "SELECT namespace, key, size FROM cache ORDER BY last_access"
+        ):
+            victims.append((namespace, key))
+            freed += size
+            if freed >= to_free:
+                break
+        self._conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", victims)
+
+    def invalidate_sync(self, namespace: str, key: Optional[str] = None):
+        with self._lock:
+            if key is None:
+                self._conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+            else:
+                self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the cached value, or None when missing or expired"""
+        try:
+            return await asyncio.to_thread(self.get_sync, namespace, key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed: {e}")
+            return None
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Store a JSON-serializable value; entries above SHARED_CACHE_MAX_ENTRY_BYTES are skipped"""
+        try:
+            return await asyncio.to_thread(self.set_sync, namespace, key, value, ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed: {e}")
+            return False
+
+    async def invalidate(self, namespace: str, key: Optional[str] = None):
+        try:
+            await asyncio.to_thread(self.invalidate_sync, namespace, key)
+        except Exception as e:
+            logger.warning(f"Shared cache invalidation failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-namespace hit/miss counters for this worker plus shared size"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return {
+            'path': self.path,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'worker_pid': os.getpid(),
+            'namespaces': {
+                namespace: {
+                    **counters,
+                    'hit_rate': counters['hits'] / (counters['hits'] + counters['misses'])
+                    if counters['hits'] + counters['misses'] else None
+                }
+                for namespace, counters in self.stats.items()
+            }
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,139 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and quoted values; punctuation and spacing between them don't change the question
+TOKEN_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?|\w+")
+
+
+def normalize_question(text: str) -> str:
+    """Lowercased word sequence; one substituted word ("ascending"/"descending") is a different question"""
+    return ' '.join(TOKEN_PATTERN.findall(text.lower()))
+
+
+class Speculation:
+    """SQL generation started from a partially typed question"""
+
+    def __init__(self, question: str, context: Optional[str], scope: Optional[str], task: asyncio.Task):
+        self.question = question
+        self.normalized = normalize_question(question)
+        self.context = context
+        self.scope = scope
+        self.task = task
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        task.add_done_callback(self._done)
+
+    def _done(self, _task):
+        self.finished = time.monotonic()
+
+
+class SpeculationManager:
+    """Keeps the latest speculative SQL generation per session and hands it to the submit if the text still matches.
+
+    A newer partial question cancels the older speculation (and with it the Groq call).
+    """
+
+    def __init__(self, generate: Callable[[str, Optional[str]], Awaitable[Optional[str]]]):
+        self.generate = generate
+        self.enabled = os.getenv("SPECULATION_ENABLED", "1").lower() in ("1", "true", "yes")
+        self.min_chars = int(os.getenv("SPECULATION_MIN_CHARS", "12"))
+        self.ttl = float(os.getenv("SPECULATION_TTL", "120"))
+        self.max_sessions = int(os.getenv("SPECULATION_MAX_SESSIONS", "500"))
+        self.latest: "OrderedDict[str, Speculation]" = OrderedDict()
+        self.stats = {
+            'started': 0,
+            'skipped': 0,
+            'cancelled': 0,
+            'wasted': 0,
+            'hits': 0,
+            'hits_in_flight': 0,
+            'misses': 0,
+            'saved_seconds': 0.0
+        }
+
+    def matches(self, speculation: Speculation, question: str, context: Optional[str], scope: Optional[str]) -> bool:
+        if speculation.context != context or speculation.scope != scope:
+            return False
+        if time.monotonic() - speculation.started > self.ttl:
+            return False
+        # Near matches aren't reused: "passed" vs "failed" differs by one word and means the opposite
+        return normalize_question(question) == speculation.normalized
+
+    def speculate(self, session_id: str, question: str, context: Optional[str], scope: Optional[str] = None) -> bool:
+        """Start generating for the partial question, replacing the session's previous speculation"""
+        previous = self.latest.get(session_id)
+        if previous and previous.normalized == normalize_question(question) and previous.context == context:
+            return True
+        if not self.enabled or len(question.strip()) < self.min_chars:
+            self.stats['skipped'] += 1
+            return False
+
+        self._discard(session_id)
+        task = asyncio.create_task(self.generate(question, context))
+        self.latest[session_id] = Speculation(question, context, scope, task)
+        self.latest.move_to_end(session_id)
+        self.stats['started'] += 1
+        while len(self.latest) > self.max_sessions:
+            self._discard(next(iter(self.latest)))
+        return True
+
+    async def take(self, session_id: str, question: str, context: Optional[str],
+                   scope: Optional[str] = None) -> Optional[str]:
+        """SQL from the session's speculation if it matches the submitted question, else None"""
+        speculation = self.latest.get(session_id)
+        if speculation is None:
+            return None
+        if not self.matches(speculation, question, context, scope):
+            self.stats['misses'] += 1
+            self._discard(session_id)
+            return None
+
+        del self.latest[session_id]
+        in_flight = not speculation.task.done()
+        submitted = time.monotonic()
+        try:
+            # Not shielded: if the submitting request is cancelled, so is the generation
+            sql_query = await speculation.task
+        except Exception as e:
+            logger.warning(f"Speculative generation failed: {e}")
+            sql_query = None
+        if not sql_query:
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        if in_flight:
+            self.stats['hits_in_flight'] += 1
+        # Generation time that elapsed before the user submitted
+        self.stats['saved_seconds'] += min(speculation.finished or submitted, submitted) - speculation.started
+        return sql_query
+
+    def _discard(self, session_id: str):
+        speculation = self.latest.pop(session_id, None)
+        if speculation is None:
+            return
+        if speculation.task.done():
+            # The LLM call finished but its SQL was never used
+            self.stats['wasted'] += 1
+        else:
+            speculation.task.cancel()
+            self.stats['cancelled'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        decided = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'saved_seconds': round(self.stats['saved_seconds'], 3),
+            'hit_rate': round(self.stats['hits'] / decided, 3) if decided else None,
+            'waste_rate': round((self.stats['wasted'] + self.stats['cancelled']) / self.stats['started'], 3)
+            if self.stats['started'] else None,
+            'active': len(self.latest),
+            'enabled': self.enabled
+        }
@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTracker:
+    """Times startup phases and decides readiness.
+
+    The app starts serving once its services exist; warm-up phases (schema, rollups, profiles,
+    Groq connection) continue in the background and GET /ready reports 503 until they finish.
+    A failed warm-up is retried with exponential backoff, so a transient outage doesn't leave
+    the app unready until restart.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self.serving_after_ms: Optional[float] = None
+        self.ready_after_ms: Optional[float] = None
+        self.ready = False
+        self.warmup_task: Optional[asyncio.Task] = None
+        self.warmup_attempts = 0
+        self.warmup_error: Optional[str] = None
+        self.retry_backoff = float(os.getenv("STARTUP_RETRY_BACKOFF", "2"))
+        self.max_retry_backoff = float(os.getenv("STARTUP_MAX_RETRY_BACKOFF", "60"))
+
+    async def phase(self, name: str, awaitable: Awaitable, required: bool = True) -> Any:
+        """Run and time one phase; failures of optional phases are logged, not raised"""
+        start = time.monotonic()
+        self.phases[name] = {'status': 'running', 'required': required}
+        try:
+            result = await awaitable
+        except Exception as e:
+            self.phases[name].update(status='failed', error=str(e), ms=round((time.monotonic() - start) * 1000, 1))
+            if required:
+                raise
+            logger.warning(f"Startup phase {name} failed: {e}")
+            return None
+        self.phases[name].update(status='done', ms=round((time.monotonic() - start) * 1000, 1))
+        return result
+
+    def serving(self):
+        self.serving_after_ms = round((time.monotonic() - self.started) * 1000, 1)
+        logger.info(f"Serving after {self.serving_after_ms}ms, warming up in the background")
+
+    def start_warmup(self, warmup: Callable[[], Awaitable]):
+        """Run the warm-up in the background, retrying until it succeeds"""
+        async def run():
+            backoff = self.retry_backoff
+            while True:
+                self.warmup_attempts += 1
+                try:
+                    await warmup()
+                    break
+                except Exception as e:
+                    self.warmup_error = str(e)
+                    logger.error(f"Warm-up attempt {self.warmup_attempts} failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_retry_backoff)
+            self.ready = True
+            self.warmup_error = None
+            self.ready_after_ms = round((time.monotonic() - self.started) * 1000, 1)
+            logger.info(f"Ready after {self.ready_after_ms}ms")
+
+        self.warmup_task = asyncio.create_task(run())
+
+    def stop(self):
+        if self.warmup_task:
+            self.warmup_task.cancel()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'started_at': self.started_at,
+            'serving_after_ms': self.serving_after_ms,
+            'ready_after_ms': self.ready_after_ms,
+            'warmup_attempts': self.warmup_attempts,
+            'warmup_error': self.warmup_error,
+            'phases': self.phases
+        }
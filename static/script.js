@@ -1,3 +1,415 @@
+// Virtualized results grid: renders only the visible rows, sorts/filters on typed keys
+// and pages further rows from a background query job when the inline result was capped
+class ResultsGrid {
+    static ROW_HEIGHT = 33;
+    static VIEWPORT_HEIGHT = 300;
+    static OVERSCAN = 8;
+    static PAGE_SIZE = 2000;
+    static ISO_DATE = /^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$/;
+    static FILTER = /^\s*(\w+)\s*(>=|<=|!=|=|>|<|~)\s*(.+?)\s*$/;
+
+    constructor(container, rows, { hasMore = false, sqlQuery = null } = {}) {
+        this.container = container;
+        this.rows = rows;
+        this.columns = rows.length ? Object.keys(rows[0]) : [];
+        this.hasMore = hasMore;
+        this.sqlQuery = sqlQuery;
+        this.totalRows = null;
+        this.jobId = null;
+        this.loadingMore = false;
+
+        this.types = this.columns.map(col => this.inferType(col));
+        this.sortKeys = {};
+        this.sortColumn = null;
+        this.sortDirection = 1;
+        this.filterText = '';
+        this.view = null;
+        this.renderedRange = [-1, -1];
+        this.collator = new Intl.Collator(undefined, { numeric: true, sensitivity: 'base' });
+
+        this.build();
+        this.applyView();
+    }
+
+    inferType(col) {
+        // Type from the first non-null values; JSON numbers stay numbers, ISO strings are dates
+        let sampled = 0;
+        let type = null;
+        for (let i = 0; i < this.rows.length && sampled < 50; i++) {
+            const value = this.rows[i][col];
+            if (value === null || value === undefined) continue;
+            sampled++;
+            const valueType = typeof value === 'number' ? 'number'
+                : typeof value === 'boolean' ? 'boolean'
+                : ResultsGrid.ISO_DATE.test(value) ? 'date' : 'string';
+            if (type && type !== valueType) return 'string';
+            type = valueType;
+        }
+        return type || 'string';
+    }
+
+    toKey(value, type) {
+        if (value === null || value === undefined) return null;
+        if (type === 'number') return typeof value === 'number' ? value : parseFloat(value);
+        if (type === 'date') return Date.parse(value);
+        if (type === 'boolean') return value ? 1 : 0;
+        return String(value);
+    }
+
+    keysFor(columnIndex) {
+        // Parsed once per column and extended as pages arrive
+        const col = this.columns[columnIndex];
+        const type = this.types[columnIndex];
+        const keys = this.sortKeys[col] || (this.sortKeys[col] = []);
+        for (let i = keys.length; i < this.rows.length; i++) {
+            keys.push(this.toKey(this.rows[i][col], type));
+        }
+        return keys;
+    }
+
+    build() {
+        this.container.classList.add('results-grid');
+        this.container.innerHTML = `
+            <div class="grid-toolbar">
+                <input type="text" class="grid-filter" placeholder="Filter: text, or column > value (=, !=, <, <=, >, >=, ~)">
+                <span class="grid-status"></span>
+            </div>
+            <div class="grid-header"><table><colgroup></colgroup><thead><tr></tr></thead></table></div>
+            <div class="grid-viewport">
+                <div class="grid-spacer"><table><colgroup></colgroup><tbody></tbody></table></div>
+            </div>
+        `;
+        this.filterInput = this.container.querySelector('.grid-filter');
+        this.status = this.container.querySelector('.grid-status');
+        this.header = this.container.querySelector('.grid-header');
+        this.viewport = this.container.querySelector('.grid-viewport');
+        this.spacer = this.container.querySelector('.grid-spacer');
+        this.bodyTable = this.spacer.querySelector('table');
+        this.tbody = this.spacer.querySelector('tbody');
+        this.viewport.style.height = `${ResultsGrid.VIEWPORT_HEIGHT}px`;
+
+        // Header and body are separate tables sharing fixed column widths
+        const widths = this.columns.map((col, i) => this.columnWidth(col, i));
+        const tableWidth = widths.reduce((sum, w) => sum + w, 0);
+        this.container.querySelectorAll('colgroup').forEach(colgroup => {
+            colgroup.innerHTML = widths.map(w => `<col style="width: ${w}px">`).join('');
+            colgroup.parentElement.style.width = `${tableWidth}px`;
+        });
+
+        const headerRow = this.container.querySelector('thead tr');
+        this.columns.forEach((col, i) => {
+            const th = document.createElement('th');
+            th.textContent = col;
+            th.title = `${col} (${this.types[i]}) - click to sort`;
+            th.addEventListener('click', () => this.sortBy(i));
+            headerRow.appendChild(th);
+        });
+        this.headerCells = headerRow.children;
+
+        let filterTimer = null;
+        this.filterInput.addEventListener('input', () => {
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(() => {
+                this.filterText = this.filterInput.value.trim();
+                this.applyView();
+            }, 150);
+        });
+
+        this.viewport.addEventListener('scroll', () => {
+            this.header.scrollLeft = this.viewport.scrollLeft;
+            if (!this.frameRequested) {
+                this.frameRequested = true;
+                requestAnimationFrame(() => {
+                    this.frameRequested = false;
+                    this.renderVisible();
+                });
+            }
+        }, { passive: true });
+    }
+
+    columnWidth(col, columnIndex) {
+        let longest = col.length;
+        const sample = Math.min(this.rows.length, 200);
+        for (let i = 0; i < sample; i++) {
+            const value = this.rows[i][col];
+            if (value !== null && value !== undefined) {
+                longest = Math.max(longest, String(value).length);
+            }
+        }
+        const width = longest * 8 + 28;
+        return Math.max(80, Math.min(this.types[columnIndex] === 'string' ? 320 : 240, width));
+    }
+
+    sortBy(columnIndex) {
+        if (this.sortColumn === columnIndex) {
+            this.sortDirection = -this.sortDirection;
+        } else {
+            this.sortColumn = columnIndex;
+            this.sortDirection = 1;
+        }
+        Array.from(this.headerCells).forEach((th, i) => {
+            th.classList.toggle('sorted-asc', i === columnIndex && this.sortDirection === 1);
+            th.classList.toggle('sorted-desc', i === columnIndex && this.sortDirection === -1);
+        });
+        this.applyView();
+    }
+
+    buildFilter() {
+        // "column op value" compares typed keys; anything else is a case-insensitive substring match
+        if (!this.filterText) return null;
+
+        const match = ResultsGrid.FILTER.exec(this.filterText);
+        const columnIndex = match ? this.columns.indexOf(match[1]) : -1;
+        if (columnIndex >= 0) {
+            const [, , op, raw] = match;
+            const type = this.types[columnIndex];
+            const keys = this.keysFor(columnIndex);
+            if (op === '~') {
+                const needle = raw.toLowerCase();
+                const col = this.columns[columnIndex];
+                return i => this.rows[i][col] !== null && String(this.rows[i][col]).toLowerCase().includes(needle);
+            }
+            const target = type === 'string' ? raw.replace(/^'(.*)'$/, '$1') : this.toKey(raw, type);
+            const compare = type === 'string'
+                ? (a, b) => this.collator.compare(a, b)
+                : (a, b) => a - b;
+            const tests = {
+                '=': c => c === 0, '!=': c => c !== 0, '>': c => c > 0,
+                '>=': c => c >= 0, '<': c => c < 0, '<=': c => c <= 0
+            };
+            const test = tests[op];
+            return i => keys[i] !== null && test(compare(keys[i], target));
+        }
+
+        const needle = this.filterText.toLowerCase();
+        const columns = this.columns;
+        return i => {
+            const row = this.rows[i];
+            for (let c = 0; c < columns.length; c++) {
+                const value = row[columns[c]];
+                if (value !== null && value !== undefined && String(value).toLowerCase().includes(needle)) {
+                    return true;
+                }
+            }
+            return false;
+        };
+    }
+
+    applyView() {
+        const filter = this.buildFilter();
+        let indices;
+        if (filter) {
+            indices = [];
+            for (let i = 0; i < this.rows.length; i++) {
+                if (filter(i)) indices.push(i);
+            }
+            indices = Uint32Array.from(indices);
+        } else {
+            indices = new Uint32Array(this.rows.length);
+            for (let i = 0; i < indices.length; i++) indices[i] = i;
+        }
+
+        if (this.sortColumn !== null) {
+            const keys = this.keysFor(this.sortColumn);
+            const direction = this.sortDirection;
+            const isString = this.types[this.sortColumn] === 'string';
+            const collator = this.collator;
+            indices.sort((a, b) => {
+                const ka = keys[a];
+                const kb = keys[b];
+                // Nulls last in either direction
+                if (ka === null || Number.isNaN(ka)) return kb === null || Number.isNaN(kb) ? a - b : 1;
+                if (kb === null || Number.isNaN(kb)) return -1;
+                const c = isString ? collator.compare(ka, kb) : ka - kb;
+                return c !== 0 ? c * direction : a - b;
+            });
+        }
+
+        this.view = indices;
+        this.spacer.style.height = `${indices.length * ResultsGrid.ROW_HEIGHT}px`;
+        this.renderedRange = [-1, -1];
+        this.renderVisible();
+        this.updateStatus();
+    }
+
+    renderVisible() {
+        const rowHeight = ResultsGrid.ROW_HEIGHT;
+        const first = Math.max(0, Math.floor(this.viewport.scrollTop / rowHeight) - ResultsGrid.OVERSCAN);
+        const visible = Math.ceil(ResultsGrid.VIEWPORT_HEIGHT / rowHeight) + 2 * ResultsGrid.OVERSCAN;
+        const last = Math.min(this.view.length, first + visible);
+
+        if (first !== this.renderedRange[0] || last !== this.renderedRange[1]) {
+            this.renderedRange = [first, last];
+            const fragment = document.createDocumentFragment();
+            for (let v = first; v < last; v++) {
+                const row = this.rows[this.view[v]];
+                const tr = document.createElement('tr');
+                for (let c = 0; c < this.columns.length; c++) {
+                    const td = document.createElement('td');
+                    const value = row[this.columns[c]];
+                    if (value === null || value === undefined) {
+                        td.innerHTML = '<em>NULL</em>';
+                    } else {
+                        td.textContent = value;
+                    }
+                    tr.appendChild(td);
+                }
+                fragment.appendChild(tr);
+            }
+            this.tbody.replaceChildren(fragment);
+            this.bodyTable.style.transform = `translateY(${first * rowHeight}px)`;
+        }
+
+        // Prefetch the next page before the user reaches the end of the loaded rows
+        // Filtered views don't auto-load, which would otherwise page through the whole result
+        if (this.hasMore && !this.loadingMore && !this.filterText && last >= this.view.length - visible * 2) {
+            this.loadMore();
+        }
+    }
+
+    async loadMore() {
+        this.loadingMore = true;
+        this.updateStatus();
+        try {
+            if (!this.jobId) {
+                await this.startJob();
+                // The job re-runs the query, so restart from its first row for a consistent order
+                const firstPage = await this.fetchPage(0, Math.max(this.rows.length, ResultsGrid.PAGE_SIZE));
+                this.replaceRows(firstPage);
+            } else {
+                this.appendRows(await this.fetchPage(this.rows.length, ResultsGrid.PAGE_SIZE));
+            }
+            this.hasMore = this.rows.length < this.totalRows;
+        } catch (error) {
+            console.error('Failed to load more rows:', error);
+            this.hasMore = false;
+            this.status.textContent = `Could not load more rows: ${error.message}`;
+            return;
+        } finally {
+            this.loadingMore = false;
+        }
+        this.applyView();
+    }
+
+    async startJob() {
+        const response = await fetch('/api/jobs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ sql_query: this.sqlQuery })
+        });
+        let job = await response.json();
+        if (!response.ok) throw new Error(job.detail || 'Job submission failed');
+
+        while (job.status === 'queued' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 500));
+            job = await (await fetch(`/api/jobs/${job.job_id}`)).json();
+        }
+        if (job.status !== 'completed') throw new Error(job.error || `Job ${job.status}`);
+        this.jobId = job.job_id;
+        this.totalRows = job.row_count;
+    }
+
+    async fetchPage(offset, limit) {
+        const response = await fetch(`/api/jobs/${this.jobId}/results?offset=${offset}&limit=${limit}`);
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.detail || 'Failed to fetch rows');
+        return data.results;
+    }
+
+    replaceRows(rows) {
+        this.rows = rows;
+        this.sortKeys = {};
+    }
+
+    appendRows(rows) {
+        for (let i = 0; i < rows.length; i++) this.rows.push(rows[i]);
+    }
+
+    updateStatus() {
+        const shown = this.view ? this.view.length : 0;
+        const loaded = this.rows.length;
+        let text = shown === loaded
+            ? `${loaded.toLocaleString()} rows`
+            : `${shown.toLocaleString()} of ${loaded.toLocaleString()} rows`;
+        if (this.totalRows !== null && this.totalRows > loaded) {
+            text += ` (${this.totalRows.toLocaleString()} total)`;
+        } else if (this.hasMore) {
+            text += ' (more available)';
+        }
+        if (this.loadingMore) text += ' • loading…';
+        else if (this.hasMore && (this.filterText || this.sortColumn !== null)) text += ' • sorted/filtered over loaded rows';
+        this.status.textContent = text;
+    }
+
+    static async benchmark(sizes = [1000, 100000]) {
+        // Compares the old full innerHTML table with the virtualized grid; run from the console
+        const makeRows = n => Array.from({ length: n }, (_, i) => ({
+            id: i,
+            machine_code: `CNC-${String(i % 250).padStart(3, '0')}`,
+            status: ['running', 'idle', 'maintenance'][i % 3],
+            actual_units: (i * 7919) % 1000,
+            start_timestamp: new Date(Date.UTC(2025, 2, 10) + i * 60000).toISOString()
+        }));
+        const host = document.createElement('div');
+        host.style.cssText = 'position: absolute; left: -10000px; width: 900px;';
+        document.body.appendChild(host);
+
+        const results = [];
+        for (const size of sizes) {
+            const rows = makeRows(size);
+            const columns = Object.keys(rows[0]);
+
+            let start = performance.now();
+            let html = '<table><thead><tr>' + columns.map(c => `<th>${c}</th>`).join('') + '</tr></thead><tbody>';
+            rows.forEach(row => {
+                html += '<tr>' + columns.map(c => `<td>${row[c]}</td>`).join('') + '</tr>';
+            });
+            host.innerHTML = html + '</tbody></table>';
+            host.offsetHeight;
+            const fullTable = performance.now() - start;
+            host.innerHTML = '';
+
+            const mount = document.createElement('div');
+            host.appendChild(mount);
+            start = performance.now();
+            const grid = new ResultsGrid(mount, rows);
+            host.offsetHeight;
+            const gridRender = performance.now() - start;
+
+            start = performance.now();
+            grid.sortBy(3);
+            const sortTime = performance.now() - start;
+
+            start = performance.now();
+            grid.filterText = 'status = idle';
+            grid.applyView();
+            const filterTime = performance.now() - start;
+
+            start = performance.now();
+            grid.viewport.scrollTop = grid.viewport.scrollHeight / 2;
+            grid.renderVisible();
+            host.offsetHeight;
+            const scrollFrame = performance.now() - start;
+            host.innerHTML = '';
+
+            results.push({
+                rows: size,
+                'full table ms': +fullTable.toFixed(1),
+                'grid render ms': +gridRender.toFixed(1),
+                'sort ms': +sortTime.toFixed(1),
+                'filter ms': +filterTime.toFixed(1),
+                'scroll frame ms': +scrollFrame.toFixed(1)
+            });
+        }
+        host.remove();
+        console.table(results);
+        return results;
+    }
+}
+
+// Pages served under /plants/{id}/ query that plant's database
+const API_BASE = (window.location.pathname.match(/^\/plants\/[^/]+/) || [''])[0];
+
 class NLPSQLChatbot {
     constructor() {
         this.messagesContainer = document.getElementById('chat-messages');
@@ -12,6 +424,13 @@ class NLPSQLChatbot {
         this.messageId = 0;
         this.isLoading = false;
         this.sidebarCollapsed = false;
+        // One conversation per page load; lets the server answer refinements from cached results
+        this.sessionId = window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+        // Partial questions are sent once typing pauses so SQL generation starts before submit
+        this.speculationTimer = null;
+        this.lastSpeculated = '';
         
         this.init();
     }
@@ -25,6 +444,10 @@ class NLPSQLChatbot {
                 this.sendMessage();
             }
         });
+        this.inputField.addEventListener('input', () => {
+            clearTimeout(this.speculationTimer);
+            this.speculationTimer = setTimeout(() => this.speculate(), 700);
+        });
         
         // Sidebar toggle
         this.sidebarToggle.addEventListener('click', () => this.toggleSidebar());
@@ -74,7 +497,7 @@ class NLPSQLChatbot {
     
     async loadDatabaseSchema() {
         try {
-            const response = await fetch('/api/schema');
+            const response = await fetch(`${API_BASE}/api/schema`);
             const data = await response.json();
             
             if (data.success) {
@@ -128,11 +551,32 @@ class NLPSQLChatbot {
         `;
     }
     
+    speculate() {
+        const partialQuestion = this.inputField.value.trim();
+        if (this.isLoading || partialQuestion.length < 12 || partialQuestion === this.lastSpeculated) return;
+        this.lastSpeculated = partialQuestion;
+        
+        // Best effort: the submit works the same whether or not this lands
+        fetch(`${API_BASE}/api/speculate`, {
+            method: 'POST',
+            keepalive: true,
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                partial_question: partialQuestion,
+                session_id: this.sessionId
+            })
+        }).catch(() => {});
+    }
+    
     async sendMessage() {
         if (this.isLoading) return;
         
         const message = this.inputField.value.trim();
         if (!message) return;
+        clearTimeout(this.speculationTimer);
+        this.lastSpeculated = '';
         
         // Add user message
         this.addMessage('user', message);
@@ -144,14 +588,15 @@ class NLPSQLChatbot {
         
         try {
             // Send to backend
-            const response = await fetch('/api/query', {
+            const response = await fetch(`${API_BASE}/api/query`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
                     question: message,
-                    context: null
+                    context: null,
+                    session_id: this.sessionId
                 })
             });
             
@@ -161,7 +606,14 @@ class NLPSQLChatbot {
             this.removeMessage(loadingMessage);
             
             if (data.success) {
-                this.addMessage('assistant', 'Here\'s the SQL query and results:', data.sql_query, data.results, data.execution_time);
+                const intro = data.answered_by === 'session'
+                    ? 'Refined from the previous results:'
+                    : 'Here\'s the SQL query and results:';
+                this.addMessage('assistant', intro, data.sql_query, data.results, data.execution_time, false, {
+                    hasMore: data.has_more,
+                    sqlQuery: data.original_sql_query,
+                    cachedAt: data.cached_at
+                });
             } else {
                 this.addMessage('assistant', `Error: ${data.error}`, data.sql_query || null, null, null);
             }
@@ -175,7 +627,7 @@ class NLPSQLChatbot {
         }
     }
     
-    addMessage(sender, content, sqlQuery = null, results = null, executionTime = null, isLoading = false) {
+    addMessage(sender, content, sqlQuery = null, results = null, executionTime = null, isLoading = false, resultSource = {}) {
         const messageId = ++this.messageId;
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${sender}`;
@@ -203,13 +655,14 @@ class NLPSQLChatbot {
                 messageHTML += `
                     <div class="sql-container">
                         <div class="sql-query">${highlightedSQL}</div>
+                        <button class="sql-explain-button" data-sql="${this.escapeHtml(sqlQuery)}">Explain</button>
                         <button class="sql-copy-button" data-sql="${this.escapeHtml(sqlQuery)}">Copy</button>
                     </div>
                 `;
             }
             
             if (results && results.length > 0) {
-                messageHTML += this.renderResultsTable(results);
+                messageHTML += '<div class="results-grid-mount"></div>';
             } else if (results && results.length === 0) {
                 messageHTML += '<div class="text-secondary mt-2">No results found.</div>';
             }
@@ -219,6 +672,9 @@ class NLPSQLChatbot {
             if (executionTime) {
                 metaInfo += ` • Executed in ${executionTime.toFixed(3)}s`;
             }
+            if (resultSource.cachedAt) {
+                metaInfo += ` • Cached result from ${new Date(resultSource.cachedAt).toLocaleTimeString()}`;
+            }
             
             messageHTML += `
                 <div class="message-meta">
@@ -229,11 +685,57 @@ class NLPSQLChatbot {
         
         messageDiv.innerHTML = messageHTML;
         this.messagesContainer.appendChild(messageDiv);
+        
+        const gridMount = messageDiv.querySelector('.results-grid-mount');
+        if (gridMount) {
+            new ResultsGrid(gridMount, results, resultSource);
+        }
         this.scrollToBottom();
         
         return messageId;
     }
     
+    async explainSQL(button) {
+        const container = button.closest('.sql-container');
+        if (container.nextElementSibling && container.nextElementSibling.classList.contains('sql-explanation')) {
+            return;
+        }
+        
+        const output = document.createElement('div');
+        output.className = 'sql-explanation';
+        container.after(output);
+        button.disabled = true;
+        
+        try {
+            const response = await fetch(`${API_BASE}/api/explain`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ sql_query: button.getAttribute('data-sql') })
+            });
+            if (!response.ok) {
+                const error = await response.json().catch(() => ({}));
+                throw new Error(error.detail || response.statusText);
+            }
+            
+            // Render the explanation as it streams in
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                output.textContent += decoder.decode(value, { stream: true });
+                this.scrollToBottom();
+            }
+        } catch (error) {
+            console.error('Explain error:', error);
+            output.textContent = `Could not explain this query: ${error.message}`;
+        } finally {
+            button.disabled = false;
+        }
+    }
+    
     removeMessage(messageId) {
         const messageElement = document.querySelector(`[data-message-id="${messageId}"]`);
         if (messageElement) {
@@ -241,43 +743,6 @@ class NLPSQLChatbot {
         }
     }
     
-    renderResultsTable(results) {
-        if (!results || results.length === 0) {
-            return '<div class="text-secondary">No results found.</div>';
-        }
-        
-        const columns = Object.keys(results[0]);
-        
-        let tableHTML = `
-            <div class="results-table">
-                <table>
-                    <thead>
-                        <tr>
-                            ${columns.map(col => `<th>${this.escapeHtml(col)}</th>`).join('')}
-                        </tr>
-                    </thead>
-                    <tbody>
-        `;
-        
-        results.forEach(row => {
-            tableHTML += '<tr>';
-            columns.forEach(col => {
-                const value = row[col];
-                const displayValue = value === null ? '<em>NULL</em>' : this.escapeHtml(String(value));
-                tableHTML += `<td>${displayValue}</td>`;
-            });
-            tableHTML += '</tr>';
-        });
-        
-        tableHTML += `
-                    </tbody>
-                </table>
-            </div>
-        `;
-        
-        return tableHTML;
-    }
-    
     setLoading(loading) {
         this.isLoading = loading;
         this.sendButton.disabled = loading;
@@ -399,8 +864,13 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 });
 
-// Add copy functionality for SQL queries
+// Add copy and explain functionality for SQL queries
 document.addEventListener('click', (e) => {
+    if (e.target.classList.contains('sql-explain-button') && window.chatbot) {
+        window.chatbot.explainSQL(e.target);
+        return;
+    }
+
     if (e.target.classList.contains('sql-copy-button')) {
         const sqlQuery = e.target.getAttribute('data-sql');
         if (sqlQuery) {
@@ -0,0 +1,270 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Callable
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from database import DatabaseManager
+from pool_controller import CONTROL_CONNECTIONS
+from column_profiles import ColumnProfiler
+
+logger = logging.getLogger(__name__)
+
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$')
+
+# /plants/{tenant}/api/... is routed as /api/... against that plant's database
+TENANT_PATH_PATTERN = re.compile(r'^/plants/([^/]+)(/.*)$')
+
+# The plant database the current request targets; None means the default database
+current_tenant: ContextVar[Optional["Tenant"]] = ContextVar("current_tenant", default=None)
+
+
+class UnknownTenant(Exception):
+    pass
+
+
+class TenantUnavailable(Exception):
+    """No connection capacity could be freed for the tenant within the wait timeout"""
+
+
+class Tenant:
+    """One plant database: its pool, schema cache scope and column profiles"""
+
+    def __init__(self, tenant_id: str, db_manager: DatabaseManager):
+        self.tenant_id = tenant_id
+        self.db = db_manager
+        self.column_profiler = ColumnProfiler(db_manager)
+        self.max_connections = db_manager.max_connections
+        self.in_flight = 0
+        self.requests = 0
+        self.opened_at = datetime.now(timezone.utc).isoformat()
+        self.last_used = time.monotonic()
+
+
+class TenantRegistry:
+    """Lazily opened per-plant pools, LRU-evicted when idle to stay under a global connection cap.
+
+    Plants come from TENANTS_FILE ({"plant_a": {"dsn": ..., "max_connections": 5}}) or, for any
+    other id, from TENANT_DSN_TEMPLATE ("postgresql://user:pw@host/plant_{tenant}").
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.dsn_template = os.getenv("TENANT_DSN_TEMPLATE", "")
+        self.max_connections = int(os.getenv("TENANT_MAX_CONNECTIONS", "100"))
+        self.pool_min_size = int(os.getenv("TENANT_POOL_MIN_SIZE", "1"))
+        self.pool_max_size = int(os.getenv("TENANT_POOL_MAX_SIZE", "5"))
+        self.idle_ttl = float(os.getenv("TENANT_IDLE_TTL", "600"))
+        self.wait_timeout = float(os.getenv("TENANT_WAIT_TIMEOUT", "10"))
+        self.configs = self._load_configs(os.getenv("TENANTS_FILE", "tenants.json"))
+        self.tenants: Dict[str, Tenant] = {}
+        self._opening: Dict[str, asyncio.Task] = {}
+        self._capacity = asyncio.Condition()
+        self.sweeper_task: Optional[asyncio.Task] = None
+        self.stats = {'opened': 0, 'evicted_lru': 0, 'evicted_idle': 0, 'capacity_waits': 0, 'rejected': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.configs or self.dsn_template)
+
+    def _load_configs(self, path: str) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            configs = json.load(f)
+        logger.info(f"Loaded {len(configs)} plant databases from {path}")
+        return configs
+
+    def start(self):
+        if self.enabled and self.idle_ttl > 0:
+            self.sweeper_task = asyncio.create_task(self._run_sweeper())
+
+    @property
+    def reserved_connections(self) -> int:
+        """Connections the open pools may hold at their maximum size"""
+        return sum(tenant.max_connections for tenant in self.tenants.values())
+
+    def _config(self, tenant_id: str) -> Dict[str, Any]:
+        if not TENANT_ID_PATTERN.match(tenant_id):
+            raise UnknownTenant(tenant_id)
+        if tenant_id in self.configs:
+            return self.configs[tenant_id]
+        if self.dsn_template:
+            return {'dsn': self.dsn_template.format(tenant=tenant_id)}
+        raise UnknownTenant(tenant_id)
+
+    async def acquire(self, tenant_id: str) -> Tenant:
+        """Return the tenant with its pool open, leased until release() so it isn't evicted mid-request"""
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None or tenant_id in self._opening:
+            # Concurrent first requests share one pool opening, which outlives a cancelled request
+            if tenant_id not in self._opening:
+                self._opening[tenant_id] = asyncio.create_task(self._open(tenant_id))
+            tenant = await asyncio.shield(self._opening[tenant_id])
+        tenant.in_flight += 1
+        tenant.requests += 1
+        tenant.last_used = time.monotonic()
+        return tenant
+
+    async def release(self, tenant: Tenant):
+        async with self._capacity:
+            tenant.in_flight -= 1
+            tenant.last_used = time.monotonic()
+            self._capacity.notify_all()
+
+    async def _open(self, tenant_id: str) -> Tenant:
+        try:
+            return await self._connect(tenant_id)
+        finally:
+            self._opening.pop(tenant_id, None)
+
+    async def _connect(self, tenant_id: str) -> Tenant:
+        config = self._config(tenant_id)
+        max_size = int(config.get('max_connections', self.pool_max_size))
+        # Each pool also opens its control connection beyond max_size
+        await self._reserve(max_size + CONTROL_CONNECTIONS)
+
+        db_manager = DatabaseManager(
+            cache=self.cache,
+            tenant=tenant_id,
+            connection_params={'dsn': config['dsn']},
+            min_size=min(self.pool_min_size, max_size),
+            max_size=max_size,
+            statement_timeout=config.get('statement_timeout')
+        )
+        # Register before connecting so concurrent openings count this pool against the cap
+        tenant = Tenant(tenant_id, db_manager)
+        self.tenants[tenant_id] = tenant
+        try:
+            await db_manager.connect()
+        except Exception:
+            del self.tenants[tenant_id]
+            raise
+        self.stats['opened'] += 1
+        logger.info(f"Opened pool for plant {tenant_id} ({tenant.max_connections} connections, "
+                    f"{self.reserved_connections}/{self.max_connections} reserved)")
+        return tenant
+
+    async def _reserve(self, connections: int):
+        """Evict idle pools, least recently used first, until `connections` fit under the cap"""
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        async with self._capacity:
+            while self.reserved_connections + connections > self.max_connections:
+                idle = sorted(
+                    (t for t in self.tenants.values() if t.in_flight == 0 and t.tenant_id not in self._opening),
+                    key=lambda t: t.last_used
+                )
+                if idle:
+                    await self._evict(idle[0], 'evicted_lru')
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['rejected'] += 1
+                    raise TenantUnavailable(f"{self.reserved_connections} of {self.max_connections} connections in use")
+                if not waited:
+                    self.stats['capacity_waits'] += 1
+                    waited = True
+                try:
+                    await asyncio.wait_for(self._capacity.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _evict(self, tenant: Tenant, reason: str):
+        del self.tenants[tenant.tenant_id]
+        self.stats[reason] += 1
+        logger.info(f"Closing pool for plant {tenant.tenant_id} ({reason.replace('_', ' ')})")
+        await tenant.db.disconnect()
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_ttl))
+            now = time.monotonic()
+            for tenant in list(self.tenants.values()):
+                if tenant.in_flight == 0 and tenant.tenant_id not in self._opening and now - tenant.last_used > self.idle_ttl:
+                    try:
+                        await self._evict(tenant, 'evicted_idle')
+                    except Exception as e:
+                        logger.error(f"Failed to close pool for plant {tenant.tenant_id}: {e}")
+
+    async def close(self):
+        if self.sweeper_task:
+            self.sweeper_task.cancel()
+        for tenant in list(self.tenants.values()):
+            await tenant.db.disconnect()
+        self.tenants.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'open': len(self.tenants),
+            'reserved_connections': self.reserved_connections,
+            'max_connections': self.max_connections,
+            'tenants': [
+                {
+                    'tenant': tenant.tenant_id,
+                    'in_flight': tenant.in_flight,
+                    'requests': tenant.requests,
+                    'opened_at': tenant.opened_at,
+                    'idle_seconds': round(time.monotonic() - tenant.last_used, 1),
+                    'pool': tenant.db.pool.get_status() if tenant.db.pool else None
+                }
+                for tenant in sorted(self.tenants.values(), key=lambda t: t.tenant_id)
+            ]
+        }
+
+
+class TenantMiddleware:
+    """Selects the plant database from the TENANT_HEADER header or a /plants/{tenant} path prefix"""
+
+    def __init__(self, app, registry: Callable[[], Optional[TenantRegistry]]):
+        self.app = app
+        self.registry = registry
+        self.header = os.getenv("TENANT_HEADER", "X-Plant")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        tenant_id = Headers(scope=scope).get(self.header)
+        match = TENANT_PATH_PATTERN.match(scope['path'])
+        if match:
+            tenant_id = match.group(1)
+            scope = {**scope, 'path': match.group(2), 'raw_path': match.group(2).encode()}
+
+        registry = self.registry()
+        if not tenant_id or registry is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            tenant = await registry.acquire(tenant_id)
+        except UnknownTenant:
+            await JSONResponse({'detail': f"Unknown plant: {tenant_id}"}, status_code=404)(scope, receive, send)
+            return
+        except TenantUnavailable as e:
+            response = JSONResponse({'detail': f"Plant {tenant_id} is unavailable: {e}"}, status_code=503,
+                                    headers={'Retry-After': '5'})
+            await response(scope, receive, send)
+            return
+        except Exception as e:
+            logger.error(f"Failed to open database for plant {tenant_id}: {e}")
+            await JSONResponse({'detail': f"Database for plant {tenant_id} is unavailable"},
+                               status_code=503)(scope, receive, send)
+            return
+
+        token = current_tenant.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_tenant.reset(token)
+            await registry.release(tenant)
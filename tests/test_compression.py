@@ -0,0 +1,101 @@
+import asyncio
+import gzip
+
+import pytest
+
+from compression import CompressionMiddleware, PrecompressedStaticFiles
+from build_static import build
+
+
+def request(app, path, headers=None):
+    """Run one GET through the ASGI app; returns (status, headers, body)"""
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': b'', 'scheme': 'http', 'server': ('test', 80), 'http_version': '1.1',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+    messages = []
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            # The client stays connected until the response completes
+            await asyncio.Event().wait()
+        received = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = messages[0]
+    response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], response_headers, body
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / 'script.js').write_text('console.log("hello");\n' * 200)
+    return tmp_path
+
+
+def test_on_the_fly_compressed_static_file_revalidates(static_dir):
+    app = CompressionMiddleware(PrecompressedStaticFiles(directory=str(static_dir)))
+    status, headers, body = request(app, '/script.js', {'Accept-Encoding': 'gzip'})
+    assert status == 200 and headers['content-encoding'] == 'gzip'
+    assert headers['etag'].endswith('-gzip"')
+    assert gzip.decompress(body).startswith(b'console.log')
+
+    status, _, _ = request(app, '/script.js', {'Accept-Encoding': 'gzip', 'If-None-Match': headers['etag']})
+    assert status == 304
+
+
+def test_precompressed_variant_is_served_and_revalidates(static_dir):
+    build(str(static_dir), verbose=False)
+    app = CompressionMiddleware(PrecompressedStaticFiles(directory=str(static_dir)))
+    status, headers, body = request(app, '/script.js', {'Accept-Encoding': 'gzip'})
+    assert status == 200 and headers['content-encoding'] == 'gzip'
+    assert body == (static_dir / 'script.js.gz').read_bytes()
+
+    status, _, _ = request(app, '/script.js', {'Accept-Encoding': 'gzip', 'If-None-Match': headers['etag']})
+    assert status == 304
+
+
+def test_changed_file_is_not_reported_unmodified(static_dir):
+    app = CompressionMiddleware(PrecompressedStaticFiles(directory=str(static_dir)))
+    _, headers, _ = request(app, '/script.js', {'Accept-Encoding': 'gzip'})
+    (static_dir / 'script.js').write_text('console.log("changed");\n' * 300)
+    status, _, _ = request(app, '/script.js', {'Accept-Encoding': 'gzip', 'If-None-Match': headers['etag']})
+    assert status == 200
+
+
+def test_build_skips_up_to_date_variants_and_leaves_no_temp_files(static_dir):
+    build(str(static_dir), verbose=False)
+    variant = static_dir / 'script.js.gz'
+    built_at = variant.stat().st_mtime_ns
+    build(str(static_dir), verbose=False)
+    assert variant.stat().st_mtime_ns == built_at
+    assert not list(static_dir.glob('*.tmp'))
+
+
+def test_large_bodies_are_compressed_in_a_thread(monkeypatch):
+    threads = []
+    real_to_thread = asyncio.to_thread
+
+    async def to_thread(func, *args):
+        threads.append(func)
+        return await real_to_thread(func, *args)
+
+    monkeypatch.setattr(asyncio, 'to_thread', to_thread)
+    body = b'{"rows": [' + b'{"machine_id": 1}, ' * 5000 + b'{}]}'
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    status, headers, compressed = request(CompressionMiddleware(app), '/api/data', {'Accept-Encoding': 'gzip'})
+    assert status == 200 and headers['content-encoding'] == 'gzip'
+    assert gzip.decompress(compressed) == body
+    assert len(threads) == 1
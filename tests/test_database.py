@@ -0,0 +1,136 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from database import DatabaseManager, is_volatile
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.copy_timeout = 'unset'
+
+    async def execute(self, query):
+        self.executed.append(query)
+
+    async def copy_from_query(self, query, output, format, header, timeout):
+        self.copy_timeout = timeout
+        await asyncio.sleep(0.01)
+        await output(b"machine_id\n1\n")
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.in_use = 0
+        self.peak = 0
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+        try:
+            yield self.conn
+        finally:
+            self.in_use -= 1
+
+
+def export(timeout):
+    async def run():
+        db = DatabaseManager(connection_params={'dsn': 'postgresql://test'})
+        db.pool = FakePool()
+        chunks = [chunk async for chunk in db.stream_query_csv("SELECT machine_id FROM machines;", timeout=timeout)]
+        return chunks, db.pool.conn
+
+    return asyncio.run(run())
+
+
+def test_export_timeout_overrides_the_statement_timeout():
+    chunks, conn = export(600)
+    assert chunks == [b"machine_id\n1\n"]
+    assert conn.executed == ["SET statement_timeout = 600000"]
+    assert conn.copy_timeout == 600
+
+
+@pytest.mark.parametrize("timeout", [None, 0])
+def test_export_without_a_timeout_keeps_the_pool_statement_timeout(timeout):
+    _, conn = export(timeout)
+    assert conn.executed == []
+    assert conn.copy_timeout is None
+
+
+def test_concurrent_exports_share_a_bounded_number_of_connections(monkeypatch):
+    monkeypatch.setenv("EXPORT_MAX_CONCURRENCY", "2")
+
+    async def run():
+        db = DatabaseManager(connection_params={'dsn': 'postgresql://test'})
+        db.pool = FakePool()
+
+        async def export_one():
+            return [chunk async for chunk in db.stream_query_csv("SELECT machine_id FROM machines", timeout=60)]
+
+        results = await asyncio.gather(*(export_one() for _ in range(5)))
+        return results, db.pool.peak
+
+    results, peak = asyncio.run(run())
+    assert all(chunks == [b"machine_id\n1\n"] for chunks in results)
+    assert peak == 2
+
+
+@pytest.mark.parametrize("sql_query, volatile", [
+    ("SELECT * FROM production_runs WHERE start_timestamp > NOW() - interval '1 day'", True),
+    ("SELECT * FROM quality_checks WHERE check_date = CURRENT_DATE", True),
+    ("SELECT * FROM production_runs WHERE start_timestamp > 'today'::date", True),
+    ("SELECT * FROM machines ORDER BY random() LIMIT 5", True),
+    ("SELECT * FROM production_runs WHERE start_timestamp >= '2025-03-10'", False),
+    ("SELECT machine_id AS now_running FROM machines", False),
+])
+def test_volatile_queries_are_detected(sql_query, volatile):
+    assert is_volatile(sql_query) == volatile
+
+
+class FakeSharedCache:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, namespace, key):
+        return self.values.get((namespace, key))
+
+    async def set(self, namespace, key, value, ttl=None):
+        self.values[(namespace, key)] = value
+
+
+class FetchConnection:
+    def __init__(self):
+        self.fetches = 0
+
+    async def fetch(self, query):
+        self.fetches += 1
+        return [{'machine_id': 1}]
+
+
+def cached_twice(sql_query):
+    async def run():
+        db = DatabaseManager(cache=FakeSharedCache(), connection_params={'dsn': 'postgresql://test'})
+        db.pool = FakePool()
+        db.pool.conn = FetchConnection()
+        first = await db.execute_cached(sql_query)
+        second = await db.execute_cached(sql_query)
+        return first, second, db.pool.conn.fetches
+
+    return asyncio.run(run())
+
+
+def test_cached_results_report_when_they_were_computed():
+    (rows, _, first_cached_at), (cached_rows, _, cached_at), fetches = cached_twice("SELECT machine_id FROM machines")
+    assert fetches == 1
+    assert first_cached_at is None
+    assert cached_rows == rows == [{'machine_id': 1}]
+    assert cached_at is not None
+
+
+def test_volatile_queries_bypass_the_result_cache():
+    (_, _, first_cached_at), (_, _, cached_at), fetches = cached_twice("SELECT machine_id FROM machines WHERE NOW() > '2025-01-01'")
+    assert fetches == 2
+    assert first_cached_at is None and cached_at is None
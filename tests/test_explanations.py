@@ -0,0 +1,60 @@
+import asyncio
+
+from explanations import QueryExplainer
+
+
+class FakeDatabase:
+    def __init__(self, tenant=None, table='machines'):
+        self.tenant = tenant
+        self.table = table
+
+    def cache_key(self, key):
+        return f"{self.tenant}/{key}" if self.tenant else key
+
+    async def get_schema_info(self):
+        return [{'table_name': 'machines', 'columns': []}]
+
+    def format_schema_compact(self, tables):
+        return f"{self.tenant or 'default'}: {self.table}"
+
+
+class FakeLLM:
+    def __init__(self):
+        self.contexts = []
+
+    async def stream_explanation(self, sql_query, schema_context):
+        self.contexts.append(schema_context)
+        yield f"Explained with {schema_context}"
+
+
+class FakeSharedCache:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, namespace, key):
+        return self.values.get((namespace, key))
+
+    async def set(self, namespace, key, value, ttl=None):
+        self.values[(namespace, key)] = value
+
+
+def test_explanations_are_cached_per_database():
+    llm = FakeLLM()
+    cache = FakeSharedCache()
+    default_db, plant_db = FakeDatabase(), FakeDatabase(tenant='plant_a')
+    explainer = QueryExplainer(default_db, llm, cache=cache)
+    sql_query = "SELECT * FROM machines"
+
+    async def explain(db_manager):
+        pending = await explainer.explain(sql_query, db_manager)
+        return ''.join([chunk async for chunk in pending.follow()])
+
+    async def run():
+        return [await explain(None), await explain(plant_db), await explain(plant_db)]
+
+    default_text, plant_text, plant_again = asyncio.run(run())
+    assert default_text == "Explained with default: machines"
+    assert plant_text == plant_again == "Explained with plant_a: machines"
+    assert len(llm.contexts) == 2
+    assert explainer.stats['memory_hits'] == 1
+    assert {key.startswith('plant_a/') for _, key in cache.values} == {True, False}
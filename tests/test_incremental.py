@@ -0,0 +1,132 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from incremental import plan_refresh, IncrementalRefresher
+from query_rewriter import SQLRewriter
+
+SCHEMA = [
+    {'table_name': 'production_runs', 'columns': [
+        {'column_name': 'start_timestamp', 'data_type': 'timestamp with time zone'},
+        {'column_name': 'machine_id', 'data_type': 'integer'},
+        {'column_name': 'actual_units', 'data_type': 'integer'},
+    ]},
+    {'table_name': 'quality_checks', 'columns': [
+        {'column_name': 'check_date', 'data_type': 'date'},
+        {'column_name': 'result', 'data_type': 'text'},
+    ]},
+    {'table_name': 'machines', 'columns': [
+        {'column_name': 'machine_id', 'data_type': 'integer'},
+        {'column_name': 'name', 'data_type': 'text'},
+    ]},
+]
+
+WATERMARK = '2024-01-02T10:00:00+00:00'
+
+
+def plan(sql_query):
+    refresh_plan, reason = plan_refresh(sql_query, SCHEMA)
+    assert refresh_plan, reason
+    return refresh_plan
+
+
+def test_rows_ordered_descending_are_replaced_at_the_start():
+    refresh_plan = plan("SELECT * FROM production_runs ORDER BY start_timestamp DESC")
+    assert (refresh_plan.kind, refresh_plan.position, refresh_plan.output_column) == ('rows', 'start', 'start_timestamp')
+    assert refresh_plan.boundary(WATERMARK, 3600) == (
+        f"(('{WATERMARK}'::timestamp with time zone - interval '3600 seconds')::timestamp with time zone)"
+    )
+
+
+def test_date_column_boundary_rereads_the_whole_watermark_day():
+    refresh_plan = plan("SELECT check_date, result FROM quality_checks WHERE check_date >= '2024-01-01'")
+    assert refresh_plan.boundary('2024-01-02', 0) == "(('2024-01-02'::date - interval '0 seconds')::date)"
+
+
+def test_predicate_is_anded_around_the_existing_where_clause():
+    refresh_plan = plan(
+        "SELECT pr.machine_id, m.name, pr.start_timestamp AS started FROM production_runs pr "
+        "JOIN machines m ON m.machine_id = pr.machine_id WHERE m.name = 'A' OR m.name = 'B' ORDER BY pr.start_timestamp"
+    )
+    assert refresh_plan.output_column == 'started'
+    assert refresh_plan.with_predicate("pr.start_timestamp >= X") == (
+        "SELECT pr.machine_id, m.name, pr.start_timestamp AS started FROM production_runs pr "
+        "JOIN machines m ON m.machine_id = pr.machine_id WHERE pr.start_timestamp >= X AND "
+        "(m.name = 'A' OR m.name = 'B') ORDER BY pr.start_timestamp"
+    )
+
+
+def test_predicate_is_inserted_before_group_by_without_a_where_clause():
+    refresh_plan = plan(
+        "SELECT DATE_TRUNC('hour', start_timestamp) AS hour, SUM(actual_units) FROM production_runs GROUP BY 1 ORDER BY hour;"
+    )
+    assert (refresh_plan.kind, refresh_plan.output_column) == ('buckets', 'hour')
+    assert refresh_plan.with_predicate("start_timestamp >= X") == (
+        "SELECT DATE_TRUNC('hour', start_timestamp) AS hour, SUM(actual_units) FROM production_runs "
+        "WHERE start_timestamp >= X GROUP BY 1 ORDER BY hour"
+    )
+    assert refresh_plan.boundary(WATERMARK, 0) == (
+        f"DATE_TRUNC('hour', ('{WATERMARK}'::timestamp with time zone - interval '0 seconds'))"
+    )
+
+
+@pytest.mark.parametrize("sql_query, reason", [
+    ("SELECT machine_id FROM production_runs ORDER BY start_timestamp", "timestamp column not in the result"),
+    ("SELECT * FROM production_runs WHERE start_timestamp > NOW() - interval '1 day'", "relative time window"),
+    ("SELECT * FROM production_runs ORDER BY start_timestamp LIMIT 10", "LIMIT/OFFSET"),
+    ("SELECT machine_id, SUM(actual_units) FROM production_runs GROUP BY machine_id", "not grouped by a time bucket"),
+    ("SELECT * FROM machines ORDER BY name", "not ordered by a timestamp column"),
+])
+def test_other_shapes_fall_back(sql_query, reason):
+    refresh_plan, fallback_reason = plan_refresh(sql_query, SCHEMA)
+    assert refresh_plan is None
+    assert fallback_reason.startswith(reason)
+
+
+class FakeCache:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, namespace, key):
+        return self.values.get((namespace, key))
+
+    async def set(self, namespace, key, value, ttl=None):
+        self.values[(namespace, key)] = value
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.queries = []
+
+    def cache_key(self, key):
+        return key
+
+    async def get_schema_info(self):
+        return SCHEMA
+
+    async def execute_at_snapshot(self, sql_query, watermark_query):
+        self.queries.append(sql_query)
+        watermark = {'watermark': datetime(2024, 1, 2, 10, tzinfo=timezone.utc)}
+        if 'replace_from' in watermark_query:
+            watermark['replace_from'] = datetime(2024, 1, 2, 9, tzinfo=timezone.utc)
+        return [{'start_timestamp': '2024-01-02T09:30:00+00:00'}], watermark, 0.01
+
+
+def test_token_round_trip_returns_a_delta_from_the_lookback_boundary():
+    async def run():
+        refresher = IncrementalRefresher(FakeCache())
+        database = FakeDatabase()
+        sql_query = "SELECT * FROM production_runs ORDER BY start_timestamp"
+        _, _, _, full = await refresher.execute(database, sql_query, None, SQLRewriter(default_limit=0))
+        _, _, _, delta = await refresher.execute(database, sql_query, full['result_token'], SQLRewriter(default_limit=0))
+        return refresher, database, full, delta
+
+    refresher, database, full, delta = asyncio.run(run())
+    assert full['mode'] == 'full' and full['watermark'] == WATERMARK
+    assert delta['mode'] == 'delta'
+    assert delta['replace_from'] == '2024-01-02T09:00:00+00:00'
+    assert delta['column'] == 'start_timestamp'
+    assert f"start_timestamp >= (('{WATERMARK}'::timestamp with time zone - interval '{refresher.lookback} seconds')" \
+        in database.queries[-1]
+    assert delta['result_token'] != full['result_token']
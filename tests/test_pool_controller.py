@@ -0,0 +1,92 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from pool_controller import AdaptivePool
+
+
+class FakeConnection:
+    async def fetchval(self, query, *args):
+        return 1
+
+
+class FakePool:
+    def __init__(self, size):
+        self.slots = asyncio.Semaphore(size)
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        async with self.slots:
+            yield FakeConnection()
+
+
+def test_limit_starts_at_max_and_shrinks_when_idle():
+    async def run():
+        pool = AdaptivePool(FakePool(5), min_size=2, max_size=4)
+        assert pool.limit == 4
+        await pool.adjust()
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.limit == 3
+    assert pool.decisions[-1]['action'] == 'shrink'
+
+
+def test_a_burst_after_shrinking_grows_the_limit_without_waiting_for_a_tick():
+    async def run():
+        pool = AdaptivePool(FakePool(9), min_size=1, max_size=8)
+        pool.limit = 1
+        release = asyncio.Event()
+
+        async def hold():
+            async with pool.acquire():
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        state = (pool.limit, pool._in_use, pool._waiting)
+        release.set()
+        await asyncio.gather(*tasks)
+        return state, pool
+
+    (limit, in_use, waiting), pool = asyncio.run(run())
+    assert (limit, in_use, waiting) == (4, 4, 0)
+    assert pool.decisions[-1]['reason'] == "caller waiting for a connection"
+
+
+def test_callers_queue_once_the_limit_reaches_the_maximum():
+    async def run():
+        pool = AdaptivePool(FakePool(3), min_size=1, max_size=2)
+        release = asyncio.Event()
+
+        async def hold():
+            async with pool.acquire():
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        state = (pool.limit, pool._in_use, pool._waiting)
+        release.set()
+        await asyncio.gather(*tasks)
+        return state
+
+    assert asyncio.run(run()) == (2, 2, 1)
+
+
+def test_control_connection_bypasses_a_saturated_limit():
+    async def run():
+        pool = AdaptivePool(FakePool(3), min_size=1, max_size=2)
+        release = asyncio.Event()
+
+        async def hold():
+            async with pool.acquire():
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        async with pool.control(timeout=1) as conn:
+            result = await asyncio.wait_for(conn.fetchval("SELECT 1"), 1)
+        release.set()
+        await asyncio.gather(*tasks)
+        return result
+
+    assert asyncio.run(run()) == 1
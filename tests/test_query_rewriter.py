@@ -0,0 +1,114 @@
+import asyncio
+import os
+
+import pytest
+
+from query_rewriter import SQLRewriter
+
+BASE = "SELECT * FROM production_runs pr WHERE "
+
+
+@pytest.fixture
+def rewriter():
+    return SQLRewriter(default_limit=0)
+
+
+@pytest.mark.parametrize("predicate, expected", [
+    ("pr.start_timestamp::date = '2025-03-10'",
+     "(pr.start_timestamp >= '2025-03-10' AND pr.start_timestamp < '2025-03-11')"),
+    ("DATE(pr.start_timestamp) >= '2025-03-10'", "pr.start_timestamp >= '2025-03-10'"),
+    ("CAST(pr.start_timestamp AS DATE) < '2025-03-10'", "pr.start_timestamp < '2025-03-10'"),
+    ("pr.start_timestamp::date <= '2025-03-10'", "pr.start_timestamp < '2025-03-11'"),
+    ("pr.start_timestamp::date > '2025-03-10'", "pr.start_timestamp >= '2025-03-11'"),
+    ("DATE_TRUNC('month', pr.start_timestamp) = '2025-12-01'",
+     "(pr.start_timestamp >= '2025-12-01' AND pr.start_timestamp < '2026-01-01')"),
+    ("DATE_TRUNC('hour', pr.start_timestamp) > '2025-03-10T06:00:00'", "pr.start_timestamp >= '2025-03-10T07:00:00'"),
+    ("EXTRACT(YEAR FROM pr.start_timestamp) = 2024",
+     "(pr.start_timestamp >= '2024-01-01' AND pr.start_timestamp < '2025-01-01')"),
+    ("pr.start_timestamp::date BETWEEN '2025-03-01' AND '2025-03-31'",
+     "(pr.start_timestamp >= '2025-03-01' AND pr.start_timestamp < '2025-04-01')"),
+])
+def test_wrapped_timestamp_predicates_become_half_open_ranges(rewriter, predicate, expected):
+    result = rewriter.rewrite_query(BASE + predicate)
+    assert result.rewritten_query == BASE + expected
+    assert result.original_query == BASE + predicate
+    assert len(result.rewrites_applied) == 1
+
+
+@pytest.mark.parametrize("predicate", [
+    # Not a bucket boundary, so there is no equivalent range
+    "DATE_TRUNC('month', pr.start_timestamp) = '2025-03-15'",
+    "pr.start_timestamp::date NOT BETWEEN '2025-03-01' AND '2025-03-31'",
+    "EXTRACT(MONTH FROM pr.start_timestamp) = 3",
+    "DATE(pr.start_timestamp + interval '1 hour') = '2025-03-10'",
+    "pr.start_timestamp::date = CURRENT_DATE",
+])
+def test_other_predicates_are_left_alone(rewriter, predicate):
+    result = rewriter.rewrite_query(BASE + predicate)
+    assert result.rewritten_query == BASE + predicate
+    assert result.rewrites_applied == []
+
+
+def test_limit_is_injected_into_unaggregated_queries():
+    result = SQLRewriter(default_limit=100).rewrite_query("SELECT * FROM production_runs;")
+    assert result.rewritten_query == "SELECT * FROM production_runs\nLIMIT 100;"
+    assert result.limit_applied == 100
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT * FROM production_runs LIMIT 5",
+    "SELECT * FROM production_runs FETCH FIRST 5 ROWS ONLY",
+    "SELECT machine_id, COUNT(*) FROM production_runs GROUP BY machine_id",
+    "SELECT COUNT(*) FROM production_runs",
+    "SELECT ROUND(AVG(actual_units), 1) FROM production_runs",
+])
+def test_limit_is_not_injected(sql_query):
+    result = SQLRewriter(default_limit=100).rewrite_query(sql_query)
+    assert result.rewritten_query == sql_query
+    assert result.limit_applied is None
+
+
+def test_window_functions_and_subquery_limits_still_get_a_limit():
+    rewriter = SQLRewriter(default_limit=100)
+    assert rewriter.rewrite_query(
+        "SELECT machine_id, ROW_NUMBER() OVER (ORDER BY start_timestamp) FROM production_runs"
+    ).limit_applied == 100
+    assert rewriter.rewrite_query(
+        "SELECT * FROM machines WHERE machine_id IN (SELECT machine_id FROM production_runs LIMIT 3)"
+    ).limit_applied == 100
+
+
+def test_limit_injection_can_be_disabled():
+    assert SQLRewriter(default_limit=100).rewrite_query(
+        "SELECT * FROM production_runs", inject_limit=False
+    ).limit_applied is None
+    assert SQLRewriter(default_limit=0).rewrite_query("SELECT * FROM production_runs").limit_applied is None
+
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL not set")
+def test_rewritten_predicate_lowers_the_plan_cost():
+    from database import DatabaseManager
+
+    async def run():
+        db = DatabaseManager(connection_params={'dsn': os.environ["TEST_DATABASE_URL"]}, min_size=1, max_size=1)
+        await db.connect()
+        try:
+            async with db.pool.acquire() as conn:
+                await conn.execute("""
+                    DROP TABLE IF EXISTS rewrite_plan_runs;
+                    CREATE TABLE rewrite_plan_runs AS
+                        SELECT g AS id, timestamp '2024-01-01' + g * interval '1 minute' AS start_timestamp
+                        FROM generate_series(1, 200000) g;
+                    CREATE INDEX ON rewrite_plan_runs (start_timestamp);
+                    ANALYZE rewrite_plan_runs;
+                """)
+            sql_query = "SELECT * FROM rewrite_plan_runs WHERE start_timestamp::date = '2024-03-10'"
+            rewritten = SQLRewriter(default_limit=0).rewrite_query(sql_query).rewritten_query
+            return await db.estimate_query_cost(sql_query), await db.estimate_query_cost(rewritten)
+        finally:
+            async with db.pool.acquire() as conn:
+                await conn.execute("DROP TABLE IF EXISTS rewrite_plan_runs")
+            await db.disconnect()
+
+    before, after = asyncio.run(run())
+    assert after < before / 10
@@ -0,0 +1,69 @@
+import json
+from datetime import date
+
+import pytest
+
+from query_templates import QueryHistory, TemplateMatcher
+
+PASSED_SQL = (
+    "SELECT m.name FROM machines m JOIN quality_checks q ON q.machine_id = m.machine_id "
+    "WHERE q.result = 'pass' AND q.check_date >= '{day}' AND q.check_date < '{next_day}'"
+)
+
+
+@pytest.fixture
+def matcher(tmp_path):
+    history_path = tmp_path / "history.jsonl"
+    with open(history_path, "w") as history_file:
+        for day, next_day in (("2025-03-10", "2025-03-11"), ("2025-03-12", "2025-03-13")):
+            history_file.write(json.dumps({
+                'question': f"Which machines passed quality checks on {day}?",
+                'sql_query': PASSED_SQL.format(day=day, next_day=next_day)
+            }) + "\n")
+        for n in (3, 5):
+            history_file.write(json.dumps({
+                'question': f"List top {n} machines by units",
+                'sql_query': f"SELECT machine_id, SUM(actual_units) FROM production_runs GROUP BY 1 ORDER BY 2 DESC LIMIT {n}"
+            }) + "\n")
+    matcher = TemplateMatcher(QueryHistory(str(history_path)), str(tmp_path / "templates.json"))
+    matcher.load()
+    return matcher
+
+
+def test_slots_are_extracted_into_a_typed_shape(matcher):
+    shape, slots = matcher.extract_slots("Downtime for CNC-101 on the night shift on Mar 3rd, 2025 over 15 minutes")
+    assert shape == "downtime for <machine> on the <shift> shift on <date> over <number> minutes"
+    assert slots == [('machine', 'CNC-101'), ('shift', 'night'), ('date', date(2025, 3, 3)), ('number', '15')]
+
+
+def test_sql_is_generalized_including_derived_next_day_literals(matcher):
+    sql_template = matcher._generalize_sql(
+        PASSED_SQL.format(day="2025-03-10", next_day="2025-03-11"), [('date', date(2025, 3, 10))]
+    )
+    assert "'{date_0}'" in sql_template and "'{date_0:next}'" in sql_template
+    assert matcher._generalize_sql("SELECT 1", [('machine', 'CNC-101')]) is None
+
+
+def test_curated_template_renders_new_slot_values(matcher):
+    assert len(matcher.templates) == 2
+    match = matcher.match("Which machines passed quality checks on 2025-04-01?")
+    assert match['match'] == 'exact'
+    assert match['sql_query'] == PASSED_SQL.format(day="2025-04-01", next_day="2025-04-02")
+
+
+def test_filler_word_differences_still_match(matcher):
+    match = matcher.match("Show me the top 7 machines by units please")
+    assert match['match'] == 'stop_words'
+    assert match['sql_query'].endswith("LIMIT 7")
+
+
+@pytest.mark.parametrize("question", [
+    "Which machines failed quality checks on 2025-04-01?",
+    "List bottom 3 machines by units",
+    "List top 3 machines by scrap",
+    "Which machines did not pass quality checks on 2025-04-01?",
+    "Which machines passed quality checks on CNC-101?",
+])
+def test_near_miss_shapes_fall_through_to_the_llm(matcher, question):
+    assert matcher.match(question) is None
+    assert matcher.stats['fallthroughs'] == 1
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from rollups import RollupManager
+
+SCHEMA = [{
+    'table_name': 'production_runs',
+    'columns': [{'column_name': name} for name in (
+        'start_timestamp', 'end_timestamp', 'machine_id', 'shift_id',
+        'planned_units', 'actual_units', 'rejected_units'
+    )]
+}]
+
+
+@pytest.fixture
+def manager():
+    manager = RollupManager(db_manager=None)
+    asyncio.run(manager.initialize(SCHEMA))
+    manager.state['rollup_production_daily'] = {'refreshed_at': datetime.now(timezone.utc), 'watermark': None}
+    return manager
+
+
+def routed(manager, sql_query):
+    route = manager.route_query(sql_query)
+    return route.routed_query if route else None
+
+
+def test_count_star_keeps_its_name_and_is_zero_on_empty_ranges(manager):
+    assert routed(manager, "SELECT machine_id, COUNT(*) FROM production_runs GROUP BY machine_id") == (
+        "SELECT machine_id, COALESCE(SUM(row_count), 0) AS count FROM rollup_production_daily GROUP BY machine_id;"
+    )
+
+
+def test_avg_divides_by_the_measure_non_null_count(manager):
+    sql = routed(manager, "SELECT shift_id, AVG(actual_units) FROM production_runs GROUP BY shift_id")
+    assert "(SUM(actual_units)::numeric / NULLIF(SUM(actual_units_count), 0)) AS avg" in sql
+    assert "row_count" not in sql
+
+
+def test_existing_aliases_and_nested_aggregates_are_kept(manager):
+    sql = routed(
+        manager,
+        "SELECT pr.shift_id, ROUND(AVG(pr.actual_units), 1) AS avg_units, COUNT(*) AS runs "
+        "FROM production_runs pr GROUP BY pr.shift_id HAVING COUNT(*) > 5"
+    )
+    assert "ROUND((SUM(pr.actual_units)::numeric / NULLIF(SUM(pr.actual_units_count), 0)), 1) AS avg_units" in sql
+    assert "COALESCE(SUM(pr.row_count), 0) AS runs" in sql
+    # HAVING can't take an alias
+    assert "HAVING COALESCE(SUM(pr.row_count), 0) > 5" in sql
+
+
+def test_day_aligned_ranges_route_and_unaligned_ones_do_not(manager):
+    assert "bucket_date >= '2024-01-01'" in routed(
+        manager, "SELECT COUNT(*) FROM production_runs WHERE start_timestamp >= '2024-01-01'"
+    )
+    assert routed(manager, "SELECT COUNT(*) FROM production_runs WHERE start_timestamp >= '2024-01-01 06:00'") is None
+
+
+def test_unmappable_aggregates_are_not_routed(manager):
+    assert routed(manager, "SELECT MAX(actual_units) FROM production_runs") is None
+    assert routed(manager, "SELECT AVG(machine_id) FROM production_runs") is None
+
+
+def test_select_list_stores_a_count_per_summed_measure(manager):
+    select_list = manager._select_list(manager.rollups['rollup_production_daily'])
+    assert select_list.endswith(
+        "COUNT(planned_units) AS planned_units_count, COUNT(actual_units) AS actual_units_count, "
+        "COUNT(rejected_units) AS rejected_units_count"
+    )
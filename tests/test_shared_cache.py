@@ -0,0 +1,33 @@
+import pytest
+
+from shared_cache import SharedCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SharedCache(path=str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def last_access(cache, key):
+    return cache._conn.execute("SELECT last_access FROM cache WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_within_the_touch_interval_do_not_write(cache):
+    cache.touch_interval = 60
+    cache.set_sync("result", "k", {'rows': [1]})
+    written = cache._conn.total_changes
+    for _ in range(5):
+        assert cache.get_sync("result", "k") == {'rows': [1]}
+    assert cache._conn.total_changes == written
+    assert cache.stats['result']['hits'] == 5
+
+
+def test_stale_access_time_is_refreshed_on_a_hit(cache):
+    cache.touch_interval = 60
+    cache.set_sync("result", "k", 1)
+    cache._conn.execute("UPDATE cache SET last_access = last_access - 120")
+    before = last_access(cache, "k")
+    cache.get_sync("result", "k")
+    assert last_access(cache, "k") > before + 100
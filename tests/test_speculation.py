@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from speculation import SpeculationManager
+
+
+async def generate(question, context):
+    await asyncio.sleep(0.01)
+    return f"-- {question}"
+
+
+async def speculate_then_take(partial, submitted):
+    manager = SpeculationManager(generate)
+    assert manager.speculate("s1", partial, None)
+    return await manager.take("s1", submitted, None), manager
+
+
+@pytest.mark.parametrize("partial, submitted", [
+    ("Show runs sorted ascending", "Show runs sorted descending"),
+    ("How many checks passed last week", "How many checks failed last week"),
+    ("Machines with downtime above average", "Machines with downtime below average"),
+    ("Top 5 machines by scrap", "Top 10 machines by scrap"),
+    ("Runs for shift 'Night'", "Runs for shift 'Day'"),
+    ("Downtime per machine", "Downtime per machine per shift"),
+])
+def test_different_questions_are_not_reused(partial, submitted):
+    sql_query, manager = asyncio.run(speculate_then_take(partial, submitted))
+    assert sql_query is None
+    assert manager.stats['misses'] == 1
+
+
+def test_case_spacing_and_punctuation_differences_are_reused():
+    sql_query, manager = asyncio.run(speculate_then_take("show  downtime, by machine", "Show downtime by machine?"))
+    assert sql_query == "-- show  downtime, by machine"
+    assert manager.stats['hits'] == 1
+
+
+def test_newer_partial_question_cancels_the_previous_one():
+    async def run():
+        manager = SpeculationManager(generate)
+        manager.speculate("s1", "show downtime by line", None)
+        first = manager.latest["s1"].task
+        manager.speculate("s1", "show downtime by line for last week", None)
+        await asyncio.sleep(0)
+        return first, manager
+
+    first, manager = asyncio.run(run())
+    assert first.cancelled()
+    assert manager.stats['cancelled'] == 1
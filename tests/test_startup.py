@@ -0,0 +1,55 @@
+import os
+import sys
+import asyncio
+import subprocess
+
+from startup import StartupTracker
+
+
+def test_failed_warmup_is_retried_until_ready():
+    async def run():
+        tracker = StartupTracker()
+        tracker.retry_backoff = 0.01
+        failures = [ConnectionError("database unavailable")]
+
+        async def warm_up():
+            await tracker.phase("schema", asyncio.sleep(0))
+            if failures:
+                raise failures.pop()
+
+        tracker.start_warmup(warm_up)
+        assert not tracker.ready
+        await asyncio.wait_for(tracker.warmup_task, 1)
+        return tracker
+
+    tracker = asyncio.run(run())
+    assert tracker.ready
+    assert tracker.warmup_attempts == 2
+    assert tracker.get_status()['warmup_error'] is None
+
+
+def test_backoff_is_capped():
+    async def run():
+        tracker = StartupTracker()
+        tracker.retry_backoff = 0.01
+        tracker.max_retry_backoff = 0.02
+
+        async def warm_up():
+            raise ConnectionError("still down")
+
+        tracker.start_warmup(warm_up)
+        await asyncio.sleep(0.1)
+        tracker.stop()
+        return tracker
+
+    tracker = asyncio.run(run())
+    assert not tracker.ready
+    assert tracker.warmup_attempts >= 4
+    assert tracker.warmup_error == "still down"
+
+
+def test_importing_the_app_defers_sqlparse_and_aiohttp():
+    code = "import sys, main; print('sqlparse' in sys.modules, 'aiohttp' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=60,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert output.stdout.split() == ['False', 'False'], output.stderr
@@ -0,0 +1,31 @@
+import asyncio
+
+from database import DatabaseManager
+from tenants import TenantRegistry
+
+
+def test_control_connections_count_against_the_global_cap(monkeypatch):
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    monkeypatch.setattr(DatabaseManager, "connect", connect)
+    monkeypatch.setattr(DatabaseManager, "disconnect", disconnect)
+    monkeypatch.setenv("TENANTS_FILE", "/nonexistent/tenants.json")
+    monkeypatch.setenv("TENANT_DSN_TEMPLATE", "postgresql://test/plant_{tenant}")
+    monkeypatch.setenv("TENANT_MAX_CONNECTIONS", "12")
+    monkeypatch.setenv("TENANT_POOL_MAX_SIZE", "5")
+
+    async def run():
+        registry = TenantRegistry()
+        for tenant_id in ("a", "b", "c"):
+            await registry.release(await registry.acquire(tenant_id))
+        return registry
+
+    registry = asyncio.run(run())
+    # 5 checkout connections plus 1 control connection per pool: only two pools fit under 12
+    assert sorted(registry.tenants) == ["b", "c"]
+    assert registry.reserved_connections == 12
+    assert registry.stats['evicted_lru'] == 1
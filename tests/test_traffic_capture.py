@@ -0,0 +1,87 @@
+import asyncio
+import gzip
+import json
+import os
+
+import pytest
+
+from traffic_capture import TrafficCapture, LLMReplay, read_capture
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    monkeypatch.setenv("CAPTURE_DIR", str(tmp_path))
+    return TrafficCapture()
+
+
+def entry(n, **fields):
+    return {'ts': n, 'endpoint': '/api/query', 'request': {'question': f"question {n}"}, **fields}
+
+
+def test_batches_append_gzip_members_that_read_back_in_order(capture, tmp_path):
+    capture._write_batch([entry(1), entry(2)])
+    capture._write_batch([entry(3)])
+
+    # One file holding two gzip members
+    assert os.listdir(tmp_path) == [os.path.basename(capture.current_path)]
+    with open(capture.current_path, "rb") as capture_file:
+        assert capture_file.read().count(b"\x1f\x8b\x08") == 2
+    assert [e['ts'] for e in read_capture(capture.current_path)] == [1, 2, 3]
+    assert capture.stats['written'] == 3
+
+
+def test_rotation_prunes_old_files_and_directory_reads_oldest_first(capture, tmp_path):
+    capture.max_file_bytes = 1
+    capture.max_files = 2
+    for n in range(1, 5):
+        capture._write_batch([entry(n)])
+
+    assert len(os.listdir(tmp_path)) == 2
+    assert capture.stats['files_rotated'] == 3
+    assert [e['ts'] for e in read_capture(str(tmp_path))] == [3, 4]
+
+
+def test_close_flushes_queued_entries(capture):
+    async def run():
+        capture.enabled = True
+        capture.start()
+        for n in range(3):
+            capture.finish(capture.begin('/api/query', {'question': f"question {n}"}), success=True)
+        await capture.close()
+
+    asyncio.run(run())
+    entries = list(read_capture(capture.current_path))
+    assert [e['request']['question'] for e in entries] == ["question 0", "question 1", "question 2"]
+    assert all('_started' not in e and e['total_ms'] >= 0 for e in entries)
+
+
+def write_capture(path, entries):
+    with gzip.open(path, "wt", encoding="utf-8") as capture_file:
+        for e in entries:
+            capture_file.write(json.dumps(e) + "\n")
+
+
+def test_replay_serves_repeated_prompts_in_recorded_order(tmp_path):
+    path = str(tmp_path / "capture-1.jsonl.gz")
+    write_capture(path, [
+        entry(1, prompt_hash='abc', llm_response='SELECT 1'),
+        entry(2, prompt_hash='abc', llm_response='SELECT 2'),
+        # Entries without a response, prompt hash or question are skipped or indexed partially
+        entry(3, prompt_hash='def'),
+        {'ts': 4, 'prompt_hash': 'ghi', 'llm_response': 'SELECT 4'},
+        {'ts': 5, 'request': {'question': 'no hash'}, 'llm_response': 'SELECT 5'},
+    ])
+    replay = LLMReplay(path, delay_scale=0)
+
+    async def run():
+        return [
+            await replay.lookup('abc', None),
+            await replay.lookup('abc', None),
+            await replay.lookup('abc', None),
+            await replay.lookup('ghi', None),
+            await replay.lookup('unknown', 'no hash'),
+            await replay.lookup('def', 'question 3'),
+        ]
+
+    assert asyncio.run(run()) == ['SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 4', 'SELECT 5', None]
+    assert replay.stats == {'hits': 5, 'misses': 1}
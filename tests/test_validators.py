@@ -0,0 +1,32 @@
+import pytest
+
+from validators import SQLValidator
+
+
+@pytest.fixture
+def validator():
+    return SQLValidator()
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT 1) TO PROGRAM 'id'",
+    "SELECT 1 FROM machines) TO PROGRAM 'id'; SELECT (1",
+    "SELECT $$($$) TO STDOUT",
+    "SELECT (machine_id FROM machines",
+    "SELECT name FROM machines WHERE name = 'A",
+])
+def test_sql_that_could_escape_a_wrapping_subquery_is_rejected(validator, sql_query):
+    result = validator.validate_query(sql_query)
+    assert not result.is_valid
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT name FROM machines WHERE name = ')' AND (machine_id > 1)",
+    "SELECT COUNT(*) FROM machines WHERE name = 'it''s (x'",
+    "SELECT E'\\')' AS quoted FROM machines",
+    'SELECT "odd)name" FROM machines',
+    "SELECT ROUND(AVG((actual_units)::numeric), 1) FROM production_runs;",
+])
+def test_parentheses_inside_literals_do_not_count(validator, sql_query):
+    result = validator.validate_query(sql_query)
+    assert result.is_valid, result.error_message
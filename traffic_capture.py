@@ -0,0 +1,188 @@
+import os
+import glob
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Iterator
+
+from shared_cache import json_default
+
+logger = logging.getLogger(__name__)
+
+# The capture entry of the request being handled; the LLM layer annotates it with the Groq exchange
+current_capture: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_capture", default=None)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+def annotate(**fields):
+    """Add fields to the current request's capture entry, if traffic is being captured"""
+    entry = current_capture.get()
+    if entry is not None:
+        entry.update(fields)
+
+
+def read_capture(path: str) -> Iterator[Dict[str, Any]]:
+    """Entries of a capture file, or of every capture file in a directory, oldest file first"""
+    paths = sorted(glob.glob(os.path.join(path, "capture-*.jsonl.gz"))) if os.path.isdir(path) else [path]
+    for capture_path in paths:
+        with gzip.open(capture_path, "rt", encoding="utf-8") as capture_file:
+            for line in capture_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class TrafficCapture:
+    """Opt-in capture of /api/query traffic to rotating gzip JSONL files.
+
+    Requests only append to an in-memory queue; a background task writes batches from a thread,
+    and entries are dropped (and counted) rather than slowing requests when the queue is full.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("CAPTURE_TRAFFIC", "").lower() in ("1", "true", "yes")
+        self.directory = os.getenv("CAPTURE_DIR", "captures")
+        self.max_file_bytes = int(os.getenv("CAPTURE_FILE_BYTES", str(16 * 1024 * 1024)))
+        self.max_files = int(os.getenv("CAPTURE_MAX_FILES", "20"))
+        self.flush_interval = float(os.getenv("CAPTURE_FLUSH_INTERVAL", "2"))
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=int(os.getenv("CAPTURE_BUFFER", "1000")))
+        self.current_path: Optional[str] = None
+        self.writer_task: Optional[asyncio.Task] = None
+        self.stats = {'captured': 0, 'dropped': 0, 'written': 0, 'bytes_written': 0, 'files_rotated': 0}
+
+    def start(self):
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self.writer_task = asyncio.create_task(self._run_writer())
+            logger.info(f"Capturing /api/query traffic to {self.directory}")
+
+    async def close(self):
+        """Stop the writer after flushing whatever is still queued"""
+        if self.writer_task:
+            self.writer_task.cancel()
+            await asyncio.gather(self.writer_task, return_exceptions=True)
+            batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if batch:
+                await asyncio.to_thread(self._write_batch, batch)
+
+    def begin(self, endpoint: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Start an entry for this request and make it the current one"""
+        if not self.enabled:
+            return None
+        entry = {
+            'ts': time.time(),
+            'captured_at': datetime.now(timezone.utc).isoformat(),
+            'endpoint': endpoint,
+            'request': request,
+            '_started': time.monotonic()
+        }
+        current_capture.set(entry)
+        return entry
+
+    def finish(self, entry: Optional[Dict[str, Any]], **fields):
+        """Complete the entry with the outcome and timings and queue it for writing"""
+        if entry is None:
+            return
+        entry.update(fields)
+        entry['total_ms'] = round((time.monotonic() - entry.pop('_started')) * 1000, 2)
+        try:
+            self.queue.put_nowait(entry)
+            self.stats['captured'] += 1
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+
+    async def _run_writer(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Collect what arrives within the flush interval so files are written in batches
+            deadline = time.monotonic() + self.flush_interval
+            while time.monotonic() < deadline:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} captured requests: {e}")
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        if not self.current_path or os.path.getsize(self.current_path) >= self.max_file_bytes:
+            self._rotate()
+        data = "".join(json.dumps(entry, default=json_default) + "\n" for entry in batch).encode()
+        # Each batch is its own gzip member; gzip readers concatenate members transparently
+        with gzip.open(self.current_path, "ab") as capture_file:
+            capture_file.write(data)
+        self.stats['written'] += len(batch)
+        self.stats['bytes_written'] += len(data)
+
+    def _rotate(self):
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self.current_path = os.path.join(self.directory, f"capture-{stamp}-{os.getpid()}.jsonl.gz")
+        if self.stats['written']:
+            self.stats['files_rotated'] += 1
+        files = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl.gz")))
+        for old_path in files[:max(0, len(files) - self.max_files + 1)]:
+            os.remove(old_path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'queued': self.queue.qsize(),
+            'current_file': self.current_path
+        }
+
+
+class LLMReplay:
+    """Serves Groq responses recorded in a capture, keyed by prompt hash and falling back to the question.
+
+    A prompt recorded several times replays its responses in recorded order, wrapping around.
+    """
+
+    def __init__(self, path: str, delay_scale: float = 1.0):
+        self.by_prompt: Dict[str, deque] = defaultdict(deque)
+        self.by_question: Dict[str, deque] = defaultdict(deque)
+        self.delay_scale = delay_scale
+        self.stats = {'hits': 0, 'misses': 0}
+        recorded = 0
+        for entry in read_capture(path):
+            if entry.get('llm_response') is None:
+                continue
+            recorded += 1
+            if entry.get('prompt_hash'):
+                self.by_prompt[entry['prompt_hash']].append(entry)
+            question = (entry.get('request') or {}).get('question')
+            if question:
+                self.by_question[question].append(entry)
+        logger.info(f"Replaying {recorded} recorded LLM responses ({len(self.by_prompt)} prompts) from {path}")
+
+    @classmethod
+    def from_env(cls) -> Optional["LLMReplay"]:
+        path = os.getenv("LLM_REPLAY_PATH")
+        if not path:
+            return None
+        return cls(path, float(os.getenv("LLM_REPLAY_DELAY_SCALE", "1")))
+
+    async def lookup(self, prompt_digest: str, question: Optional[str]) -> Optional[str]:
+        """The recorded response, after the recorded LLM latency scaled by LLM_REPLAY_DELAY_SCALE"""
+        entries = self.by_prompt.get(prompt_digest) or self.by_question.get(question)
+        if not entries:
+            self.stats['misses'] += 1
+            return None
+        entry = entries[0]
+        entries.rotate(-1)
+        self.stats['hits'] += 1
+        if self.delay_scale > 0:
+            await asyncio.sleep(entry.get('llm_ms', 0) / 1000 * self.delay_scale)
+        return entry['llm_response']
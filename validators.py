@@ -8,14 +8,22 @@ from models import ValidationResult, QueryType
 
 logger = logging.getLogger(__name__)
 
+# String literals and quoted identifiers, whose contents don't count as SQL structure:
+# E'' strings (backslash escapes), dollar-quoted strings, '' strings and "" identifiers
+QUOTED_PATTERN = re.compile(
+    r"(?<!\w)[Ee]'(?:[^'\\]|\\.|'')*'|\$(\w*)\$.*?\$\1\$|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"",
+    re.DOTALL
+)
+
 class SQLValidator:
     def __init__(self):
         # Define dangerous operations that should be blocked
         self.dangerous_keywords = {
-            'DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE'
+            'DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE', 'COPY'
         }
         
         # Define dangerous functions and operations
+        # (CSV export wraps queries in COPY server-side; user SQL may never use it)
         self.dangerous_functions = {
             'pg_sleep', 'pg_read_file', 'pg_ls_dir', 'pg_stat_file',
             'copy', 'lo_import', 'lo_export', 'dblink', 'dblink_exec'
@@ -71,12 +79,20 @@ class SQLValidator:
                 return pattern_check
             
             # Check for multiple statements (SQL injection prevention)
-            if self._has_multiple_statements(parsed_query):
+            if len([s for s in parsed if str(s).strip()]) > 1 or self._has_multiple_statements(parsed_query):
                 return ValidationResult(
                     is_valid=False,
                     error_message="Multiple SQL statements are not allowed"
                 )
             
+            # Unbalanced parentheses could close the subquery CSV export wraps the query in
+            if not self._has_balanced_parentheses(sql_query):
+                return ValidationResult(
+                    is_valid=False,
+                    error_message="Unbalanced parentheses or quotes in SQL query",
+                    potentially_dangerous=True
+                )
+            
             # Determine query type
             query_type = self._get_query_type(parsed_query)
             
@@ -183,6 +199,22 @@ class SQLValidator:
         
         return semicolon_count > 0 or keyword_count > 1
     
+    def _has_balanced_parentheses(self, sql_query: str) -> bool:
+        """Check that quotes are terminated and parentheses outside them pair up"""
+        unquoted = QUOTED_PATTERN.sub("''", sql_query)
+        if "'" in unquoted.replace("''", "") or '"' in unquoted:
+            # An unterminated literal or identifier
+            return False
+        depth = 0
+        for char in unquoted:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth < 0:
+                    return False
+        return depth == 0
+    
     def _get_query_type(self, parsed_query) -> QueryType:
         """Determine the type of SQL query"""
         # Handle WITH clauses (CTEs) - they are SELECT queries